@@ -0,0 +1,112 @@
+"""Decoding an action: JSON vs. the binary format of dapp.actions.
+
+For each method a set of random actions is encoded both ways. The JSON
+side is timed as handle_action uses it, json.loads followed by int() and
+checksum_address() on the args; the binary side through decode_action,
+and through eth_abi.decode for reference. The mean encoded size of each
+form is printed below the timings.
+
+    python benchmarks/bench_actions.py --actions 20000
+"""
+
+import argparse
+import json
+import random
+
+from common import measure, print_results, summarize, write_json
+from payloads import json_action
+
+from eth_abi import decode
+
+from dapp.actions import ACTION_TYPES, decode_action, encode_action
+from dapp.util import checksum_address
+
+
+def random_args(rng, types, addresses):
+    args = {}
+    for name, abi_type in types:
+        if abi_type == "address":
+            args[name] = rng.choice(addresses)
+        elif abi_type == "uint64":
+            args[name] = rng.randrange(2**32)
+        else:
+            args[name] = rng.randrange(10**24)
+    return args
+
+
+def json_decode(encoded, types):
+    payload = json.loads(encoded)
+    args = payload["args"]
+    return {
+        "method": payload["method"],
+        "args": {
+            name: (
+                checksum_address(args[name])
+                if abi_type == "address"
+                else int(args[name])
+            )
+            for name, abi_type in types
+        },
+    }
+
+
+def eth_abi_decode(encoded, method, types):
+    values = decode([abi_type for _, abi_type in types], encoded[2:])
+    return {
+        "method": method,
+        "args": {
+            name: checksum_address(value) if abi_type == "address" else value
+            for (name, abi_type), value in zip(types, values)
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--actions", type=int, default=20_000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    addresses = [checksum_address(f"0x{rng.getrandbits(160):040x}") for _ in range(500)]
+    results = {}
+    sizes = {}
+    for method, types in ACTION_TYPES.values():
+        actions = [random_args(rng, types, addresses) for _ in range(args.actions)]
+        as_json = [json_action(method, action) for action in actions]
+        as_binary = [encode_action(method, action) for action in actions]
+        assert all(
+            json_decode(j, types)
+            == decode_action(b)
+            == eth_abi_decode(b, method, types)
+            for j, b in zip(as_json, as_binary)
+        )
+
+        results[f"{method}, JSON"] = summarize(
+            measure(lambda i: json_decode(as_json[i], types), args.actions)
+        )
+        results[f"{method}, binary"] = summarize(
+            measure(lambda i: decode_action(as_binary[i]), args.actions)
+        )
+        results[f"{method}, binary via eth_abi"] = summarize(
+            measure(lambda i: eth_abi_decode(as_binary[i], method, types), args.actions)
+        )
+        sizes[method] = {
+            "json_bytes": sum(map(len, as_json)) / args.actions,
+            "binary_bytes": sum(map(len, as_binary)) / args.actions,
+        }
+
+    print_results("action decode", results)
+    print("mean encoded size")
+    for method, row in sizes.items():
+        print(
+            f"  {method:<40} JSON {row['json_bytes']:>6.0f} bytes"
+            f"  binary {row['binary_bytes']:>6.0f} bytes"
+        )
+    if args.json:
+        write_json(args.json, {"results": results, "sizes": sizes})
+
+
+if __name__ == "__main__":
+    main()
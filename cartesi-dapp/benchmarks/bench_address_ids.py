@@ -0,0 +1,232 @@
+"""Row size, index size and query latency with TEXT addresses vs. INTEGER ids.
+
+A database at the last schema with TEXT address columns is filled with
+--streams streams between --wallets wallets and one balance row per wallet
+and token. The size of each table and index, and the average bytes per
+row, are read from dbstat and the hot stream and balance queries are timed.
+Then migrate_db() moves it to account ids and the same is measured again,
+both for the bare SQL on ids and for the dapp.db helpers, which also turn
+addresses into ids and back through the connection's AddressBook.
+
+    python benchmarks/bench_address_ids.py --streams 1000000 --wallets 100000
+"""
+
+import argparse
+import os
+import random
+import time
+
+from common import measure, print_results, summarize, use_temp_db, write_json
+
+from dapp.addresses import get_address_id
+from dapp.db import (
+    get_user_shares,
+    get_wallet_non_accrued_streamed_amts,
+    get_wallet_streams,
+)
+from dapp.util import checksum_address, int_to_bytes32, int_to_signed_bytes32
+from sqlite import MIGRATIONS, migrate_db, migrate_address_ids
+from tests.utils import create_legacy_db
+
+TOKENS = [checksum_address(f"0x{i:040x}") for i in range(2**159, 2**159 + 4)]
+TABLES = ("account", "token", "balance", "stream")
+
+QUERIES = {
+    "live_streams": """
+        SELECT start_timestamp, duration, amount, 0 FROM stream
+        WHERE {from_} = ? AND {token} = ? AND accrued = 0 AND {to} != ?
+        UNION ALL
+        SELECT start_timestamp, duration, amount, 1 FROM stream
+        WHERE {to} = ? AND {token} = ? AND accrued = 0
+        """,
+    "wallet_streams": """
+        SELECT * FROM stream WHERE {from_} = ? AND {token} = ?
+        UNION ALL
+        SELECT * FROM stream WHERE {to} = ? AND {token} = ? AND {from_} != ?
+        """,
+    "shares": """
+        SELECT shares FROM balance WHERE {account} = ? AND {token} = ?
+        """,
+}
+PARAMS = {
+    "live_streams": lambda w, t: (w, t, w, w, t),
+    "wallet_streams": lambda w, t: (w, t, w, t, w),
+    "shares": lambda w, t: (w, t),
+}
+HELPERS = {
+    "live_streams": lambda c, w, t: sum(
+        get_wallet_non_accrued_streamed_amts(c, w, t, 2**62, 2**62)
+    ),
+    "wallet_streams": lambda c, w, t: get_wallet_streams(c, w, t),
+    "shares": lambda c, w, t: get_user_shares(c, w, t),
+}
+TEXT_COLUMNS = dict(
+    from_="from_address",
+    to="to_address",
+    token="token_address",
+    account="account_address",
+)
+ID_COLUMNS = dict(from_="from_id", to="to_id", token="token_id", account="account_id")
+
+
+def create_text_address_db():
+    """Database at the schema right before migrate_address_ids."""
+    connection = create_legacy_db()
+    cursor = connection.cursor()
+    last = MIGRATIONS.index(migrate_address_ids)
+    for version, migration in enumerate(MIGRATIONS[:last], start=1):
+        migration(cursor)
+        cursor.execute(f"PRAGMA user_version = {version}")
+    connection.commit()
+    return connection
+
+
+def fill(connection, streams, wallets, accrued_ratio, seed):
+    rng = random.Random(seed)
+    addresses = [checksum_address(f"0x{i:040x}") for i in range(1, wallets + 1)]
+    connection.executemany(
+        "INSERT INTO account (address) VALUES (?)",
+        [(address,) for address in addresses + TOKENS],
+    )
+    connection.executemany(
+        "INSERT INTO token (address, total_assets, total_shares) VALUES (?, ?, ?)",
+        [(token, int_to_bytes32(10**24), int_to_bytes32(10**24)) for token in TOKENS],
+    )
+    connection.executemany(
+        """
+        INSERT INTO balance (shares, account_address, token_address)
+        VALUES (?, ?, ?)
+        """,
+        [
+            (int_to_signed_bytes32(rng.randrange(1, 10**21)), address, token)
+            for address in addresses
+            for token in TOKENS
+        ],
+    )
+    batch = []
+    for i in range(streams):
+        sender, receiver = rng.sample(addresses, 2)
+        start = rng.randrange(0, 1_000_000)
+        duration = rng.randrange(1, 100_000)
+        batch.append(
+            (
+                sender,
+                receiver,
+                start,
+                duration,
+                int_to_bytes32(rng.randrange(1, 10**21)),
+                rng.choice(TOKENS),
+                1 if rng.random() < accrued_ratio else 0,
+                start + duration,
+            )
+        )
+        if len(batch) == 50_000 or i == streams - 1:
+            connection.executemany(
+                """
+                INSERT INTO stream (from_address, to_address, start_timestamp, duration, amount, token_address, accrued, end_timestamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                batch,
+            )
+            batch = []
+    connection.commit()
+    return addresses
+
+
+def sizes(connection):
+    """{name: (MB, bytes per row)} of each table and index of TABLES."""
+    tables = {
+        row[0]: row[1]
+        for row in connection.execute(
+            "SELECT name, tbl_name FROM sqlite_master WHERE type IN ('table', 'index')"
+        )
+    }
+    result = {}
+    for name, size, payload, cells in connection.execute(
+        """
+        SELECT name, SUM(pgsize), SUM(CASE WHEN pagetype = 'leaf' THEN payload END),
+            SUM(CASE WHEN pagetype = 'leaf' THEN ncell END)
+        FROM dbstat GROUP BY name
+        """
+    ):
+        if tables.get(name) in TABLES:
+            result[name] = (size / 2**20, (payload or 0) / cells if cells else 0.0)
+    return result
+
+
+def time_queries(connection, probes, columns, label, results):
+    for name, sql in QUERIES.items():
+        sql = sql.format(**columns)
+        results[f"{name} ({label})"] = summarize(
+            measure(
+                lambda i: connection.execute(sql, PARAMS[name](*probes[i])).fetchall(),
+                len(probes),
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streams", type=int, default=1_000_000)
+    parser.add_argument("--wallets", type=int, default=10_000)
+    parser.add_argument("--accrued-ratio", type=float, default=0.5)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    db_file_path = use_temp_db("address-ids")
+    connection = create_text_address_db()
+    start = time.perf_counter()
+    addresses = fill(
+        connection, args.streams, args.wallets, args.accrued_ratio, args.seed
+    )
+    print(f"Inserted {args.streams} streams in {time.perf_counter() - start:.1f}s")
+    connection.execute("VACUUM")
+    file_mb = {"text": os.path.getsize(db_file_path) / 2**20}
+
+    rng = random.Random(args.seed)
+    probes = [(rng.choice(addresses), rng.choice(TOKENS)) for _ in range(args.queries)]
+
+    results = {}
+    measured = {"text": sizes(connection)}
+    time_queries(connection, probes, TEXT_COLUMNS, "text", results)
+
+    start = time.perf_counter()
+    migrate_db(connection)
+    print(f"Migrated to account ids in {time.perf_counter() - start:.1f}s")
+    connection.execute("VACUUM")
+    file_mb["ids"] = os.path.getsize(db_file_path) / 2**20
+    measured["ids"] = sizes(connection)
+    id_probes = [
+        (get_address_id(connection, wallet), get_address_id(connection, token))
+        for wallet, token in probes
+    ]
+    time_queries(connection, id_probes, ID_COLUMNS, "ids", results)
+    for name, helper in HELPERS.items():
+        results[f"{name} (dapp.db helper)"] = summarize(
+            measure(lambda i: helper(connection, *probes[i]), len(probes))
+        )
+    connection.close()
+
+    print_results(f"stream and balance queries, {args.streams} streams", results)
+    print(f"  {'size in MB, bytes per row':<40} {'text':>18} -> {'ids':>18}")
+    for name in sorted(set(measured["text"]) | set(measured["ids"])):
+        text_mb, text_row = measured["text"].get(name, (0, 0))
+        ids_mb, ids_row = measured["ids"].get(name, (0, 0))
+        print(
+            f"  {name:<40} {text_mb:>9.1f} {text_row:>8.1f}"
+            f" -> {ids_mb:>9.1f} {ids_row:>8.1f}"
+        )
+    print(
+        f"  {'database file after VACUUM':<40} {file_mb['text']:>9.1f}"
+        f" -> {file_mb['ids']:>18.1f}"
+    )
+    if args.json:
+        write_json(
+            args.json, {"results": results, "sizes": measured, "file_mb": file_mb}
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Encode/decode throughput of the decimal TEXT and 32-byte BLOB amount codecs.
+
+Times the bare conversions and a round trip of amount rows through SQLite.
+
+    python benchmarks/bench_amount_codec.py --values 200000
+"""
+
+import argparse
+import random
+import sqlite3
+import time
+
+import common  # noqa: F401  (puts the dapp on sys.path)
+
+from dapp.util import bytes32_to_int, int_to_bytes32, int_to_str, str_to_int
+
+CODECS = {
+    "text": (int_to_str, str_to_int, "TEXT"),
+    "blob": (int_to_bytes32, bytes32_to_int, "BLOB"),
+}
+
+
+def rate(count, seconds):
+    return f"{count / seconds / 1e6:6.2f} M/s"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--values", type=int, default=200_000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    values = [rng.randrange(0, 10**24) for _ in range(args.values)]
+
+    for name, (encode, decode, column_type) in CODECS.items():
+        start = time.perf_counter()
+        encoded = [encode(value) for value in values]
+        encode_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        decoded = [decode(value) for value in encoded]
+        decode_s = time.perf_counter() - start
+        assert decoded == values
+
+        connection = sqlite3.connect(":memory:")
+        connection.execute(f"CREATE TABLE amounts (amount {column_type} NOT NULL)")
+        start = time.perf_counter()
+        connection.executemany(
+            "INSERT INTO amounts (amount) VALUES (?)",
+            ((encode(value),) for value in values),
+        )
+        write_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        total = sum(
+            decode(row[0]) for row in connection.execute("SELECT amount FROM amounts")
+        )
+        read_s = time.perf_counter() - start
+        assert total == sum(values)
+        size = connection.execute("SELECT SUM(length(amount)) FROM amounts").fetchone()[
+            0
+        ]
+        connection.close()
+
+        print(
+            f"{name}: encode {rate(len(values), encode_s)}"
+            f"  decode {rate(len(values), decode_s)}"
+            f"  row write {rate(len(values), write_s)}"
+            f"  row read {rate(len(values), read_s)}"
+            f"  {size / len(values):.1f} bytes/value"
+        )
+
+
+if __name__ == "__main__":
+    main()
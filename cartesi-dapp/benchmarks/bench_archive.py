@@ -0,0 +1,173 @@
+"""Stream table and index size, and query latency, before and after archiving.
+
+The stream table is filled with --streams rows of which --accrued-ratio are
+accrued. The hot stream queries are timed and the size of stream and of
+each of its indexes is read from dbstat. Then archive_accrued_streams moves
+the accrued rows to stream_archive in batches of --batch, and the sizes and
+queries are measured again, together with the full history read that
+includes the archive.
+
+    python benchmarks/bench_archive.py --streams 10000000 --wallets 100000
+"""
+
+import argparse
+import os
+import random
+import time
+
+from common import measure, print_results, summarize, use_temp_db, write_json
+
+from dapp.db import (
+    archive_accrued_streams,
+    create_account_if_not_exists,
+    create_token_if_not_exists,
+    get_connection,
+    get_max_end_timestamp_for_wallet,
+    get_wallet_endend_streams,
+    get_wallet_non_accrued_streamed_amts,
+    get_wallet_streams,
+)
+from dapp.util import int_to_bytes32
+
+TOKENS = [f"0x{i:040x}" for i in range(0xA0, 0xA4)]
+
+QUERIES = {
+    "non_accrued_streamed_amts": lambda c, w, t, ts: sum(
+        get_wallet_non_accrued_streamed_amts(c, w, t, ts, ts)
+    ),
+    "endend_streams": lambda c, w, t, ts: get_wallet_endend_streams(c, w, t, ts),
+    "wallet_streams": lambda c, w, t, ts: get_wallet_streams(c, w, t),
+    "max_end_timestamp": lambda c, w, t, ts: get_max_end_timestamp_for_wallet(c, w),
+}
+
+
+def fill(connection, streams, wallets, accrued_ratio, seed):
+    rng = random.Random(seed)
+    addresses = [f"0x{i:040x}" for i in range(1, wallets + 1)]
+    ids = [create_account_if_not_exists(connection, address) for address in addresses]
+    token_ids = [create_token_if_not_exists(connection, token) for token in TOKENS]
+    batch = []
+    for i in range(streams):
+        sender, receiver = rng.sample(ids, 2)
+        start = rng.randrange(0, 1_000_000)
+        duration = rng.randrange(0, 100_000)
+        batch.append(
+            (
+                sender,
+                receiver,
+                start,
+                duration,
+                int_to_bytes32(rng.randrange(1, 10**21)),
+                rng.choice(token_ids),
+                1 if rng.random() < accrued_ratio else 0,
+                start + duration,
+            )
+        )
+        if len(batch) == 50_000 or i == streams - 1:
+            connection.executemany(
+                """
+                INSERT INTO stream (from_id, to_id, start_timestamp, duration, amount, token_id, accrued, end_timestamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                batch,
+            )
+            batch = []
+    connection.commit()
+    return addresses
+
+
+def sizes_mb(connection):
+    """MB used by stream and stream_archive, each with its indexes."""
+    tables = {
+        row[0]: row[1]
+        for row in connection.execute(
+            "SELECT name, tbl_name FROM sqlite_master WHERE type IN ('table', 'index')"
+        )
+    }
+    sizes = {}
+    for name, size in connection.execute(
+        "SELECT name, SUM(pgsize) FROM dbstat GROUP BY name"
+    ):
+        if tables.get(name) in ("stream", "stream_archive"):
+            sizes[name] = size / 2**20
+    return sizes
+
+
+def time_queries(connection, probes, label, results):
+    for name, query in QUERIES.items():
+        results[f"{name} ({label})"] = summarize(
+            measure(lambda i: query(connection, *probes[i]), len(probes))
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streams", type=int, default=1_000_000)
+    parser.add_argument("--wallets", type=int, default=10_000)
+    parser.add_argument("--accrued-ratio", type=float, default=0.9)
+    parser.add_argument("--batch", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    db_file_path = use_temp_db("archive")
+    connection = get_connection()
+    start = time.perf_counter()
+    addresses = fill(
+        connection, args.streams, args.wallets, args.accrued_ratio, args.seed
+    )
+    print(f"Inserted {args.streams} streams in {time.perf_counter() - start:.1f}s")
+
+    rng = random.Random(args.seed)
+    probes = [
+        (rng.choice(addresses), rng.choice(TOKENS), rng.randrange(0, 1_100_000))
+        for _ in range(args.queries)
+    ]
+
+    results = {}
+    sizes = {"before": sizes_mb(connection)}
+    time_queries(connection, probes, "before", results)
+
+    batches = []
+    while True:
+        start = time.perf_counter()
+        archived = archive_accrued_streams(connection, args.batch)
+        connection.commit()
+        if not archived:
+            break
+        batches.append(time.perf_counter() - start)
+    print(
+        f"Archived in {len(batches)} batches of up to {args.batch} rows,"
+        f" {sum(batches):.1f}s in total"
+    )
+    results[f"archive batch of {args.batch}"] = summarize(batches)
+
+    sizes["after"] = sizes_mb(connection)
+    time_queries(connection, probes, "after", results)
+    results["wallet_streams with archive (after)"] = summarize(
+        measure(
+            lambda i: get_wallet_streams(
+                connection, probes[i][0], probes[i][1], include_archived=True
+            ),
+            len(probes),
+        )
+    )
+    connection.execute("VACUUM")
+    file_mb = os.path.getsize(db_file_path) / 2**20
+    connection.close()
+
+    print_results(f"stream queries, {args.streams} streams", results)
+    print("size in MB")
+    for name in sorted(set(sizes["before"]) | set(sizes["after"])):
+        print(
+            f"  {name:<40} {sizes['before'].get(name, 0):>10.1f}"
+            f" -> {sizes['after'].get(name, 0):>10.1f}"
+        )
+    print(f"  {'database file after VACUUM':<40} {file_mb:>10.1f}")
+    if args.json:
+        write_json(args.json, {"results": results, "sizes_mb": sizes})
+
+
+if __name__ == "__main__":
+    main()
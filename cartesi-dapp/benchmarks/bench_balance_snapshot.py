@@ -0,0 +1,114 @@
+"""Token-wide balances: balance_of per wallet vs. token_holder_snapshot.
+
+The indexer and the total supply check used to call balance_of once per
+holder, each running its own share, token-total and stream queries.
+token_holder_snapshot reads balance, token and the live stream rows of the
+token once. For each holder count the token gets that many minted wallets
+and streams between them, then both ways of reading every balance are timed
+and checked to agree.
+
+    python benchmarks/bench_balance_snapshot.py --holders 1000 10000 50000
+"""
+
+import argparse
+import random
+
+from common import measure, print_results, summarize, use_temp_db, write_json
+
+from dapp.db import (
+    ConnectionManager,
+    create_account_if_not_exists,
+    create_token_if_not_exists,
+)
+from dapp.streamrebasetoken import StreamRebaseToken
+from dapp.util import checksum_address, int_to_bytes32
+
+TOKEN = "0x1234567890AbcdEF1234567890ABCDEF12345673"
+NOW = 1_000_000
+
+
+def fill(connection, holders, streams_per_holder, seed):
+    rng = random.Random(seed)
+    wallets = [checksum_address(f"0x{i:040x}") for i in range(1, holders + 1)]
+    token = StreamRebaseToken(connection, TOKEN)
+    for wallet in wallets:
+        token.mint_assets(10**24, wallet)
+    ids = [create_account_if_not_exists(connection, wallet) for wallet in wallets]
+    token_id = create_token_if_not_exists(connection, TOKEN)
+    rows = []
+    for _ in range(holders * streams_per_holder):
+        start = rng.randrange(0, 2 * NOW)
+        duration = rng.randrange(1, NOW)
+        rows.append(
+            (
+                rng.choice(ids),
+                rng.choice(ids),
+                start,
+                duration,
+                int_to_bytes32(rng.randrange(1, 10**18)),
+                token_id,
+                0,
+                start + duration,
+            )
+        )
+    connection.executemany(
+        """
+        INSERT INTO stream (from_id, to_id, start_timestamp, duration, amount, token_id, accrued, end_timestamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        rows,
+    )
+    return wallets
+
+
+def run(holders, streams_per_holder, iterations, seed):
+    use_temp_db(f"balance-snapshot-{holders}")
+    manager = ConnectionManager()
+    with manager.advance() as connection:
+        wallets = fill(connection, holders, streams_per_holder, seed)
+
+    token = StreamRebaseToken(manager.connection, TOKEN)
+    per_wallet = {wallet: token.balance_of(wallet, NOW) for wallet in wallets}
+    assert token.balance_of_many(wallets, NOW) == per_wallet
+    assert token.token_holder_snapshot(NOW) == per_wallet
+
+    results = {
+        f"balance_of loop, {holders} holders": summarize(
+            measure(
+                lambda i: [token.balance_of(wallet, NOW) for wallet in wallets],
+                iterations,
+            )
+        ),
+        f"balance_of_many, {holders} holders": summarize(
+            measure(lambda i: token.balance_of_many(wallets, NOW), iterations)
+        ),
+        f"token_holder_snapshot, {holders} holders": summarize(
+            measure(lambda i: token.token_holder_snapshot(NOW), iterations)
+        ),
+    }
+    manager.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--holders", type=int, nargs="+", default=[1_000, 10_000])
+    parser.add_argument("--streams-per-holder", type=int, default=4)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    for holders in args.holders:
+        results.update(
+            run(holders, args.streams_per_holder, args.iterations, args.seed)
+        )
+
+    print_results("every holder's balance of one token", results)
+    if args.json:
+        write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
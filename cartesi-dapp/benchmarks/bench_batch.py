@@ -0,0 +1,142 @@
+"""Paying many recipients: one stream input each vs. batch inputs.
+
+A payroll sender with live streams of its own pays --recipients wallets,
+once with a stream input per recipient and once with batch inputs of up to
+MAX_BATCH_ACTIONS stream actions. Every input goes through handle_advance
+as in bench_pipeline, so decoding, settlement, the funds check and the
+report are paid once per input. Each round is timed as a whole and divided
+by the number of recipients; the number of inputs and their payload bytes,
+which is what the sender pays for on L1, are printed alongside.
+
+    python benchmarks/bench_batch.py --recipients 10 100 1000
+"""
+
+import argparse
+import logging
+import time
+
+from bench_pipeline import Pipeline, StubSession
+from common import print_results, summarize, use_temp_db, write_json
+from payloads import json_action
+
+from dapp.db import get_connection_manager
+from dapp.rollup import RollupClient, set_rollup_client
+from dapp.util import MAX_BATCH_ACTIONS
+
+TRANSFER_AMOUNT = 10**15
+DURATION = 30 * 24 * 3600
+
+
+def payload_bytes(request) -> int:
+    return (len(request["payload"]) - 2) // 2
+
+
+def stream_args(pipeline: Pipeline, receiver: str):
+    return {
+        "token": pipeline.tokens[0],
+        "receiver": receiver,
+        "amount": str(TRANSFER_AMOUNT),
+        "duration": str(DURATION),
+        "start": "0",
+    }
+
+
+def single_inputs(pipeline: Pipeline, sender: str, receivers):
+    return [
+        pipeline.wrapper_request(
+            sender, json_action("stream", stream_args(pipeline, receiver))
+        )
+        for receiver in receivers
+    ]
+
+
+def batch_inputs(pipeline: Pipeline, sender: str, receivers):
+    inputs = []
+    for i in range(0, len(receivers), MAX_BATCH_ACTIONS):
+        actions = [
+            {"method": "stream", "args": stream_args(pipeline, receiver)}
+            for receiver in receivers[i : i + MAX_BATCH_ACTIONS]
+        ]
+        inputs.append(
+            pipeline.wrapper_request(sender, json_action("batch", {"actions": actions}))
+        )
+    return inputs
+
+
+def time_inputs(pipeline: Pipeline, inputs) -> float:
+    start = time.perf_counter()
+    for request in inputs:
+        pipeline.advance(request)
+    return time.perf_counter() - start
+
+
+def run(recipients: int, streams: int, rounds: int, seed: int):
+    use_temp_db(f"batch-{recipients}")
+    pipeline = Pipeline(recipients + 1, 1, seed)
+    sender, receivers = pipeline.wallets[0], pipeline.wallets[1:]
+    pipeline.setup(0, 0)
+    # Live streams of the sender that settlement and the funds check face
+    background = [receivers[i % recipients] for i in range(streams)]
+    for request in batch_inputs(pipeline, sender, background):
+        pipeline.advance(request)
+
+    samples = {"stream inputs": [], "batch inputs": []}
+    sizes = {}
+    for _ in range(rounds):
+        for name, build in (
+            ("stream inputs", single_inputs),
+            ("batch inputs", batch_inputs),
+        ):
+            inputs = build(pipeline, sender, receivers)
+            sizes[name] = (len(inputs), sum(payload_bytes(r) for r in inputs))
+            samples[name].append(time_inputs(pipeline, inputs) / recipients)
+    if pipeline.rejected:
+        raise SystemExit(f"{pipeline.rejected} inputs were rejected")
+    get_connection_manager().close()
+
+    results = {
+        f"{name}, {recipients} recipients": summarize(values)
+        for name, values in samples.items()
+    }
+    inputs = {
+        f"{name}, {recipients} recipients": {"inputs": count, "payload_bytes": size}
+        for name, (count, size) in sizes.items()
+    }
+    return results, inputs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--recipients", type=int, nargs="+", default=[10, 100, 1_000])
+    parser.add_argument(
+        "--streams", type=int, default=1_000, help="live streams of the sender"
+    )
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    set_rollup_client(RollupClient(session=StubSession()))
+
+    results = {}
+    inputs = {}
+    for recipients in args.recipients:
+        run_results, run_inputs = run(recipients, args.streams, args.rounds, args.seed)
+        results.update(run_results)
+        inputs.update(run_inputs)
+
+    print_results("time per recipient paid", results)
+    print("inputs per round")
+    for name, row in inputs.items():
+        print(
+            f"  {name:<40} {row['inputs']:>6} inputs {row['payload_bytes']:>10} bytes"
+        )
+    if args.json:
+        write_json(
+            args.json, {"config": vars(args), "inputs": inputs, "results": results}
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""keccak calls and latency per transfer spent on address checksumming.
+
+Every StreamRebaseToken method and the hook are wrapped by
+with_checksum_address, and address_or_raise validates the checksum again.
+eth_utils hashes the address with keccak each time it checksums one.
+
+The legacy run swaps in the old per-call to_checksum_address, with the raw
+payload strings passed straight to the token. The cached run normalizes
+once, the way handle_action now does, and relies on the ChecksumAddress
+fast path and the LRU cache.
+
+    python benchmarks/bench_checksum.py --transfers 1000
+"""
+
+import argparse
+
+import eth_utils.address
+from common import measure, print_results, summarize, use_temp_db, write_json
+from eth_utils import is_checksum_address, is_hex_address, to_checksum_address
+
+import dapp.streamrebasetoken
+import dapp.util
+from dapp.db import ConnectionManager
+from dapp.streamrebasetoken import StreamRebaseToken
+
+TOKEN = "0x1234567890abcdef1234567890abcdef12345673"
+WALLETS = ["0x" + f"{i:02x}" * 20 for i in range(1, 33)]
+
+
+class KeccakCounter:
+    def __init__(self, keccak):
+        self.keccak = keccak
+        self.calls = 0
+
+    def __call__(self, *args, **kwargs):
+        self.calls += 1
+        return self.keccak(*args, **kwargs)
+
+
+def legacy_checksum_address(value):
+    return to_checksum_address(value) if is_hex_address(value) else value
+
+
+def legacy_address_or_raise(address):
+    if not is_checksum_address(address):
+        raise ValueError(f"Invalid address {address}")
+    return address
+
+
+def run(name, transfers, normalize):
+    use_temp_db(f"checksum-{name}")
+    manager = ConnectionManager()
+    with manager.advance() as connection:
+        token = StreamRebaseToken(connection, TOKEN)
+        for wallet in WALLETS:
+            token.mint_assets(10**18, wallet)
+
+    def transfer(i):
+        with manager.advance() as connection:
+            StreamRebaseToken(connection, normalize(TOKEN)).transfer(
+                receiver=normalize(WALLETS[(i + 1) % len(WALLETS)]),
+                amount=1000,
+                duration=100,
+                start_timestamp=i,
+                sender=normalize(WALLETS[i % len(WALLETS)]),
+                current_timestamp=i,
+            )
+
+    counter = KeccakCounter(eth_utils.address.keccak)
+    eth_utils.address.keccak = counter
+    try:
+        summary = summarize(measure(transfer, transfers))
+    finally:
+        eth_utils.address.keccak = counter.keccak
+    manager.close()
+    summary["keccak_per_transfer"] = counter.calls / transfers
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--transfers", type=int, default=1000)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    cached_checksum_address = dapp.util.checksum_address
+    cached_address_or_raise = dapp.streamrebasetoken.address_or_raise
+    dapp.util.checksum_address = legacy_checksum_address
+    dapp.streamrebasetoken.address_or_raise = legacy_address_or_raise
+    try:
+        results = {"transfer (legacy)": run("legacy", args.transfers, lambda a: a)}
+    finally:
+        dapp.util.checksum_address = cached_checksum_address
+        dapp.streamrebasetoken.address_or_raise = cached_address_or_raise
+    results["transfer (cached)"] = run(
+        "cached", args.transfers, cached_checksum_address
+    )
+
+    print_results("transfer address checksumming", results)
+    for name, summary in results.items():
+        print(f"  {name:<40} {summary['keccak_per_transfer']:>10.2f} keccak/op")
+    if args.json:
+        write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
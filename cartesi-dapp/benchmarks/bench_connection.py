@@ -0,0 +1,72 @@
+"""Per-input fixed cost of opening the database vs. the long-lived manager.
+
+Run from the cartesi-dapp directory:
+
+    python benchmarks/bench_connection.py --inputs 2000
+"""
+
+import argparse
+
+from common import measure, print_results, summarize, use_temp_db
+
+from dapp.db import ConnectionManager, get_connection
+from dapp.streamrebasetoken import StreamRebaseToken
+
+TOKEN = "0x1234567890AbcdEF1234567890ABCDEF12345673"
+WALLETS = [f"0x{i:040x}" for i in range(1, 65)]
+
+
+def advance_work(connection, i):
+    token = StreamRebaseToken(connection, TOKEN)
+    token.mint_assets(1000, WALLETS[i % len(WALLETS)])
+
+
+def inspect_work(connection, i):
+    token = StreamRebaseToken(connection, TOKEN)
+    token.balance_of(WALLETS[i % len(WALLETS)], 0)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--inputs", type=int, default=2000)
+    args = parser.parse_args()
+
+    results = {}
+
+    use_temp_db("connection-reopen")
+
+    def reopen_advance(i):
+        # Previous handle_advance: fresh connection with the default cache
+        connection = get_connection(cached_statements=128)
+        advance_work(connection, i)
+        connection.commit()
+        connection.close()
+
+    def reopen_inspect(i):
+        connection = get_connection(cached_statements=128)
+        inspect_work(connection, i)
+        connection.close()
+
+    results["advance (reopen)"] = summarize(measure(reopen_advance, args.inputs))
+    results["inspect (reopen)"] = summarize(measure(reopen_inspect, args.inputs))
+
+    use_temp_db("connection-manager")
+    manager = ConnectionManager()
+
+    def managed_advance(i):
+        with manager.advance() as connection:
+            advance_work(connection, i)
+
+    def managed_inspect(i):
+        with manager.inspect() as connection:
+            inspect_work(connection, i)
+
+    results["advance (manager)"] = summarize(measure(managed_advance, args.inputs))
+    results["inspect (manager)"] = summarize(measure(managed_inspect, args.inputs))
+    manager.close()
+
+    print_results(f"Per-input cost over {args.inputs} inputs", results)
+
+
+if __name__ == "__main__":
+    main()
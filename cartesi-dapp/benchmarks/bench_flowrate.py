@@ -0,0 +1,132 @@
+"""balance_of on the rows engine vs. the flowrate engine.
+
+One wallet receives and sends --streams streams. The rows engine reads
+every one of them to build the wallet's vesting schedule, then serves
+reads from the cached schedule until the streams change, so it is timed
+both with the cache dropped before each read and warm. The flowrate
+engine reads the wallet's flow state, the events since it was last
+settled and the running streams whose amount does not divide by their
+duration. It is timed
+right after rebuild_flows (nothing settled) and after settle_flow at the
+read timestamp, with divisible amounts and with arbitrary ones.
+
+    python benchmarks/bench_flowrate.py --streams 100 1000 10000
+"""
+
+import argparse
+import random
+
+from common import measure, print_results, summarize, use_temp_db, write_json
+
+from dapp.db import (
+    ConnectionManager,
+    create_account_if_not_exists,
+    create_token_if_not_exists,
+)
+from dapp.flowrate import rebuild_flows, settle_flow
+from dapp.streamrebasetoken import StreamRebaseToken
+from dapp.util import checksum_address, int_to_bytes32
+
+TOKEN = checksum_address("0x1234567890abcdef1234567890abcdef12345673")
+WALLET = checksum_address(f"0x{1:040x}")
+NOW = 1_000_000
+
+
+def fill(connection, streams, divisible, seed):
+    rng = random.Random(seed)
+    others = [checksum_address(f"0x{i:040x}") for i in range(2, 102)]
+    token = StreamRebaseToken(connection, TOKEN)
+    token.mint_assets(10**24, WALLET)
+    wallet_id = create_account_if_not_exists(connection, WALLET)
+    other_ids = [create_account_if_not_exists(connection, other) for other in others]
+    token_id = create_token_if_not_exists(connection, TOKEN)
+    rows = []
+    for _ in range(streams):
+        start = rng.randrange(0, 2 * NOW)
+        duration = rng.randrange(1, NOW)
+        amount = rng.randrange(1, 10**12)
+        if divisible:
+            amount *= duration
+        sender, receiver = rng.sample([wallet_id, rng.choice(other_ids)], 2)
+        rows.append(
+            (
+                sender,
+                receiver,
+                start,
+                duration,
+                int_to_bytes32(amount),
+                token_id,
+                0,
+                start + duration,
+            )
+        )
+    connection.executemany(
+        """
+        INSERT INTO stream (from_id, to_id, start_timestamp, duration, amount, token_id, accrued, end_timestamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        rows,
+    )
+    rebuild_flows(connection)
+
+
+def run(streams, divisible, iterations, seed):
+    amounts = "divisible" if divisible else "arbitrary"
+    use_temp_db(f"flowrate-{streams}-{amounts}")
+    manager = ConnectionManager()
+    with manager.advance() as connection:
+        fill(connection, streams, divisible, seed)
+
+    connection = manager.connection
+    token = StreamRebaseToken(connection, TOKEN)
+
+    def balance(flow_engine, cached=True):
+        connection.flow_engine = flow_engine
+        if not cached:
+            connection.schedules = None
+        return token.balance_of(WALLET, NOW)
+
+    expected = balance(False)
+    assert balance(True) == expected
+
+    results = {
+        f"rows cold, {streams} {amounts}": summarize(
+            measure(lambda i: balance(False, cached=False), iterations)
+        ),
+        f"rows cached, {streams} {amounts}": summarize(
+            measure(lambda i: balance(False), iterations)
+        ),
+        f"flowrate cold, {streams} {amounts}": summarize(
+            measure(lambda i: balance(True), iterations)
+        ),
+    }
+    with manager.advance() as connection:
+        settle_flow(connection, WALLET, TOKEN, NOW)
+    assert balance(True) == expected
+    results[f"flowrate settled, {streams} {amounts}"] = summarize(
+        measure(lambda i: balance(True), iterations)
+    )
+    manager.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streams", type=int, nargs="+", default=[100, 1_000, 10_000])
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    for streams in args.streams:
+        for divisible in (True, False):
+            results.update(run(streams, divisible, args.iterations, args.seed))
+
+    print_results("balance_of of a wallet with many streams", results)
+    if args.json:
+        write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""transfer latency for a sender with many live outgoing streams.
+
+A payroll sender keeps thousands of streams running. The funds check of
+every new transfer used to evaluate all of them through balance_of at the
+sender's max end timestamp; it now reads the maintained stream_outflow
+total. For each stream count the sender gets that many running streams,
+then transfers are timed with the current check and with the old one.
+
+    python benchmarks/bench_payroll.py --streams 100 1000 10000
+"""
+
+import argparse
+import random
+
+from common import measure, print_results, summarize, use_temp_db, write_json
+
+from dapp.db import (
+    ConnectionManager,
+    create_account_if_not_exists,
+    create_token_if_not_exists,
+    get_max_end_timestamp_for_wallet,
+)
+from dapp.streamrebasetoken import StreamRebaseToken
+from dapp.util import bytes32_to_int, int_to_bytes32
+
+TOKEN = "0x1234567890abcdEf1234567890abcDEf12345673"
+SENDER = "0x0000000000000000000000000000000000000001"
+RECEIVERS = [f"0x{i:040x}" for i in range(2, 34)]
+NOW = 1_000_000
+MONTH = 30 * 24 * 3600
+
+
+def balance_of_check(token, account_address, current_timestamp):
+    max_timestamp = max(
+        current_timestamp,
+        get_max_end_timestamp_for_wallet(token._connection, account_address),
+    )
+    return token.balance_of(account_address, max_timestamp, False, current_timestamp)
+
+
+def run(streams, transfers, seed):
+    use_temp_db(f"payroll-{streams}")
+    manager = ConnectionManager()
+    rng = random.Random(seed)
+    with manager.advance() as connection:
+        StreamRebaseToken(connection, TOKEN).mint_assets(10**30, SENDER)
+        sender_id = create_account_if_not_exists(connection, SENDER)
+        receiver_ids = [
+            create_account_if_not_exists(connection, receiver) for receiver in RECEIVERS
+        ]
+        token_id = create_token_if_not_exists(connection, TOKEN)
+        rows = []
+        for i in range(streams):
+            start = NOW - rng.randrange(0, MONTH)
+            rows.append(
+                (
+                    sender_id,
+                    receiver_ids[i % len(receiver_ids)],
+                    start,
+                    MONTH,
+                    int_to_bytes32(rng.randrange(1, 10**18)),
+                    token_id,
+                    0,
+                    start + MONTH,
+                )
+            )
+        connection.executemany(
+            """
+            INSERT INTO stream (from_id, to_id, start_timestamp, duration, amount, token_id, accrued, end_timestamp)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            rows,
+        )
+        # The rows above bypass add_stream, so fill in their total directly
+        connection.execute(
+            """
+            INSERT INTO stream_outflow (account_id, token_id, committed)
+            VALUES (?, ?, ?)
+            """,
+            (
+                sender_id,
+                token_id,
+                int_to_bytes32(sum(bytes32_to_int(row[4]) for row in rows)),
+            ),
+        )
+
+    def transfer(i):
+        with manager.advance() as connection:
+            StreamRebaseToken(connection, TOKEN).transfer(
+                receiver=RECEIVERS[i % len(RECEIVERS)],
+                amount=1000,
+                duration=MONTH,
+                start_timestamp=NOW + i,
+                sender=SENDER,
+                current_timestamp=NOW + i,
+            )
+
+    results = {
+        f"transfer, {streams} live streams": summarize(measure(transfer, transfers))
+    }
+    token = StreamRebaseToken(manager.connection, TOKEN)
+    assert token.uncommitted_balance(SENDER, NOW) == balance_of_check(
+        token, SENDER, NOW
+    )
+
+    current = StreamRebaseToken.uncommitted_balance
+    StreamRebaseToken.uncommitted_balance = balance_of_check
+    try:
+        results[f"transfer (balance_of check), {streams} live streams"] = summarize(
+            measure(lambda i: transfer(transfers + i), transfers)
+        )
+    finally:
+        StreamRebaseToken.uncommitted_balance = current
+    manager.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streams", type=int, nargs="+", default=[100, 1_000, 10_000])
+    parser.add_argument("--transfers", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    for streams in args.streams:
+        results.update(run(streams, args.transfers, args.seed))
+
+    print_results("transfer vs. live outgoing streams of the sender", results)
+    if args.json:
+        write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
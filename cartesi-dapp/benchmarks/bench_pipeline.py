@@ -0,0 +1,305 @@
+"""End-to-end throughput of handle_advance and handle_inspect.
+
+The dapp is configured through its own inputs: claim_admin, input box
+wrapper and yield bridge. Then every wallet gets a deposit of every token,
+and the chosen number of background streams is opened. Each workload then
+sends --inputs encoded rollup requests through the handlers and times them
+one by one:
+
+    deposit   yield bridge deposit relayed by the input box wrapper
+    stream    stream between two random wallets
+    withdraw  burn plus voucher
+    cancel    cancel_stream of a stream opened during setup
+    rebase    input box wrapper rebasing every token, no action
+    inspect   balance inspect
+
+Requests to the rollup server are answered by an in-process stub, so the
+numbers cover decoding, the token logic and SQLite. Results can be written
+as JSON and compared with an earlier run:
+
+    python benchmarks/bench_pipeline.py --json before.json
+    python benchmarks/bench_pipeline.py --compare before.json
+"""
+
+import argparse
+import json
+import logging
+import random
+import subprocess
+
+from common import measure, print_results, summarize, use_temp_db, write_json
+from payloads import (
+    advance_request,
+    input_box_wrapper_input,
+    inspect_request,
+    json_action,
+    yield_bridge_deposit,
+)
+
+from dapp.db import get_connection_manager, get_token_total_assets
+from dapp.handlers import handle_advance, handle_inspect
+from dapp.rollup import RollupClient, set_rollup_client
+from dapp.util import checksum_address
+
+WORKLOADS = ["deposit", "stream", "withdraw", "cancel", "rebase", "inspect"]
+START_TIMESTAMP = 1_722_152_540
+BLOCK_TIME = 12
+DEPOSIT_AMOUNT = 10**24
+TRANSFER_AMOUNT = 10**15
+
+
+class StubResponse:
+    status_code = 200
+    text = ""
+    content = b""
+
+    def json(self):
+        return {}
+
+
+class StubSession:
+    def post(self, url, json=None, **kwargs):
+        return StubResponse()
+
+
+def address(n: int) -> str:
+    return checksum_address(f"0x{n:040x}")
+
+
+class Pipeline:
+    def __init__(self, wallets: int, tokens: int, seed: int):
+        self.rng = random.Random(seed)
+        self.admin = address(0xAD)
+        self.input_box_wrapper = address(0x1B)
+        self.yield_bridge = address(0xB1)
+        self.dapp = address(0xDA)
+        self.wallets = [address(0x10000 + i) for i in range(wallets)]
+        self.tokens = [address(0x20000 + i) for i in range(tokens)]
+        self.timestamp = START_TIMESTAMP
+        self.input_index = 0
+        self.rejected = 0
+
+    def request(self, msg_sender: str, payload: str):
+        self.input_index += 1
+        self.timestamp += BLOCK_TIME
+        return advance_request(msg_sender, payload, self.timestamp, self.input_index)
+
+    def wrapper_request(self, sender, action=b"", tokens=(), amounts=()):
+        payload = input_box_wrapper_input(sender, list(tokens), list(amounts), action)
+        return self.request(self.input_box_wrapper, payload)
+
+    def advance(self, data):
+        if handle_advance(data) != "accept":
+            self.rejected += 1
+
+    def setup(self, streams: int, cancellable: int):
+        self.advance(
+            self.request(
+                self.admin,
+                input_box_wrapper_input(
+                    self.admin,
+                    [],
+                    [],
+                    json_action("claim_admin", {"admin": self.admin}),
+                ),
+            )
+        )
+        for method, value in (
+            ("set_input_box_wrapper", self.input_box_wrapper),
+            ("set_yield_bridge", self.yield_bridge),
+        ):
+            self.advance(
+                self.request(
+                    self.admin,
+                    input_box_wrapper_input(
+                        self.admin, [], [], json_action(method, {method[4:]: value})
+                    ),
+                )
+            )
+        for wallet in self.wallets:
+            for token in self.tokens:
+                self.advance(self.deposit(token, wallet, DEPOSIT_AMOUNT))
+        for _ in range(streams):
+            self.advance(self.stream(self.rng.randrange(60, 100_000)))
+        for _ in range(cancellable):
+            self.advance(self.stream(10**9))
+
+    def deposit(self, token, wallet, amount):
+        deposit = yield_bridge_deposit(token, self.dapp, amount, wallet)
+        return self.wrapper_request(self.yield_bridge, deposit)
+
+    def stream(self, duration: int):
+        sender, receiver = self.rng.sample(self.wallets, 2)
+        action = json_action(
+            "stream",
+            {
+                "token": self.rng.choice(self.tokens),
+                "receiver": receiver,
+                "amount": TRANSFER_AMOUNT,
+                "duration": duration,
+                "start": self.timestamp + BLOCK_TIME,
+            },
+        )
+        return self.wrapper_request(sender, action)
+
+    def build(self, workload: str, inputs: int):
+        """Encodes the inputs of one workload up front so only the handler is timed."""
+        rng = self.rng
+        if workload == "deposit":
+            return [
+                self.deposit(
+                    rng.choice(self.tokens), rng.choice(self.wallets), TRANSFER_AMOUNT
+                )
+                for _ in range(inputs)
+            ]
+        if workload == "stream":
+            return [self.stream(rng.randrange(60, 3_600)) for _ in range(inputs)]
+        if workload == "withdraw":
+            return [
+                self.wrapper_request(
+                    rng.choice(self.wallets),
+                    json_action(
+                        "withdraw",
+                        {
+                            "token": rng.choice(self.tokens),
+                            "amount": TRANSFER_AMOUNT,
+                            "recipient": rng.choice(self.wallets),
+                        },
+                    ),
+                )
+                for _ in range(inputs)
+            ]
+        if workload == "cancel":
+            rows = (
+                get_connection_manager()
+                .connection.execute(
+                    """
+                    SELECT stream.id, sender.address, token.address FROM stream
+                    JOIN account sender ON sender.id = stream.from_id
+                    JOIN account token ON token.id = stream.token_id
+                    WHERE accrued = 0 AND end_timestamp > ?
+                    ORDER BY stream.id DESC
+                    LIMIT ?
+                    """,
+                    (self.timestamp + inputs * BLOCK_TIME, inputs),
+                )
+                .fetchall()
+            )
+            return [
+                self.wrapper_request(
+                    sender,
+                    json_action(
+                        "cancel_stream", {"token": token, "stream_id": stream_id}
+                    ),
+                )
+                for stream_id, sender, token in rows
+            ]
+        if workload == "rebase":
+            connection = get_connection_manager().connection
+            totals = [get_token_total_assets(connection, t) for t in self.tokens]
+            return [
+                self.wrapper_request(
+                    self.admin,
+                    tokens=self.tokens,
+                    amounts=[total + total * (i + 1) // 10**6 for total in totals],
+                )
+                for i in range(inputs)
+            ]
+        if workload == "inspect":
+            return [
+                inspect_request(
+                    {
+                        "data": "balance",
+                        "token_address": rng.choice(self.tokens),
+                        "wallet_address": rng.choice(self.wallets),
+                        "timestamp": self.timestamp,
+                    }
+                )
+                for _ in range(inputs)
+            ]
+        raise ValueError(f"Unknown workload {workload}")
+
+    def run(self, workload: str, inputs: int):
+        batch = self.build(workload, inputs)
+        if workload == "inspect":
+            return measure(lambda i: handle_inspect(batch[i]), len(batch))
+        return measure(lambda i: self.advance(batch[i]), len(batch))
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_comparison(path: str, results: dict):
+    with open(path) as f:
+        baseline = json.load(f)
+    print(f"compared with {path} (commit {baseline.get('commit')})")
+    for name, summary in results.items():
+        before = baseline["results"].get(name)
+        if before is None:
+            continue
+        print(
+            f"  {name:<40} {summary['per_second'] / before['per_second']:>6.2f}x op/s"
+            f"  p99 {before['p99_us']:>10.1f} -> {summary['p99_us']:>10.1f} us"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--wallets", type=int, default=100)
+    parser.add_argument("--tokens", type=int, default=4)
+    parser.add_argument(
+        "--streams", type=int, default=2_000, help="background streams opened in setup"
+    )
+    parser.add_argument("--inputs", type=int, default=500, help="inputs per workload")
+    parser.add_argument("--workloads", nargs="+", choices=WORKLOADS, default=WORKLOADS)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="JSON file of an earlier run")
+    parser.add_argument(
+        "--logs", action="store_true", help="keep the dapp's INFO logging on"
+    )
+    args = parser.parse_args()
+
+    if not args.logs:
+        logging.disable(logging.INFO)
+    set_rollup_client(RollupClient(session=StubSession()))
+
+    use_temp_db("pipeline")
+    pipeline = Pipeline(args.wallets, args.tokens, args.seed)
+    cancellable = args.inputs if "cancel" in args.workloads else 0
+    pipeline.setup(args.streams, cancellable)
+    if pipeline.rejected:
+        raise SystemExit(f"{pipeline.rejected} setup inputs were rejected")
+
+    results = {}
+    for workload in args.workloads:
+        results[workload] = summarize(pipeline.run(workload, args.inputs))
+        if pipeline.rejected:
+            raise SystemExit(f"{pipeline.rejected} {workload} inputs were rejected")
+
+    print_results(
+        f"pipeline: {args.wallets} wallets, {args.tokens} tokens,"
+        f" {args.streams} streams",
+        results,
+    )
+    if args.compare:
+        print_comparison(args.compare, results)
+    if args.json:
+        write_json(
+            args.json,
+            {"commit": current_commit(), "config": vars(args), "results": results},
+        )
+    get_connection_manager().close()
+
+
+if __name__ == "__main__":
+    main()
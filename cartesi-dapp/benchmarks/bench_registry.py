@@ -0,0 +1,77 @@
+"""Account/token upserts issued and skipped per input.
+
+Read paths no longer insert into account and token, and write paths skip
+the insert for accounts already in the connection's AddressBook and for
+tokens already in the AddressRegistry. This prints how many write
+statements each kind of input still runs and how many token upserts the
+registry saved.
+
+    python benchmarks/bench_registry.py --inputs 1000
+"""
+
+import argparse
+
+from common import use_temp_db
+
+from dapp.db import ConnectionManager
+from dapp.streamrebasetoken import StreamRebaseToken
+
+TOKEN = "0x1234567890AbcdEF1234567890ABCDEF12345673"
+WALLETS = [f"0x{i:040x}" for i in range(1, 33)]
+WRITE_PREFIXES = ("INSERT", "UPDATE", "DELETE")
+
+
+def count_writes(statements):
+    return sum(1 for sql in statements if sql.lstrip().startswith(WRITE_PREFIXES))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--inputs", type=int, default=1000)
+    args = parser.parse_args()
+
+    use_temp_db("registry")
+    manager = ConnectionManager()
+    with manager.advance() as connection:
+        token = StreamRebaseToken(connection, TOKEN)
+        for wallet in WALLETS:
+            token.mint_assets(10**18, wallet)
+
+    statements = []
+    manager.connection.set_trace_callback(statements.append)
+
+    advance_writes = 0
+    for i in range(args.inputs):
+        with manager.advance() as connection:
+            StreamRebaseToken(connection, TOKEN).transfer(
+                receiver=WALLETS[(i + 1) % len(WALLETS)],
+                amount=1000,
+                duration=100,
+                start_timestamp=0,
+                sender=WALLETS[i % len(WALLETS)],
+                current_timestamp=i,
+            )
+        advance_writes += count_writes(statements)
+        statements.clear()
+
+    inspect_writes = 0
+    for i in range(args.inputs):
+        with manager.inspect() as connection:
+            StreamRebaseToken(connection, TOKEN).balance_of(
+                WALLETS[i % len(WALLETS)], args.inputs
+            )
+        inspect_writes += count_writes(statements)
+        statements.clear()
+    manager.connection.set_trace_callback(None)
+
+    registry = manager.registry
+    print(f"transfer inputs:           {args.inputs}")
+    print(f"  write statements/input:  {advance_writes / args.inputs:.2f}")
+    print(f"  upserts skipped/input:   {registry.skipped_upserts_per_input():.2f}")
+    print(f"balance inspects:          {args.inputs}")
+    print(f"  write statements/input:  {inspect_writes / args.inputs:.2f}")
+    manager.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Cost of the success report of each REPORT_POLICY.
+
+Batch stream inputs of --actions sizes go through handle_advance once per
+policy. The rollup server stub counts the bytes POSTed to /report, so the
+time per input is printed with the report bytes per input next to it.
+
+    python benchmarks/bench_reports.py --actions 1 32 256
+"""
+
+import argparse
+import logging
+import os
+
+from bench_pipeline import Pipeline, StubResponse
+from bench_batch import batch_inputs
+from common import measure, print_results, summarize, use_temp_db, write_json
+
+from dapp.db import get_connection_manager
+from dapp.reports import REPORT_POLICIES
+from dapp.rollup import RollupClient, json_body, set_rollup_client
+
+
+class CountingSession:
+    def __init__(self):
+        self.report_bytes = 0
+
+    def post(self, url, json=None, **kwargs):
+        if url.endswith("/report"):
+            self.report_bytes += len(json_body(json))
+        return StubResponse()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--actions", type=int, nargs="+", default=[1, 32, 256])
+    parser.add_argument("--inputs", type=int, default=200, help="inputs per row")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    session = CountingSession()
+    set_rollup_client(RollupClient(session=session))
+
+    results = {}
+    report_bytes = {}
+    for actions in args.actions:
+        for policy in REPORT_POLICIES:
+            # A fresh database per row, so no policy runs on more streams
+            use_temp_db(f"reports-{policy}-{actions}")
+            pipeline = Pipeline(actions + 1, 1, args.seed)
+            sender, receivers = pipeline.wallets[0], pipeline.wallets[1:]
+            pipeline.setup(0, 0)
+            inputs = [
+                batch_inputs(pipeline, sender, receivers)[0] for _ in range(args.inputs)
+            ]
+            os.environ["REPORT_POLICY"] = policy
+            session.report_bytes = 0
+            name = f"{policy}, {actions} actions per input"
+            results[name] = summarize(
+                measure(lambda i: pipeline.advance(inputs[i]), args.inputs)
+            )
+            report_bytes[name] = session.report_bytes / args.inputs
+            os.environ.pop("REPORT_POLICY")
+            if pipeline.rejected:
+                raise SystemExit(f"{pipeline.rejected} inputs were rejected")
+            get_connection_manager().close()
+
+    print_results("handle_advance by report policy", results)
+    print("report bytes per input")
+    for name, size in report_bytes.items():
+        print(f"  {name:<40} {size:>10.0f} bytes")
+    if args.json:
+        write_json(args.json, {"results": results, "report_bytes": report_bytes})
+
+
+if __name__ == "__main__":
+    main()
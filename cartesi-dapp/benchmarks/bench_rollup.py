@@ -0,0 +1,93 @@
+"""Rollup server round trips per input: fresh requests.post vs. RollupClient.
+
+A local HTTP/1.1 stand-in for the rollup server answers /finish with an
+inspect request and accepts /report and /voucher. Each simulated input does
+what the dapp does for a withdraw: finish, voucher, report. It is run once
+with a new connection per call, as requests.post did, and once through the
+keep-alive connection of RollupClient.
+
+    python benchmarks/bench_rollup.py --inputs 2000
+"""
+
+import argparse
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from common import measure, print_results, summarize, write_json
+
+from dapp.rollup import RollupClient
+
+ROLLUP_REQUEST = json.dumps(
+    {"request_type": "inspect_state", "data": {"payload": "0x7b7d"}}
+).encode()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this, Nagle's
+    # algorithm holds the body back on a kept-alive connection.
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        body = ROLLUP_REQUEST if self.path == "/finish" else b"{}"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--inputs", type=int, default=2000)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    # Only the HTTP round trips are compared, not the client's INFO logging
+    logging.disable(logging.INFO)
+    server = start_server()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    voucher = {"destination": "0x" + "00" * 20, "payload": "0x" + "00" * 100}
+    report = {"payload": "0x" + "00" * 200}
+
+    def fresh_connections(i):
+        requests.post(url + "/finish", json={"status": "accept"}).json()
+        requests.post(url + "/voucher", json=voucher)
+        requests.post(url + "/report", json=report)
+
+    client = RollupClient(url)
+
+    def keep_alive(i):
+        client.finish("accept")
+        client.voucher(**voucher)
+        client.report(report["payload"])
+
+    results = {
+        "requests.post per call": summarize(measure(fresh_connections, args.inputs)),
+        "RollupClient session": summarize(measure(keep_alive, args.inputs)),
+    }
+    server.shutdown()
+
+    print_results(
+        "rollup server round trips per input (finish, voucher, report)", results
+    )
+    if args.json:
+        write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
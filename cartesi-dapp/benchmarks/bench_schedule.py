@@ -0,0 +1,123 @@
+"""balance_of at many timestamps: per-stream SQL vs. the vesting schedule.
+
+One wallet gets a number of live streams, half incoming and half outgoing.
+Its balance is then read at evenly spaced timestamps across their span, as
+a chart or the indexer would, first through get_wallet_streamed_amount and
+then through the cached VestingSchedule. Both must agree. The last row
+reads all of them with one balance_series sweep.
+
+    python benchmarks/bench_schedule.py --streams 100 1000 10000
+"""
+
+import argparse
+import random
+
+from common import measure, print_results, summarize, use_temp_db, write_json
+
+from dapp.db import (
+    ConnectionManager,
+    create_account_if_not_exists,
+    create_token_if_not_exists,
+    get_wallet_streamed_amount,
+)
+from dapp.streamrebasetoken import StreamRebaseToken
+from dapp.util import int_to_bytes32
+
+TOKEN = "0x1234567890abcdEf1234567890abcDEf12345673"
+WALLET = "0x0000000000000000000000000000000000000001"
+COUNTERPARTIES = [f"0x{i:040x}" for i in range(2, 34)]
+SPAN = 1_000_000
+
+
+def run(streams, points, seed):
+    use_temp_db(f"schedule-{streams}")
+    manager = ConnectionManager()
+    rng = random.Random(seed)
+    rows = []
+    for i in range(streams):
+        start = rng.randrange(0, SPAN)
+        duration = rng.randrange(1, SPAN)
+        counterparty = rng.choice(COUNTERPARTIES)
+        sender, receiver = (
+            (WALLET, counterparty) if i % 2 == 0 else (counterparty, WALLET)
+        )
+        rows.append(
+            (
+                sender,
+                receiver,
+                start,
+                duration,
+                int_to_bytes32(rng.randrange(1, 10**18)),
+                TOKEN,
+                0,
+                start + duration,
+            )
+        )
+    with manager.advance() as connection:
+        ids = {
+            address: create_account_if_not_exists(connection, address)
+            for address in [WALLET] + COUNTERPARTIES
+        }
+        ids[TOKEN] = create_token_if_not_exists(connection, TOKEN)
+        connection.executemany(
+            """
+            INSERT INTO stream (from_id, to_id, start_timestamp, duration, amount, token_id, accrued, end_timestamp)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (ids[row[0]], ids[row[1]], *row[2:5], ids[row[5]], *row[6:])
+                for row in rows
+            ],
+        )
+
+    connection = manager.connection
+    token = StreamRebaseToken(connection, TOKEN)
+    timestamps = [2 * SPAN * i // points for i in range(points)]
+    sql = [
+        get_wallet_streamed_amount(connection, WALLET, TOKEN, t, t) for t in timestamps
+    ]
+    assert [token.vesting_schedule(WALLET).streamed_at(t) for t in timestamps] == sql
+    assert token.vesting_schedule(WALLET).streamed_series(timestamps) == sql
+
+    results = {
+        f"SQL per timestamp, {streams} streams": summarize(
+            measure(
+                lambda i: get_wallet_streamed_amount(
+                    connection, WALLET, TOKEN, timestamps[i], timestamps[i]
+                ),
+                points,
+            )
+        ),
+        f"schedule per timestamp, {streams} streams": summarize(
+            measure(
+                lambda i: token.vesting_schedule(WALLET).streamed_at(timestamps[i]),
+                points,
+            )
+        ),
+        f"balance_series of {points} points, {streams} streams": summarize(
+            measure(lambda i: token.balance_series(WALLET, timestamps), 5)
+        ),
+    }
+    manager.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streams", type=int, nargs="+", default=[100, 1_000, 10_000])
+    parser.add_argument("--points", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    for streams in args.streams:
+        results.update(run(streams, args.points, args.seed))
+
+    print_results("streamed amount of one wallet at many timestamps", results)
+    if args.json:
+        write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Accruing ended streams: process_streams per wallet vs. settle_ended_streams.
+
+--wallets wallets send --streams-per-wallet ended streams each to a hub
+wallet that stays dormant. Settling them through each sender's
+process_streams (what a withdraw or a new stream of every sender would do)
+is timed against one settle_ended_streams pass, and the hub's balance_of
+with its schedule cache dropped is timed before and after the pass.
+
+    python benchmarks/bench_settlement.py --wallets 100 1000 --streams-per-wallet 4
+"""
+
+import argparse
+import time
+
+from common import measure, print_results, summarize, use_temp_db, write_json
+
+from dapp.db import (
+    ConnectionManager,
+    create_account_if_not_exists,
+    create_token_if_not_exists,
+)
+from dapp.streamrebasetoken import StreamRebaseToken
+from dapp.util import checksum_address, int_to_bytes32
+
+TOKEN = checksum_address("0x1234567890abcdef1234567890abcdef12345673")
+HUB = checksum_address(f"0x{1:040x}")
+NOW = 1_000_000
+
+
+def fill(manager, wallets, streams_per_wallet):
+    senders = [checksum_address(f"0x{i:040x}") for i in range(2, wallets + 2)]
+    with manager.advance() as connection:
+        token = StreamRebaseToken(connection, TOKEN)
+        for sender in [HUB] + senders:
+            token.mint_assets(10**24, sender)
+        hub_id = create_account_if_not_exists(connection, HUB)
+        token_id = create_token_if_not_exists(connection, TOKEN)
+        rows = []
+        for i, sender in enumerate(senders):
+            sender_id = create_account_if_not_exists(connection, sender)
+            for j in range(streams_per_wallet):
+                start = (i * streams_per_wallet + j) % NOW
+                rows.append(
+                    (
+                        sender_id,
+                        hub_id,
+                        start,
+                        1000,
+                        int_to_bytes32(10**18 + j),
+                        token_id,
+                    )
+                )
+        connection.executemany(
+            """
+            INSERT INTO stream (from_id, to_id, start_timestamp, duration, amount, token_id, accrued, end_timestamp)
+            VALUES (?, ?, ?, ?, ?, ?, 0, ? + ?)
+            """,
+            [row + (row[2], row[3]) for row in rows],
+        )
+    return senders
+
+
+def timed_settlement(wallets, streams_per_wallet, lazy):
+    """Seconds one advance takes to settle a freshly filled database."""
+    use_temp_db(f"settlement-{wallets}")
+    manager = ConnectionManager()
+    senders = fill(manager, wallets, streams_per_wallet)
+    start = time.perf_counter()
+    with manager.advance() as connection:
+        token = StreamRebaseToken(connection, TOKEN)
+        if lazy:
+            for sender in senders:
+                token.process_streams(sender, NOW)
+        else:
+            token.settle_ended_streams(NOW)
+    elapsed = time.perf_counter() - start
+    manager.close()
+    return elapsed
+
+
+def run(wallets, streams_per_wallet, iterations):
+    name = f"{wallets} wallets, {wallets * streams_per_wallet} streams"
+    results = {
+        f"process_streams per wallet, {name}": summarize(
+            [
+                timed_settlement(wallets, streams_per_wallet, lazy=True)
+                for _ in range(iterations)
+            ]
+        ),
+        f"settle_ended_streams, {name}": summarize(
+            [
+                timed_settlement(wallets, streams_per_wallet, lazy=False)
+                for _ in range(iterations)
+            ]
+        ),
+    }
+
+    use_temp_db(f"settlement-{wallets}")
+    manager = ConnectionManager()
+    fill(manager, wallets, streams_per_wallet)
+    token = StreamRebaseToken(manager.connection, TOKEN)
+
+    def hub_balance(i):
+        manager.connection.schedules = None
+        return token.balance_of(HUB, NOW)
+
+    expected = hub_balance(0)
+    results[f"hub balance_of before, {name}"] = summarize(
+        measure(hub_balance, iterations)
+    )
+    with manager.advance() as connection:
+        StreamRebaseToken(connection, TOKEN).settle_ended_streams(NOW)
+    assert hub_balance(0) == expected
+    results[f"hub balance_of after, {name}"] = summarize(
+        measure(hub_balance, iterations)
+    )
+    manager.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--wallets", type=int, nargs="+", default=[100, 1_000])
+    parser.add_argument("--streams-per-wallet", type=int, default=4)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    for wallets in args.wallets:
+        results.update(run(wallets, args.streams_per_wallet, args.iterations))
+
+    print_results("accruing the ended streams of dormant wallets", results)
+    if args.json:
+        write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Advance throughput of the dapp under each STORAGE_PROFILE.
+
+For each profile, a fresh database goes through the setup of
+bench_pipeline.py and then --inputs inputs of each advance workload. The
+inputs are the same for every profile, so the databases must end up the
+same: each one has to pass PRAGMA integrity_check and foreign_key_check
+and hold the same rows as the first profile, or the run fails.
+
+    python benchmarks/bench_storage.py --streams 2000 --inputs 500
+"""
+
+import argparse
+import logging
+import os
+import sqlite3
+import time
+
+from bench_pipeline import Pipeline, StubSession
+from common import print_results, summarize, use_temp_db, write_json
+
+from dapp.db import close_connection_manager
+from dapp.rollup import RollupClient, set_rollup_client
+from dapp.storage import STORAGE_PROFILES
+
+WORKLOADS = ["deposit", "stream", "withdraw", "cancel", "rebase"]
+
+
+def database_content(db_file_path):
+    """Rows of every table, after checking the file's integrity."""
+    connection = sqlite3.connect(db_file_path)
+    integrity = connection.execute("PRAGMA integrity_check").fetchall()
+    if integrity != [("ok",)]:
+        raise SystemExit(f"{db_file_path} failed integrity_check: {integrity}")
+    if connection.execute("PRAGMA foreign_key_check").fetchall():
+        raise SystemExit(f"{db_file_path} failed foreign_key_check")
+    tables = [
+        row[0]
+        for row in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name"
+        )
+    ]
+    content = {
+        table: sorted(connection.execute(f"SELECT * FROM {table}").fetchall())
+        for table in tables
+    }
+    connection.close()
+    return content
+
+
+def run(profile, args):
+    os.environ["STORAGE_PROFILE"] = profile
+    db_file_path = use_temp_db(f"storage-{profile}")
+    pipeline = Pipeline(args.wallets, args.tokens, args.seed)
+    start = time.perf_counter()
+    pipeline.setup(args.streams, args.inputs)
+    setup_s = time.perf_counter() - start
+    if pipeline.rejected:
+        raise SystemExit(f"{pipeline.rejected} setup inputs were rejected")
+    print(f"{profile}: {pipeline.input_index} setup inputs in {setup_s:.1f}s")
+
+    results = {}
+    for workload in args.workloads:
+        results[f"{workload} ({profile})"] = summarize(
+            pipeline.run(workload, args.inputs)
+        )
+        if pipeline.rejected:
+            raise SystemExit(f"{pipeline.rejected} {workload} inputs were rejected")
+    close_connection_manager()
+    return results, database_content(db_file_path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profiles", nargs="+", default=list(STORAGE_PROFILES))
+    parser.add_argument("--wallets", type=int, default=100)
+    parser.add_argument("--tokens", type=int, default=4)
+    parser.add_argument("--streams", type=int, default=2_000)
+    parser.add_argument("--inputs", type=int, default=500, help="inputs per workload")
+    parser.add_argument("--workloads", nargs="+", choices=WORKLOADS, default=WORKLOADS)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    set_rollup_client(RollupClient(session=StubSession()))
+
+    results = {}
+    expected = None
+    for profile in args.profiles:
+        profile_results, content = run(profile, args)
+        results.update(profile_results)
+        if expected is None:
+            expected = content
+        elif content != expected:
+            raise SystemExit(
+                f"{profile} stored a different database than {args.profiles[0]}"
+            )
+
+    print_results(
+        f"advances per profile: {args.wallets} wallets, {args.tokens} tokens,"
+        f" {args.streams} streams",
+        results,
+    )
+    if args.json:
+        write_json(args.json, {"config": vars(args), "results": results})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Stream query latency with the legacy single-column indexes vs. the
+composite/partial indexes and UNION ALL queries.
+
+The database is filled once with the legacy schema, the legacy OR queries
+are timed, then migrate_db() upgrades it and the current helpers are timed
+on the same rows.
+
+    python benchmarks/bench_stream_indexes.py --streams 1000000 --wallets 10000
+"""
+
+import argparse
+import random
+import time
+
+from common import measure, print_results, summarize, use_temp_db
+
+from dapp.db import (
+    get_max_end_timestamp_for_wallet,
+    get_wallet_endend_streams,
+    get_wallet_non_accrued_streamed_amts,
+    get_wallet_streams,
+)
+from sqlite import migrate_db
+from tests.utils import create_legacy_db
+
+TOKENS = [f"0x{i:040x}" for i in range(0xA0, 0xA4)]
+
+LEGACY_QUERIES = {
+    "non_accrued_streamed_amts": (
+        """
+        SELECT start_timestamp, duration, amount, to_address
+        FROM stream
+        WHERE (from_address = ? OR to_address = ?) AND token_address = ? AND accrued = 0
+        AND start_timestamp <= ?
+        """,
+        lambda w, t, ts: (w, w, t, ts),
+    ),
+    "endend_streams": (
+        """
+        SELECT * FROM stream
+        WHERE (from_address = ? OR to_address = ?) AND token_address = ? AND start_timestamp + duration <= ? AND accrued = 0 AND swap_id IS NULL
+        """,
+        lambda w, t, ts: (w, w, t, ts),
+    ),
+    "wallet_streams": (
+        """
+        SELECT * FROM stream
+        WHERE (from_address = ? OR to_address = ?) AND token_address = ?
+        """,
+        lambda w, t, ts: (w, w, t),
+    ),
+    "max_end_timestamp": (
+        """
+        SELECT MAX(start_timestamp + duration)
+        FROM stream
+        WHERE (from_address = ? OR to_address = ?)
+        """,
+        lambda w, t, ts: (w, w),
+    ),
+}
+
+CURRENT_QUERIES = {
+    "non_accrued_streamed_amts": lambda c, w, t, ts: sum(
+        get_wallet_non_accrued_streamed_amts(c, w, t, ts, ts)
+    ),
+    "endend_streams": lambda c, w, t, ts: get_wallet_endend_streams(c, w, t, ts),
+    "wallet_streams": lambda c, w, t, ts: get_wallet_streams(c, w, t),
+    "max_end_timestamp": lambda c, w, t, ts: get_max_end_timestamp_for_wallet(c, w),
+}
+
+
+def fill(connection, streams, wallets, accrued_ratio, seed):
+    rng = random.Random(seed)
+    addresses = [f"0x{i:040x}" for i in range(1, wallets + 1)]
+    batch = []
+    for i in range(streams):
+        sender, receiver = rng.sample(addresses, 2)
+        start = rng.randrange(0, 1_000_000)
+        batch.append(
+            (
+                sender,
+                receiver,
+                start,
+                rng.randrange(0, 100_000),
+                str(rng.randrange(1, 10**21)),
+                rng.choice(TOKENS),
+                1 if rng.random() < accrued_ratio else 0,
+            )
+        )
+        if len(batch) == 50_000 or i == streams - 1:
+            connection.executemany(
+                """
+                INSERT INTO stream (from_address, to_address, start_timestamp, duration, amount, token_address, accrued)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                batch,
+            )
+            batch = []
+    connection.commit()
+    return addresses
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streams", type=int, default=1_000_000)
+    parser.add_argument("--wallets", type=int, default=10_000)
+    parser.add_argument("--accrued-ratio", type=float, default=0.8)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    use_temp_db("stream-indexes")
+    connection = create_legacy_db()
+    start = time.perf_counter()
+    addresses = fill(
+        connection, args.streams, args.wallets, args.accrued_ratio, args.seed
+    )
+    print(f"Inserted {args.streams} streams in {time.perf_counter() - start:.1f}s")
+
+    rng = random.Random(args.seed)
+    probes = [
+        (rng.choice(addresses), rng.choice(TOKENS), rng.randrange(0, 1_100_000))
+        for _ in range(args.queries)
+    ]
+
+    results = {}
+    for name, (sql, params) in LEGACY_QUERIES.items():
+        results[f"{name} (legacy)"] = summarize(
+            measure(
+                lambda i: connection.execute(sql, params(*probes[i])).fetchall(),
+                args.queries,
+            )
+        )
+
+    start = time.perf_counter()
+    migrate_db(connection)
+    print(f"Migrated indexes in {time.perf_counter() - start:.1f}s")
+
+    for name, query in CURRENT_QUERIES.items():
+        results[f"{name} (indexed)"] = summarize(
+            measure(lambda i: query(connection, *probes[i]), args.queries)
+        )
+
+    print_results(f"{args.streams} streams, {args.wallets} wallets", results)
+    connection.close()
+
+
+if __name__ == "__main__":
+    main()
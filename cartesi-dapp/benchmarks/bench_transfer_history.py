@@ -0,0 +1,148 @@
+"""transfer latency against the number of historical streams per wallet.
+
+Every transfer settles the sender's ended streams first. The ended-stream
+query used to filter on start_timestamp + duration, which no index can
+serve, so its cost grew with every stream the wallet ever had. It now seeks
+the stored end_timestamp on the live partial indexes. For each history size
+the sender gets that many settled (accrued) streams, then transfers are
+timed along with both forms of the ended-stream query.
+
+    python benchmarks/bench_transfer_history.py --history 0 1000 10000 100000
+"""
+
+import argparse
+import random
+
+from common import measure, print_results, summarize, use_temp_db, write_json
+
+from dapp.addresses import get_address_id
+from dapp.db import (
+    ConnectionManager,
+    create_account_if_not_exists,
+    create_token_if_not_exists,
+    get_wallet_endend_streams,
+)
+from dapp.streamrebasetoken import StreamRebaseToken
+from dapp.util import int_to_bytes32
+
+TOKEN = "0x1234567890AbcdEF1234567890ABCDEF12345673"
+SENDER = "0x0000000000000000000000000000000000000001"
+RECEIVERS = [f"0x{i:040x}" for i in range(2, 34)]
+NOW = 10_000_000
+
+EXPRESSION_QUERY = """
+    SELECT * FROM stream
+    WHERE from_id = ? AND token_id = ? AND accrued = 0
+    AND start_timestamp <= ? AND start_timestamp + duration <= ?
+    AND swap_id IS NULL
+    UNION ALL
+    SELECT * FROM stream
+    WHERE to_id = ? AND token_id = ? AND accrued = 0
+    AND start_timestamp <= ? AND start_timestamp + duration <= ?
+    AND swap_id IS NULL AND from_id != ?
+    ORDER BY id
+"""
+
+
+def fill_history(connection, history, seed):
+    rng = random.Random(seed)
+    sender_id = create_account_if_not_exists(connection, SENDER)
+    receiver_ids = [
+        create_account_if_not_exists(connection, receiver) for receiver in RECEIVERS
+    ]
+    token_id = create_token_if_not_exists(connection, TOKEN)
+    rows = []
+    for i in range(history):
+        start = rng.randrange(0, NOW - 1000)
+        duration = rng.randrange(1, 1000)
+        counterparty = rng.choice(receiver_ids)
+        sender, receiver = (
+            (sender_id, counterparty) if i % 2 == 0 else (counterparty, sender_id)
+        )
+        rows.append(
+            (
+                sender,
+                receiver,
+                start,
+                duration,
+                int_to_bytes32(rng.randrange(1, 10**18)),
+                token_id,
+                1,
+                start + duration,
+            )
+        )
+    connection.executemany(
+        """
+        INSERT INTO stream (from_id, to_id, start_timestamp, duration, amount, token_id, accrued, end_timestamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        rows,
+    )
+
+
+def run(history, transfers, seed):
+    use_temp_db(f"transfer-history-{history}")
+    manager = ConnectionManager()
+    with manager.advance() as connection:
+        token = StreamRebaseToken(connection, TOKEN)
+        token.mint_assets(10**30, SENDER)
+        fill_history(connection, history, seed)
+
+    def transfer(i):
+        with manager.advance() as connection:
+            StreamRebaseToken(connection, TOKEN).transfer(
+                receiver=RECEIVERS[i % len(RECEIVERS)],
+                amount=1000,
+                duration=10,
+                start_timestamp=NOW + i,
+                sender=SENDER,
+                current_timestamp=NOW + i,
+            )
+
+    connection = manager.connection
+    timestamp = NOW + transfers
+    sender_id = get_address_id(connection, SENDER)
+    token_id = get_address_id(connection, TOKEN)
+    params = (sender_id, token_id, timestamp, timestamp) * 2 + (sender_id,)
+    results = {
+        f"transfer, history {history}": summarize(measure(transfer, transfers)),
+        f"ended (expression), history {history}": summarize(
+            measure(
+                lambda i: connection.execute(EXPRESSION_QUERY, params).fetchall(),
+                transfers,
+            )
+        ),
+        f"ended (end_timestamp), history {history}": summarize(
+            measure(
+                lambda i: get_wallet_endend_streams(
+                    connection, SENDER, TOKEN, timestamp
+                ),
+                transfers,
+            )
+        ),
+    }
+    manager.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--history", type=int, nargs="+", default=[0, 1_000, 10_000, 100_000]
+    )
+    parser.add_argument("--transfers", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    for history in args.history:
+        results.update(run(history, args.transfers, args.seed))
+
+    print_results("transfer vs. historical streams per wallet", results)
+    if args.json:
+        write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
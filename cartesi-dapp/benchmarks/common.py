@@ -0,0 +1,61 @@
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from sqlite import initialise_db
+
+
+def use_temp_db(name: str) -> str:
+    """Point DB_FILE_PATH at a fresh database in the temp dir and create it."""
+    db_file_path = os.path.join(tempfile.gettempdir(), f"bench-{name}.sqlite")
+    os.environ["DB_FILE_PATH"] = db_file_path
+    initialise_db()
+    return db_file_path
+
+
+def measure(func, iterations: int):
+    """Call func(i) for each iteration and return the per-call durations in seconds."""
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        func(i)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def percentile(samples, pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples):
+    total = sum(samples)
+    return {
+        "count": len(samples),
+        "total_s": total,
+        "per_second": len(samples) / total if total else 0.0,
+        "mean_us": statistics.fmean(samples) * 1e6,
+        "p50_us": percentile(samples, 50) * 1e6,
+        "p99_us": percentile(samples, 99) * 1e6,
+    }
+
+
+def print_results(title: str, results: dict):
+    print(title)
+    for name, summary in results.items():
+        print(
+            f"  {name:<40} {summary['mean_us']:>10.1f} us/op"
+            f"  p50 {summary['p50_us']:>10.1f}  p99 {summary['p99_us']:>10.1f}"
+            f"  ({summary['per_second']:.0f} op/s)"
+        )
+
+
+def write_json(path: str, results: dict):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
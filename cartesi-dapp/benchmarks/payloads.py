@@ -0,0 +1,69 @@
+"""Builders for the rollup requests the dapp receives.
+
+These encode inputs the same way InputBoxWrapper and the yield bridge do,
+as in tests/test_native_yields.py, but take and return bytes where the
+handlers do, so building a payload costs as little as possible.
+"""
+
+import json
+from typing import Any, Dict, List
+
+from eth_abi import encode
+
+from dapp.util import str_to_hex
+
+
+def json_action(method: str, args: Dict[str, Any]) -> bytes:
+    data = {
+        "method": method,
+        "args": {
+            key: str(value) if isinstance(value, (int, float)) else value
+            for key, value in args.items()
+        },
+    }
+    return json.dumps(data).encode("utf-8")
+
+
+def yield_bridge_deposit(
+    token_address: str,
+    dapp_address: str,
+    amount: int,
+    recipient: str,
+    action: bytes = b"",
+) -> bytes:
+    return encode(
+        ["address", "address", "uint256", "address", "bytes"],
+        [token_address, dapp_address, amount, recipient, action],
+    )
+
+
+def input_box_wrapper_input(
+    sender_address: str,
+    token_addresses: List[str],
+    amounts: List[int],
+    action: bytes,
+) -> str:
+    encoded = encode(
+        ["address", "address[]", "uint256[]", "bytes"],
+        [sender_address, token_addresses, amounts, action],
+    )
+    return "0x" + encoded.hex()
+
+
+def advance_request(
+    msg_sender: str, payload: str, timestamp: int, input_index: int
+) -> Dict[str, Any]:
+    return {
+        "metadata": {
+            "msg_sender": msg_sender,
+            "epoch_index": 0,
+            "input_index": input_index,
+            "block_number": input_index,
+            "timestamp": timestamp,
+        },
+        "payload": payload,
+    }
+
+
+def inspect_request(query: Dict[str, Any]) -> Dict[str, Any]:
+    return {"payload": str_to_hex(json.dumps(query))}
@@ -0,0 +1,93 @@
+from typing import Any, Dict
+
+from eth_abi import encode
+
+from dapp.util import checksum_address
+
+# First byte of a binary action. JSON actions start with "{" instead.
+ACTION_FORMAT_VERSION = 1
+
+# selector -> (method, ((arg, ABI type), ...))
+ACTION_TYPES = {
+    1: (
+        "stream",
+        (
+            ("token", "address"),
+            ("receiver", "address"),
+            ("amount", "uint256"),
+            ("duration", "uint64"),
+            ("start", "uint64"),
+        ),
+    ),
+    2: (
+        "withdraw",
+        (
+            ("token", "address"),
+            ("amount", "uint256"),
+            ("recipient", "address"),
+        ),
+    ),
+    3: (
+        "cancel_stream",
+        (
+            ("token", "address"),
+            ("stream_id", "uint64"),
+        ),
+    ),
+}
+ACTION_SELECTORS = {method: selector for selector, (method, _) in ACTION_TYPES.items()}
+
+_TYPE_BOUNDS = {"address": 2**160, "uint64": 2**64, "uint256": 2**256}
+
+# selector -> (method, ((arg, exclusive upper bound, is address), ...))
+_LAYOUTS = {
+    selector: (
+        method,
+        tuple(
+            (name, _TYPE_BOUNDS[abi_type], abi_type == "address")
+            for name, abi_type in types
+        ),
+    )
+    for selector, (method, types) in ACTION_TYPES.items()
+}
+
+
+def is_binary_action(encoded: bytes) -> bool:
+    return encoded[:1] == bytes([ACTION_FORMAT_VERSION])
+
+
+def encode_action(method: str, args: Dict[str, Any]) -> bytes:
+    """Encodes an action the way an L1 caller would with abi.encode."""
+    selector = ACTION_SELECTORS[method]
+    types = ACTION_TYPES[selector][1]
+    return bytes([ACTION_FORMAT_VERSION, selector]) + encode(
+        [abi_type for _, abi_type in types], [args[name] for name, _ in types]
+    )
+
+
+def decode_action(encoded: bytes) -> Dict[str, Any]:
+    """Decodes version | selector | abi.encode(args) into {"method", "args"}.
+
+    Every argument is a static ABI type, so each one is a 32-byte word at a
+    fixed offset and is read without going through eth_abi. The args come
+    back as ints and ChecksumAddress values, in the shape json.loads gives
+    for the JSON form.
+    """
+    if len(encoded) < 2 or encoded[0] != ACTION_FORMAT_VERSION:
+        raise ValueError("Unsupported action format")
+    layout = _LAYOUTS.get(encoded[1])
+    if layout is None:
+        raise ValueError(f"Unknown action selector {encoded[1]}")
+    method, fields = layout
+    if len(encoded) != 2 + 32 * len(fields):
+        raise ValueError(f"{method} takes {len(fields)} ABI words")
+
+    args = {}
+    offset = 2
+    for name, bound, is_address in fields:
+        value = int.from_bytes(encoded[offset : offset + 32], "big")
+        if value >= bound:
+            raise ValueError(f"{name} is out of range")
+        args[name] = checksum_address(f"0x{value:040x}") if is_address else value
+        offset += 32
+    return {"method": method, "args": args}
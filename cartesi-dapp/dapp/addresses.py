@@ -0,0 +1,100 @@
+from typing import Optional
+
+
+class AddressBook:
+    """In-process cache of the account table, both address -> id and id -> address.
+
+    Every address column of the schema stores the INTEGER id of the
+    address's account row, so rows and indexes hold small integers instead
+    of 42 character strings. dapp.db converts at its boundary and its
+    callers keep passing and getting checksum addresses.
+
+    Entries learnt inside a transaction stay pending until it commits: a
+    rollback may undo the account row, and SQLite would hand its id out
+    again to another address.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._addresses = {}
+        self._pending_ids = {}
+        self._pending_addresses = {}
+
+    def __contains__(self, address) -> bool:
+        return address in self._ids
+
+    def _remember(self, connection, address, account_id):
+        if connection.in_transaction:
+            self._pending_ids[address] = account_id
+            self._pending_addresses[account_id] = address
+        else:
+            self._ids[address] = account_id
+            self._addresses[account_id] = address
+
+    def id_of(self, connection, address, create=False) -> Optional[int]:
+        """Id of the address, or None if it has no account row and not create."""
+        account_id = self._ids.get(address)
+        if account_id is None:
+            account_id = self._pending_ids.get(address)
+        if account_id is not None:
+            return account_id
+        cursor = connection.cursor()
+        cursor.execute("SELECT id FROM account WHERE address = ?", (address,))
+        row = cursor.fetchone()
+        if row is not None:
+            account_id = row[0]
+        elif create:
+            cursor.execute("INSERT INTO account (address) VALUES (?)", (address,))
+            account_id = cursor.lastrowid
+        else:
+            return None
+        self._remember(connection, address, account_id)
+        return account_id
+
+    def address_of(self, connection, account_id) -> str:
+        address = self._addresses.get(account_id)
+        if address is None:
+            address = self._pending_addresses.get(account_id)
+        if address is not None:
+            return address
+        cursor = connection.cursor()
+        cursor.execute("SELECT address FROM account WHERE id = ?", (account_id,))
+        row = cursor.fetchone()
+        if row is None:
+            raise LookupError(f"No account with id {account_id}")
+        self._remember(connection, row[0], account_id)
+        return row[0]
+
+    def commit(self):
+        self._ids.update(self._pending_ids)
+        self._addresses.update(self._pending_addresses)
+        self.rollback()
+
+    def rollback(self):
+        self._pending_ids = {}
+        self._pending_addresses = {}
+
+
+def get_address_book(connection) -> AddressBook:
+    """The connection's AddressBook.
+
+    A plain sqlite3 connection cannot hold one, so it gets a new, empty
+    book on every call and each lookup goes to the account table.
+    """
+    book = getattr(connection, "addresses", None)
+    if book is None:
+        book = AddressBook()
+        try:
+            connection.addresses = book
+        except AttributeError:
+            pass
+    return book
+
+
+def get_address_id(connection, address) -> Optional[int]:
+    """Id of an existing address, None if it was never stored."""
+    return get_address_book(connection).id_of(connection, address)
+
+
+def get_address(connection, account_id) -> str:
+    return get_address_book(connection).address_of(connection, account_id)
@@ -1,17 +1,36 @@
-import requests
-from dapp.logger import logger
-from dapp.handlers import handle
-from dapp.util import rollup_server
+from dapp.db import get_connection_manager, sync_flow_tables
+from dapp.reports import get_report_policy
+from dapp.rollup import get_rollup_client
+from dapp.settlement import get_archive_batch_size, get_settlement_interval
+from dapp.storage import get_storage_profile
+from sqlite import migrate_db
 
 
-finish = {"status": "accept"}
+def main():
+    # A bad STORAGE_PROFILE fails here, before the database is opened
+    get_storage_profile()
+    # Open and migrate the database before the first finish so no input pays for it
+    connection = get_connection_manager().connection
+    migrate_db(connection)
+    sync_flow_tables(connection)
+    # Fail at boot on a bad REPORT_POLICY, SETTLEMENT_INTERVAL or
+    # ARCHIVE_BATCH_SIZE rather than rejecting every input
+    get_report_policy()
+    get_settlement_interval()
+    get_archive_batch_size()
 
-while True:
-    logger.info("Sending finish")
-    response = requests.post(rollup_server + "/finish", json=finish)
-    logger.info(f"Received finish status {response.status_code}")
-    if response.status_code == 202:
-        logger.info("No pending rollup request, trying again")
-    else:
-        rollup_request = response.json()
-        finish["status"] = handle(rollup_request)
+    rollup_client = get_rollup_client()
+    status = "accept"
+    handle = None
+
+    while True:
+        rollup_request = rollup_client.finish(status)
+        if handle is None:
+            # The handlers pull in eth_abi and eth_utils. Importing them after
+            # the first finish keeps that cost off the machine's boot path.
+            from dapp.handlers import handle
+        status = handle(rollup_request)
+
+
+if __name__ == "__main__":
+    main()
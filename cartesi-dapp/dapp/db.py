@@ -1,75 +1,410 @@
 import os
 import sqlite3
-from typing import List, Tuple
-import unittest
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from dapp.addresses import get_address, get_address_book, get_address_id
+from dapp.flowrate import (
+    add_stream_flows,
+    get_stream_engine,
+    rebuild_flows,
+    remove_stream_flows,
+)
+from dapp.schedule import ScheduleCache, VestingSchedule
+from dapp.storage import (
+    READER_PRAGMAS,
+    WRITER_PRAGMAS,
+    apply_pragmas,
+    get_storage_profile,
+)
 from dapp.stream import Stream
-from dapp.util import int_to_str, str_to_int, to_checksum_address
+from dapp.util import (
+    STREAM_IDS_CHUNK,
+    bytes32_to_int,
+    int_to_bytes32,
+    int_to_signed_bytes32,
+    signed_bytes32_to_int,
+    to_checksum_address,
+)
 from dataclasses import dataclass
 
+# SQLite's default per-connection statement cache (128) is smaller than the
+# number of distinct statements a single advance can run through.
+CACHED_STATEMENTS = 512
 
-def get_connection():
+
+class DappConnection(sqlite3.Connection):
+    """sqlite3 connection that can carry the unit of work of the current input."""
+
+    unit_of_work = None
+    schedules = None
+    # AddressBook of the account ids this connection has read or written
+    addresses = None
+    # Whether stream writes keep the flow tables of dapp.flowrate up to date
+    flow_engine = None
+
+    def commit(self):
+        super().commit()
+        if self.addresses is not None:
+            self.addresses.commit()
+
+    def rollback(self):
+        # Cached schedules may hold stream changes that are being undone
+        self.schedules = None
+        super().rollback()
+        if self.addresses is not None:
+            self.addresses.rollback()
+
+
+def get_connection(cached_statements=CACHED_STATEMENTS):
     db_file_path = os.getenv("DB_FILE_PATH", "dapp.sqlite")
-    conn = sqlite3.connect(db_file_path)
-    # run only if not in a test unnitest
-    if not unittest.TestCase.run:
-        cursor = conn.cursor()
-        cursor.execute("PRAGMA foreign_keys = ON")
-        cursor.execute("PRAGMA journal_mode = WAL")
+    conn = sqlite3.connect(
+        db_file_path, cached_statements=cached_statements, factory=DappConnection
+    )
+    conn.flow_engine = get_stream_engine() == "flowrate"
+    apply_pragmas(conn, WRITER_PRAGMAS[get_storage_profile()])
     return conn
 
 
-def create_account_if_not_exists(connection, address):
-    cursor = connection.cursor()
-    cursor.execute(
-        """
-        INSERT OR IGNORE INTO account (address) VALUES (?)
-        """,
-        (address,),
+def get_readonly_connection(cached_statements=CACHED_STATEMENTS):
+    """Connection that can only read, for the indexer.
+
+    It never takes the write lock, so it reads next to the dapp's writer.
+    """
+    db_file_path = os.getenv("DB_FILE_PATH", "dapp.sqlite")
+    conn = sqlite3.connect(
+        f"file:{db_file_path}?mode=ro",
+        uri=True,
+        cached_statements=cached_statements,
+        factory=DappConnection,
     )
+    conn.flow_engine = get_stream_engine() == "flowrate"
+    apply_pragmas(conn, READER_PRAGMAS[get_storage_profile()])
+    return conn
+
+
+class AddressRegistry:
+    """Tokens known to have a row in the database.
+
+    Loaded once per connection so that write paths can skip the
+    INSERT OR IGNORE for tokens that already exist. Only tokens created by
+    committed advances are added to it. Known accounts live in the
+    connection's AddressBook.
+    """
+
+    def __init__(self, connection):
+        cursor = connection.cursor()
+        cursor.execute(
+            """
+            SELECT account.address FROM token
+            JOIN account ON account.id = token.id
+            """
+        )
+        self.tokens = {row[0] for row in cursor}
+        self.inputs = 0
+        self.skipped_upserts = 0
+
+    def promote(self, unit_of_work):
+        self.tokens.update(unit_of_work.new_tokens)
+        self.inputs += 1
+        self.skipped_upserts += unit_of_work.skipped_upserts
+
+    def skipped_upserts_per_input(self) -> float:
+        return self.skipped_upserts / self.inputs if self.inputs else 0.0
+
+
+class UnitOfWork:
+    """Write-behind cache for token totals and balances during one advance.
+
+    Reads of the token and balance rows are served from memory after the
+    first SELECT and writes only mark rows dirty. The dirty rows are written
+    with one executemany per table by flush(), right before the commit.
+    Tokens created during the input are tracked separately so the registry
+    only learns about them once the transaction commits.
+    """
+
+    def __init__(self, registry: AddressRegistry = None):
+        self._registry = registry
+        self._token_totals = {}
+        self._shares = {}
+        self._dirty_tokens = {}
+        self._dirty_shares = {}
+        self.new_tokens = {}
+        self.skipped_upserts = 0
+
+    def token_exists(self, address) -> bool:
+        if address in self.new_tokens or (
+            self._registry is not None and address in self._registry.tokens
+        ):
+            self.skipped_upserts += 1
+            return True
+        return False
+
+    def add_token(self, address):
+        self.new_tokens[address] = True
+
+    def get_token_totals(self, connection, token_address) -> List[int]:
+        totals = self._token_totals.get(token_address)
+        if totals is None:
+            cursor = connection.cursor()
+            cursor.execute(
+                """
+                SELECT total_assets, total_shares FROM token
+                WHERE id = ?
+                """,
+                (get_address_id(connection, token_address),),
+            )
+            row = cursor.fetchone()
+            totals = [bytes32_to_int(row[0]), bytes32_to_int(row[1])] if row else [0, 0]
+            self._token_totals[token_address] = totals
+        return totals
+
+    def set_token_totals(
+        self, connection, token_address, total_assets=None, total_shares=None
+    ):
+        totals = self.get_token_totals(connection, token_address)
+        if total_assets is not None:
+            totals[0] = total_assets
+        if total_shares is not None:
+            totals[1] = total_shares
+        self._dirty_tokens[token_address] = True
+
+    def get_shares(self, connection, account_address, token_address) -> int:
+        key = (account_address, token_address)
+        shares = self._shares.get(key)
+        if shares is None:
+            cursor = connection.cursor()
+            cursor.execute(
+                """
+                SELECT shares FROM balance
+                WHERE account_id = ? AND token_id = ?
+                """,
+                (
+                    get_address_id(connection, account_address),
+                    get_address_id(connection, token_address),
+                ),
+            )
+            row = cursor.fetchone()
+            shares = signed_bytes32_to_int(row[0]) if row else 0
+            self._shares[key] = shares
+        return shares
+
+    def set_shares(self, account_address, token_address, shares):
+        key = (account_address, token_address)
+        self._shares[key] = shares
+        self._dirty_shares[key] = True
+
+    def token_shares(self, token_address):
+        """Shares read or written during this input for one token."""
+        for (account_address, key_token), shares in self._shares.items():
+            if key_token == token_address:
+                yield account_address, shares
+
+    def flush(self, connection):
+        tokens = {}
+        for _, token_address in self._dirty_shares:
+            if token_address not in self._dirty_tokens:
+                tokens[token_address] = True
+        tokens = [address for address in tokens if not self.token_exists(address)]
+
+        cursor = connection.cursor()
+        cursor.executemany(
+            """
+            INSERT OR IGNORE INTO token (id, total_assets, total_shares)
+            VALUES (?, ?, ?)
+            """,
+            [
+                (
+                    create_account_if_not_exists(connection, address),
+                    int_to_bytes32(0),
+                    int_to_bytes32(0),
+                )
+                for address in tokens
+            ],
+        )
+        for address in tokens:
+            self.add_token(address)
+        cursor.executemany(
+            """
+            INSERT INTO token (id, total_assets, total_shares)
+            VALUES (?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                total_assets = excluded.total_assets,
+                total_shares = excluded.total_shares
+            """,
+            [
+                (
+                    create_account_if_not_exists(connection, address),
+                    int_to_bytes32(self._token_totals[address][0]),
+                    int_to_bytes32(self._token_totals[address][1]),
+                )
+                for address in self._dirty_tokens
+            ],
+        )
+        for address in self._dirty_tokens:
+            self.add_token(address)
+        cursor.executemany(
+            """
+            INSERT INTO balance (account_id, token_id, shares)
+            VALUES (?, ?, ?)
+            ON CONFLICT(account_id, token_id)
+            DO UPDATE SET shares = EXCLUDED.shares
+            """,
+            [
+                (
+                    create_account_if_not_exists(connection, key[0]),
+                    create_account_if_not_exists(connection, key[1]),
+                    int_to_signed_bytes32(self._shares[key]),
+                )
+                for key in self._dirty_shares
+            ],
+        )
+        self._dirty_tokens = {}
+        self._dirty_shares = {}
+
+
+def get_unit_of_work(connection):
+    return getattr(connection, "unit_of_work", None)
+
+
+class ConnectionManager:
+    """Owns the single long-lived connection used by the dapp process.
+
+    Opening the database once keeps the PRAGMAs and the prepared statement
+    cache alive across rollup inputs. Each advance runs in its own
+    transaction with a fresh UnitOfWork. Each inspect runs read-only in a
+    savepoint that is always rolled back.
+    """
+
+    def __init__(self, cached_statements=CACHED_STATEMENTS):
+        self._cached_statements = cached_statements
+        self._connection = None
+        self._registry = None
+
+    @property
+    def registry(self) -> AddressRegistry:
+        if self._registry is None:
+            self._registry = AddressRegistry(self.connection)
+        return self._registry
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            self._connection = get_connection(self._cached_statements)
+        return self._connection
+
+    @contextmanager
+    def advance(self):
+        connection = self.connection
+        registry = self.registry
+        connection.execute("BEGIN")
+        unit_of_work = connection.unit_of_work = UnitOfWork(registry)
+        try:
+            yield connection
+            unit_of_work.flush(connection)
+        except BaseException:
+            connection.rollback()
+            raise
+        finally:
+            connection.unit_of_work = None
+        connection.commit()
+        registry.promote(unit_of_work)
+
+    @contextmanager
+    def inspect(self):
+        connection = self.connection
+        connection.execute("SAVEPOINT inspect")
+        connection.execute("PRAGMA query_only = ON")
+        try:
+            yield connection
+        finally:
+            connection.execute("PRAGMA query_only = OFF")
+            connection.execute("ROLLBACK TO SAVEPOINT inspect")
+            connection.execute("RELEASE SAVEPOINT inspect")
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+        self._registry = None
+
+
+_connection_manager = None
+
+
+def get_connection_manager() -> ConnectionManager:
+    global _connection_manager
+    if _connection_manager is None:
+        _connection_manager = ConnectionManager()
+    return _connection_manager
+
+
+def close_connection_manager():
+    global _connection_manager
+    if _connection_manager is not None:
+        _connection_manager.close()
+        _connection_manager = None
+
+
+def create_account_if_not_exists(connection, address) -> int:
+    """Id of the address's account row, inserted if it is missing."""
+    return get_address_book(connection).id_of(connection, address, create=True)
 
 
 def create_token_if_not_exists(
     connection, token_address, default_total_assets=0, default_total_shares=0
-):
-    create_account_if_not_exists(connection, token_address)
+) -> int:
+    token_id = create_account_if_not_exists(connection, token_address)
+    unit_of_work = get_unit_of_work(connection)
+    if unit_of_work is not None and unit_of_work.token_exists(token_address):
+        return token_id
+    if unit_of_work is not None:
+        unit_of_work.add_token(token_address)
     cursor = connection.cursor()
     cursor.execute(
         """
-        INSERT OR IGNORE INTO token (address, total_assets, total_shares)
+        INSERT OR IGNORE INTO token (id, total_assets, total_shares)
         VALUES (?, ?, ?)
         """,
         (
-            token_address,
-            int_to_str(default_total_assets),
-            int_to_str(default_total_shares),
+            token_id,
+            int_to_bytes32(default_total_assets),
+            int_to_bytes32(default_total_shares),
         ),
     )
+    return token_id
 
 
 def create_pair_if_not_exists(
     connection, token_address, token_0_address, token_1_address
 ):
-    create_token_if_not_exists(connection, token_address)
+    token_id = create_token_if_not_exists(connection, token_address)
     cursor = connection.cursor()
     cursor.execute(
         """
-        INSERT OR IGNORE INTO pair (address, token_0_address, token_1_address)
+        INSERT OR IGNORE INTO pair (token_id, token_0_id, token_1_id)
         VALUES (?, ?, ?)
         """,
-        (token_address, token_0_address, token_1_address),
+        (
+            token_id,
+            create_account_if_not_exists(connection, token_0_address),
+            create_account_if_not_exists(connection, token_1_address),
+        ),
     )
     return cursor.lastrowid
 
 
-def stream_from_row(row) -> Stream:
+def stream_from_row(connection, row) -> Stream:
+    """Stream of a stream row, with its account ids turned back into addresses."""
+    book = get_address_book(connection)
     return Stream(
         stream_id=row[0],
-        from_address=row[1],
-        to_address=row[2],
+        from_address=book.address_of(connection, row[1]),
+        to_address=book.address_of(connection, row[2]),
         start_timestamp=row[3],
         duration=row[4],
-        amount=str_to_int(row[5]),
-        token_address=row[6],
+        amount=bytes32_to_int(row[5]),
+        token_address=book.address_of(connection, row[6]),
         accrued=True if row[7] == 1 else False,
         swap_id=row[8] if len(row) > 8 else None,
     )
@@ -82,23 +417,35 @@ def get_wallet_non_accrued_streamed_amts(
     until_timestamp,
     recipient_until_timestamp=0,
 ):
-    create_account_if_not_exists(connection, account_address)
-    create_token_if_not_exists(connection, token_address)
+    account_id = get_address_id(connection, account_address)
+    token_id = get_address_id(connection, token_address)
     cursor = connection.cursor()
     cursor.execute(
         """
-        SELECT start_timestamp, duration, amount, to_address
+        SELECT start_timestamp, duration, amount, 0
         FROM stream
-        WHERE (from_address = ? OR to_address = ?) AND token_address = ? AND accrued = 0
+        WHERE from_id = ? AND token_id = ? AND accrued = 0
+        AND start_timestamp <= ? AND to_id != ?
+        UNION ALL
+        SELECT start_timestamp, duration, amount, 1
+        FROM stream
+        WHERE to_id = ? AND token_id = ? AND accrued = 0
         AND start_timestamp <= ?
         """,
-        (account_address, account_address, token_address, until_timestamp),
+        (
+            account_id,
+            token_id,
+            until_timestamp,
+            account_id,
+            account_id,
+            token_id,
+            until_timestamp,
+        ),
     )
 
     for row in cursor:
-        start_timestamp, duration, amount, to_address = row
-        amount = int(amount)
-        is_recipient = to_address == account_address
+        start_timestamp, duration, amount, is_recipient = row
+        amount = bytes32_to_int(amount)
         effective_until = recipient_until_timestamp if is_recipient else until_timestamp
 
         if effective_until < start_timestamp:
@@ -112,24 +459,368 @@ def get_wallet_non_accrued_streamed_amts(
         yield (streamed_amount if is_recipient else -streamed_amount)
 
 
-def get_wallet_streams(connection, account_address, token_address) -> List[Stream]:
-    create_account_if_not_exists(connection, account_address)
-    create_token_if_not_exists(connection, token_address)
+def get_wallet_streamed_amount(
+    connection,
+    account_address,
+    token_address,
+    until_timestamp,
+    recipient_until_timestamp=0,
+) -> int:
+    """Net amount streamed to (positive) or from (negative) a wallet.
+
+    Equal to summing get_wallet_non_accrued_streamed_amts, but SQL splits the
+    streams into fully vested ones, whose amounts are just added up, and
+    partially vested ones, which need the per-row floor division. Streams
+    that have not started are never read.
+    """
+    # Incoming streams are evaluated at recipient_until_timestamp but, like
+    # in the generator, only those started by until_timestamp count.
+    incoming_start_until = min(until_timestamp, recipient_until_timestamp)
+    account_id = get_address_id(connection, account_address)
+    token_id = get_address_id(connection, token_address)
     cursor = connection.cursor()
     cursor.execute(
         """
-        SELECT * FROM stream
-        WHERE (from_address = ? OR to_address = ?) AND token_address = ?
+        SELECT amount, 0
+        FROM stream
+        WHERE from_id = ? AND token_id = ? AND accrued = 0
+        AND end_timestamp <= ? AND to_id != ?
+        UNION ALL
+        SELECT amount, 1
+        FROM stream
+        WHERE to_id = ? AND token_id = ? AND accrued = 0
+        AND end_timestamp <= ? AND start_timestamp <= ?
         """,
-        (account_address, account_address, token_address),
+        (
+            account_id,
+            token_id,
+            until_timestamp,
+            account_id,
+            account_id,
+            token_id,
+            recipient_until_timestamp,
+            incoming_start_until,
+        ),
     )
-    rows = cursor.fetchall()
+    streamed = 0
+    for amount, is_recipient in cursor:
+        if is_recipient:
+            streamed += bytes32_to_int(amount)
+        else:
+            streamed -= bytes32_to_int(amount)
 
-    streams = []
-    for row in rows:
-        streams.append(stream_from_row(row))
+    cursor.execute(
+        """
+        SELECT start_timestamp, duration, amount, 0
+        FROM stream
+        WHERE from_id = ? AND token_id = ? AND accrued = 0
+        AND end_timestamp > ? AND start_timestamp <= ?
+        AND to_id != ?
+        UNION ALL
+        SELECT start_timestamp, duration, amount, 1
+        FROM stream
+        WHERE to_id = ? AND token_id = ? AND accrued = 0
+        AND end_timestamp > ? AND start_timestamp <= ?
+        """,
+        (
+            account_id,
+            token_id,
+            until_timestamp,
+            until_timestamp,
+            account_id,
+            account_id,
+            token_id,
+            recipient_until_timestamp,
+            incoming_start_until,
+        ),
+    )
+    for start_timestamp, duration, amount, is_recipient in cursor:
+        if is_recipient:
+            elapsed = recipient_until_timestamp - start_timestamp
+            streamed += (bytes32_to_int(amount) * elapsed) // duration
+        else:
+            elapsed = until_timestamp - start_timestamp
+            streamed -= (bytes32_to_int(amount) * elapsed) // duration
+
+    return streamed
+
+
+def get_token_shares(connection, token_address) -> Dict[str, int]:
+    """Stored shares of every account holding token_address."""
+    cursor = connection.cursor()
+    cursor.execute(
+        """
+        SELECT account_id, shares FROM balance
+        WHERE token_id = ?
+        """,
+        (get_address_id(connection, token_address),),
+    )
+    book = get_address_book(connection)
+    shares_by_account = {
+        book.address_of(connection, account_id): signed_bytes32_to_int(shares)
+        for account_id, shares in cursor.fetchall()
+    }
+    unit_of_work = get_unit_of_work(connection)
+    if unit_of_work is not None:
+        shares_by_account.update(unit_of_work.token_shares(token_address))
+    return shares_by_account
+
+
+def get_token_streamed_amounts(connection, token_address, until_timestamp):
+    """Net non-accrued amount streamed to or from each wallet of a token.
+
+    One scan over the token's live streams gives, for every address that
+    sends or receives one, what get_wallet_streamed_amount returns for it
+    with recipient_until_timestamp equal to until_timestamp. As there, a
+    stream to oneself only counts as received.
+    """
+    cursor = connection.cursor()
+    cursor.execute(
+        """
+        SELECT from_id, to_id, start_timestamp, end_timestamp, duration, amount
+        FROM stream
+        WHERE token_id = ? AND accrued = 0 AND start_timestamp <= ?
+        ORDER BY id
+        """,
+        (get_address_id(connection, token_address), until_timestamp),
+    )
+    streamed_by_id = {}
+    for (
+        from_id,
+        to_id,
+        start_timestamp,
+        end_timestamp,
+        duration,
+        amount,
+    ) in cursor:
+        amount = bytes32_to_int(amount)
+        if end_timestamp > until_timestamp:
+            amount = (amount * (until_timestamp - start_timestamp)) // duration
+        if from_id != to_id:
+            streamed_by_id[from_id] = streamed_by_id.get(from_id, 0) - amount
+        streamed_by_id[to_id] = streamed_by_id.get(to_id, 0) + amount
+    book = get_address_book(connection)
+    return {
+        book.address_of(connection, account_id): streamed
+        for account_id, streamed in streamed_by_id.items()
+    }
+
+
+def uses_flow_engine(connection) -> bool:
+    """Whether stream writes keep the flow tables of dapp.flowrate up to date.
+
+    A plain sqlite3 connection follows STREAM_ENGINE, as get_connection() does.
+    """
+    flow_engine = getattr(connection, "flow_engine", None)
+    if flow_engine is None:
+        flow_engine = get_stream_engine() == "flowrate"
+    return flow_engine
+
+
+def get_schedule_cache(connection) -> ScheduleCache:
+    """The connection's schedule cache, a new one per call on a plain connection."""
+    data_version = connection.execute("PRAGMA data_version").fetchone()[0]
+    schedules = getattr(connection, "schedules", None)
+    if schedules is None or schedules.data_version != data_version:
+        schedules = ScheduleCache(data_version)
+        if isinstance(connection, DappConnection):
+            connection.schedules = schedules
+    return schedules
+
+
+def drop_schedules(connection) -> None:
+    if getattr(connection, "schedules", None) is not None:
+        connection.schedules = None
+
+
+def get_vesting_schedule(connection, account_address, token_address) -> VestingSchedule:
+    """Cached schedule of the wallet's non-accrued streams of a token."""
+    schedules = get_schedule_cache(connection)
+    schedule = schedules.get(account_address, token_address)
+    if schedule is not None:
+        return schedule
+    account_id = get_address_id(connection, account_address)
+    token_id = get_address_id(connection, token_address)
+    cursor = connection.cursor()
+    cursor.execute(
+        """
+        SELECT id, from_id, to_id, start_timestamp, duration, amount, token_id, accrued
+        FROM stream
+        WHERE from_id = ? AND token_id = ? AND accrued = 0
+        UNION ALL
+        SELECT id, from_id, to_id, start_timestamp, duration, amount, token_id, accrued
+        FROM stream
+        WHERE to_id = ? AND token_id = ? AND accrued = 0
+        AND from_id != ?
+        """,
+        (account_id, token_id, account_id, token_id, account_id),
+    )
+    return schedules.put(
+        token_address,
+        VestingSchedule(
+            account_address,
+            (stream_from_row(connection, row) for row in cursor.fetchall()),
+        ),
+    )
+
+
+def get_wallet_received_amount(
+    connection, account_address, token_address, until_timestamp
+) -> int:
+    """Amount the wallet's non-accrued incoming streams have paid by until_timestamp."""
+    cursor = connection.cursor()
+    cursor.execute(
+        """
+        SELECT start_timestamp, end_timestamp, duration, amount
+        FROM stream
+        WHERE to_id = ? AND token_id = ? AND accrued = 0
+        AND start_timestamp <= ?
+        """,
+        (
+            get_address_id(connection, account_address),
+            get_address_id(connection, token_address),
+            until_timestamp,
+        ),
+    )
+    received = 0
+    for start_timestamp, end_timestamp, duration, amount in cursor:
+        if end_timestamp <= until_timestamp:
+            received += bytes32_to_int(amount)
+        else:
+            elapsed = until_timestamp - start_timestamp
+            received += (bytes32_to_int(amount) * elapsed) // duration
+    return received
+
+
+def get_wallet_streams(
+    connection,
+    account_address,
+    token_address,
+    include_archived=False,
+    after_id=0,
+    limit=None,
+) -> List[Stream]:
+    """The wallet's streams of a token in id order, starting after after_id.
+
+    Archived streams are only read with include_archived. limit pages
+    through long histories: pass the last id returned as the next after_id.
+    """
+    branches = [
+        """
+        SELECT id, from_id, to_id, start_timestamp, duration, amount, token_id, accrued, swap_id
+        FROM stream
+        WHERE from_id = ? AND token_id = ? AND id > ?
+        UNION ALL
+        SELECT id, from_id, to_id, start_timestamp, duration, amount, token_id, accrued, swap_id
+        FROM stream
+        WHERE to_id = ? AND token_id = ? AND from_id != ? AND id > ?
+        """
+    ]
+    if include_archived:
+        branches.append(
+            """
+        SELECT id, from_id, to_id, start_timestamp, duration, amount, token_id, 1, NULL
+        FROM stream_archive
+        WHERE from_id = ? AND token_id = ? AND id > ?
+        UNION ALL
+        SELECT id, from_id, to_id, start_timestamp, duration, amount, token_id, 1, NULL
+        FROM stream_archive
+        WHERE to_id = ? AND token_id = ? AND from_id != ? AND id > ?
+        """
+        )
+    account_id = get_address_id(connection, account_address)
+    token_id = get_address_id(connection, token_address)
+    params = (
+        account_id,
+        token_id,
+        after_id,
+        account_id,
+        token_id,
+        account_id,
+        after_id,
+    )
+    cursor = connection.cursor()
+    cursor.execute(
+        " UNION ALL ".join(branches) + " ORDER BY id LIMIT ?",
+        params * len(branches) + (-1 if limit is None else limit,),
+    )
+    return [stream_from_row(connection, row) for row in cursor.fetchall()]
 
-    return streams
+
+def archive_accrued_streams(connection, limit: int) -> int:
+    """Moves up to limit accrued, non-swap streams to stream_archive, oldest first.
+
+    Accrued streams are no longer part of any balance, so only history
+    reads with include_archived see them afterwards. Returns how many moved.
+    """
+    cursor = connection.cursor()
+    cursor.execute(
+        """
+        INSERT INTO stream_archive (id, from_id, to_id, start_timestamp, duration, amount, token_id)
+        SELECT id, from_id, to_id, start_timestamp, duration, amount, token_id
+        FROM stream
+        WHERE accrued = 1 AND swap_id IS NULL
+        ORDER BY id
+        LIMIT ?
+        """,
+        (limit,),
+    )
+    archived = cursor.rowcount
+    if archived:
+        cursor.execute(
+            """
+            DELETE FROM stream
+            WHERE id IN (
+                SELECT id FROM stream
+                WHERE accrued = 1 AND swap_id IS NULL
+                ORDER BY id
+                LIMIT ?
+            )
+            """,
+            (archived,),
+        )
+    return archived
+
+
+def get_dapp_state(connection, name: str) -> Optional[str]:
+    cursor = connection.cursor()
+    cursor.execute("SELECT value FROM dapp_state WHERE name = ?", (name,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def set_dapp_state(connection, name: str, value: str) -> None:
+    cursor = connection.cursor()
+    cursor.execute(
+        """
+        INSERT INTO dapp_state (name, value) VALUES (?, ?)
+        ON CONFLICT(name) DO UPDATE SET value = EXCLUDED.value
+        """,
+        (name, value),
+    )
+
+
+# dapp_state row holding the STREAM_ENGINE the flow tables were kept for
+FLOW_TABLES_ENGINE = "flow_tables_engine"
+
+
+def sync_flow_tables(connection) -> bool:
+    """Rebuilds the flow tables at boot if they may be stale.
+
+    Stream writes only keep them up to date while the flowrate engine is
+    on, so they are rebuilt when it is turned on after running without it,
+    or on a database that never had it. The engine is recorded either way.
+    Returns whether they were rebuilt.
+    """
+    engine = "flowrate" if uses_flow_engine(connection) else "rows"
+    rebuilt = False
+    if get_dapp_state(connection, FLOW_TABLES_ENGINE) != engine:
+        if uses_flow_engine(connection):
+            rebuild_flows(connection)
+            rebuilt = True
+        set_dapp_state(connection, FLOW_TABLES_ENGINE, engine)
+        connection.commit()
+    return rebuilt
 
 
 def get_dapp_addresses(connection) -> Tuple[str, str, str]:
@@ -224,15 +915,23 @@ def get_yield_bridge(connection):
 
 
 def get_max_end_timestamp_for_wallet(connection, account_address):
-    create_account_if_not_exists(connection, account_address)
+    """Latest end of the wallet's streams, archived ones included.
+
+    future_balance_of and future_get_streams default to it, so archiving a
+    stream must not move it.
+    """
+    account_id = get_address_id(connection, account_address)
     cursor = connection.cursor()
     cursor.execute(
         """
-        SELECT MAX(start_timestamp + duration)
-        FROM stream
-        WHERE (from_address = ? OR to_address = ?)
+        SELECT MAX(
+            COALESCE((SELECT MAX(end_timestamp) FROM stream WHERE from_id = ?), 0),
+            COALESCE((SELECT MAX(end_timestamp) FROM stream WHERE to_id = ?), 0),
+            COALESCE((SELECT MAX(start_timestamp + duration) FROM stream_archive WHERE from_id = ?), 0),
+            COALESCE((SELECT MAX(start_timestamp + duration) FROM stream_archive WHERE to_id = ?), 0)
+        )
         """,
-        (account_address, account_address),
+        (account_id, account_id, account_id, account_id),
     )
 
     result = cursor.fetchone()
@@ -243,25 +942,68 @@ def get_max_end_timestamp_for_wallet(connection, account_address):
 def get_wallet_endend_streams(
     connection, account_address, token_address, current_timestamp
 ) -> List[Stream]:
-    create_account_if_not_exists(connection, account_address)
-    create_token_if_not_exists(connection, token_address)
+    account_id = get_address_id(connection, account_address)
+    token_id = get_address_id(connection, token_address)
     cursor = connection.cursor()
     cursor.execute(
         """
         SELECT * FROM stream
-        WHERE (from_address = ? OR to_address = ?) AND token_address = ? AND start_timestamp + duration <= ? AND accrued = 0 AND swap_id IS NULL
+        WHERE from_id = ? AND token_id = ? AND accrued = 0
+        AND end_timestamp <= ? AND swap_id IS NULL
+        UNION ALL
+        SELECT * FROM stream
+        WHERE to_id = ? AND token_id = ? AND accrued = 0
+        AND end_timestamp <= ? AND swap_id IS NULL AND from_id != ?
+        ORDER BY id
         """,
-        (account_address, account_address, token_address, current_timestamp),
+        (
+            account_id,
+            token_id,
+            current_timestamp,
+            account_id,
+            token_id,
+            current_timestamp,
+            account_id,
+        ),
     )
     rows = cursor.fetchall()
 
     streams = []
     for row in rows:
-        streams.append(stream_from_row(row))
+        streams.append(stream_from_row(connection, row))
 
     return streams
 
 
+def get_token_ended_streams(
+    connection, token_address, current_timestamp
+) -> List[Stream]:
+    """Every non-accrued, non-swap stream of the token ended by current_timestamp."""
+    cursor = connection.cursor()
+    cursor.execute(
+        """
+        SELECT * FROM stream
+        WHERE token_id = ? AND accrued = 0
+        AND end_timestamp <= ? AND swap_id IS NULL
+        ORDER BY id
+        """,
+        (get_address_id(connection, token_address), current_timestamp),
+    )
+    return [stream_from_row(connection, row) for row in cursor.fetchall()]
+
+
+def get_token_addresses(connection) -> List[str]:
+    cursor = connection.cursor()
+    cursor.execute(
+        """
+        SELECT account.address FROM token
+        JOIN account ON account.id = token.id
+        ORDER BY account.address
+        """
+    )
+    return [row[0] for row in cursor]
+
+
 def get_stream_by_id(connection, stream_id) -> Stream:
     cursor = connection.cursor()
     cursor.execute(
@@ -274,77 +1016,135 @@ def get_stream_by_id(connection, stream_id) -> Stream:
     row = cursor.fetchone()
 
     if row is not None:
-        return stream_from_row(row)
+        return stream_from_row(connection, row)
     else:
         return None
 
 
 def get_user_shares(connection, account_address, token_address) -> int:
-    create_account_if_not_exists(connection, account_address)
-    create_token_if_not_exists(connection, token_address)
+    unit_of_work = get_unit_of_work(connection)
+    if unit_of_work is not None:
+        return unit_of_work.get_shares(connection, account_address, token_address)
     cursor = connection.cursor()
     cursor.execute(
         """
         SELECT shares FROM balance
-        WHERE account_address = ? AND token_address = ?
+        WHERE account_id = ? AND token_id = ?
         """,
-        (account_address, token_address),
+        (
+            get_address_id(connection, account_address),
+            get_address_id(connection, token_address),
+        ),
     )
     row = cursor.fetchone()
 
-    return str_to_int(row[0]) if row else 0
+    return signed_bytes32_to_int(row[0]) if row else 0
 
 
 def set_users_shares(connection, account_address, token_address, shares) -> None:
-    create_account_if_not_exists(connection, account_address)
-    create_token_if_not_exists(connection, token_address)
+    unit_of_work = get_unit_of_work(connection)
+    if unit_of_work is not None:
+        return unit_of_work.set_shares(account_address, token_address, shares)
+    account_id = create_account_if_not_exists(connection, account_address)
+    token_id = create_token_if_not_exists(connection, token_address)
     cursor = connection.cursor()
     cursor.execute(
         """
-        INSERT INTO balance (account_address, token_address, shares)
+        INSERT INTO balance (account_id, token_id, shares)
+        VALUES (?, ?, ?)
+        ON CONFLICT(account_id, token_id)
+        DO UPDATE SET shares = EXCLUDED.shares
+        """,
+        (account_id, token_id, int_to_signed_bytes32(shares)),
+    )
+
+
+def set_users_shares_batch(connection, token_address, shares_by_account) -> None:
+    unit_of_work = get_unit_of_work(connection)
+    if unit_of_work is not None:
+        for account_address, shares in shares_by_account.items():
+            unit_of_work.set_shares(account_address, token_address, shares)
+        return
+    token_id = create_token_if_not_exists(connection, token_address)
+    cursor = connection.cursor()
+    cursor.executemany(
+        """
+        INSERT INTO balance (account_id, token_id, shares)
         VALUES (?, ?, ?)
-        ON CONFLICT(account_address, token_address)
+        ON CONFLICT(account_id, token_id)
         DO UPDATE SET shares = EXCLUDED.shares
         """,
-        (account_address, token_address, int_to_str(shares)),
+        [
+            (
+                create_account_if_not_exists(connection, account_address),
+                token_id,
+                int_to_signed_bytes32(shares),
+            )
+            for account_address, shares in shares_by_account.items()
+        ],
     )
 
 
 def add_stream(connection, stream) -> int:
-    create_account_if_not_exists(connection, stream.from_address)
-    create_account_if_not_exists(connection, stream.to_address)
-    create_token_if_not_exists(connection, stream.token_address)
+    from_id = create_account_if_not_exists(connection, stream.from_address)
+    to_id = create_account_if_not_exists(connection, stream.to_address)
+    token_id = create_token_if_not_exists(connection, stream.token_address)
     cursor = connection.cursor()
     cursor.execute(
         """
-        INSERT INTO stream (from_address, to_address, start_timestamp, duration, amount, token_address, accrued, swap_id)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        INSERT INTO stream (from_id, to_id, start_timestamp, duration, amount, token_id, accrued, swap_id, end_timestamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
         """,
         (
-            stream.from_address,
-            stream.to_address,
+            from_id,
+            to_id,
             stream.start_timestamp,
             stream.duration,
-            int_to_str(stream.amount),
-            stream.token_address,
+            int_to_bytes32(stream.amount),
+            token_id,
             1 if stream.accrued else 0,
             stream.swap_id,
+            stream.start_timestamp + stream.duration,
         ),
     )
 
+    if not stream.accrued and from_id != to_id:
+        add_committed_outflows(connection, {(from_id, token_id): stream.amount})
+    if uses_flow_engine(connection):
+        add_stream_flows(connection, [(cursor.lastrowid, stream)])
+    if getattr(connection, "schedules", None) is not None:
+        connection.schedules.stream_added(cursor.lastrowid, stream)
     return cursor.lastrowid
 
 
 def update_stream_amount_duration(connection, stream_id, duration, amount):
+    outflows = get_stream_outflows(connection, [stream_id])
     cursor = connection.cursor()
     cursor.execute(
         """
         UPDATE stream
-        SET duration = ?, amount = ?
+        SET duration = ?, amount = ?, end_timestamp = start_timestamp + ?
         WHERE id = ?
         """,
-        (duration, int_to_str(amount), stream_id),
+        (duration, int_to_bytes32(amount), duration, stream_id),
+    )
+    add_committed_outflows(
+        connection,
+        {key: amount - old_amount for key, old_amount in outflows.values()},
     )
+    if uses_flow_engine(connection):
+        update_stream_flows(connection, [stream_id])
+    if getattr(connection, "schedules", None) is not None:
+        connection.schedules.stream_updated(stream_id, duration, amount)
+
+
+def update_stream_flows(connection, stream_ids):
+    """Replaces the flows of the streams with their current rows."""
+    remove_stream_flows(connection, stream_ids)
+    streams = [
+        (stream_id, get_stream_by_id(connection, stream_id)) for stream_id in stream_ids
+    ]
+    add_stream_flows(connection, [item for item in streams if item[1] is not None])
 
 
 def merge_refunds(refunds):
@@ -422,14 +1222,14 @@ def create_swap_refunds(connection, refunds):
     cursor = connection.cursor()
     cursor.executemany(
         """
-        INSERT into swap_refund (swap_id, token_address, amount, start_timestamp, duration)
+        INSERT into swap_refund (swap_id, token_id, amount, start_timestamp, duration)
         VALUES (?, ?, ?, ?, ?)
         """,
         [
             (
                 refund[0],
-                refund[1],
-                int_to_str(refund[2]),
+                create_account_if_not_exists(connection, refund[1]),
+                int_to_bytes32(refund[2]),
                 refund[3],
                 refund[4],
             )
@@ -440,19 +1240,40 @@ def create_swap_refunds(connection, refunds):
 
 
 def update_stream_amount_duration_batch(connection, stream_durations_amounts_ids):
+    outflows = get_stream_outflows(
+        connection, [stream_id for _, _, stream_id in stream_durations_amounts_ids]
+    )
     cursor = connection.cursor()
     cursor.executemany(
         """
         UPDATE stream
-        SET duration = ?, amount = ?
+        SET duration = ?, amount = ?, end_timestamp = start_timestamp + ?
         WHERE id = ?
         """,
-        stream_durations_amounts_ids,
+        [
+            (duration, int_to_bytes32(amount), duration, stream_id)
+            for duration, amount, stream_id in stream_durations_amounts_ids
+        ],
     )
+    deltas = {}
+    for _, amount, stream_id in stream_durations_amounts_ids:
+        if stream_id in outflows:
+            key, old_amount = outflows[stream_id]
+            deltas[key] = deltas.get(key, 0) + amount - old_amount
+    add_committed_outflows(connection, deltas)
+    if uses_flow_engine(connection):
+        update_stream_flows(
+            connection, [stream_id for _, _, stream_id in stream_durations_amounts_ids]
+        )
+    if getattr(connection, "schedules", None) is not None:
+        for duration, amount, stream_id in stream_durations_amounts_ids:
+            connection.schedules.stream_updated(stream_id, duration, amount)
     return cursor.lastrowid
 
 
 def update_stream_accrued(connection, stream_id, accrued):
+    # Only a stream whose state changes moves the committed outflow
+    outflows = get_stream_outflows(connection, [stream_id], accrued=not accrued)
     cursor = connection.cursor()
     cursor.execute(
         """
@@ -462,9 +1283,107 @@ def update_stream_accrued(connection, stream_id, accrued):
         """,
         (1 if accrued else 0, stream_id),
     )
+    sign = -1 if accrued else 1
+    add_committed_outflows(
+        connection, {key: sign * amount for key, amount in outflows.values()}
+    )
+    if uses_flow_engine(connection):
+        update_stream_flows(connection, [stream_id])
+    if accrued and getattr(connection, "schedules", None) is not None:
+        connection.schedules.stream_removed(stream_id)
+    elif not accrued:
+        # The stream is not cached anywhere, so no schedule can be patched
+        drop_schedules(connection)
+
+
+def get_stream_outflows(connection, stream_ids, accrued=False):
+    """Maps each of the streams to others with the given accrued flag to
+    ((from_id, token_id), amount)."""
+    cursor = connection.cursor()
+    outflows = {}
+    for i in range(0, len(stream_ids), STREAM_IDS_CHUNK):
+        chunk = stream_ids[i : i + STREAM_IDS_CHUNK]
+        placeholders = ", ".join("?" * len(chunk))
+        cursor.execute(
+            f"""
+            SELECT id, from_id, token_id, amount FROM stream
+            WHERE id IN ({placeholders}) AND accrued = ?
+            AND from_id != to_id
+            """,
+            (*chunk, 1 if accrued else 0),
+        )
+        for stream_id, from_id, token_id, amount in cursor:
+            outflows[stream_id] = ((from_id, token_id), bytes32_to_int(amount))
+    return outflows
+
+
+def get_committed_outflow(connection, account_address, token_address) -> int:
+    """Sum of the amounts of the wallet's non-accrued streams to others."""
+    return _get_committed_outflow(
+        connection,
+        get_address_id(connection, account_address),
+        get_address_id(connection, token_address),
+    )
+
+
+def _get_committed_outflow(connection, account_id, token_id) -> int:
+    cursor = connection.cursor()
+    cursor.execute(
+        """
+        SELECT committed FROM stream_outflow
+        WHERE account_id = ? AND token_id = ?
+        """,
+        (account_id, token_id),
+    )
+    row = cursor.fetchone()
+    return bytes32_to_int(row[0]) if row else 0
+
+
+def add_committed_outflows(connection, deltas) -> None:
+    """Adds each delta to the committed outflow of its (account id, token id)."""
+    rows = []
+    for (account_id, token_id), delta in deltas.items():
+        if delta:
+            committed = _get_committed_outflow(connection, account_id, token_id)
+            rows.append((account_id, token_id, int_to_bytes32(committed + delta)))
+    connection.cursor().executemany(
+        """
+        INSERT INTO stream_outflow (account_id, token_id, committed)
+        VALUES (?, ?, ?)
+        ON CONFLICT(account_id, token_id)
+        DO UPDATE SET committed = EXCLUDED.committed
+        """,
+        rows,
+    )
+
+
+def update_streams_accrued(connection, stream_ids):
+    outflows = get_stream_outflows(connection, stream_ids)
+    cursor = connection.cursor()
+    for i in range(0, len(stream_ids), STREAM_IDS_CHUNK):
+        chunk = stream_ids[i : i + STREAM_IDS_CHUNK]
+        placeholders = ", ".join("?" * len(chunk))
+        cursor.execute(
+            f"""
+            UPDATE stream
+            SET accrued = 1
+            WHERE id IN ({placeholders})
+            """,
+            chunk,
+        )
+    deltas = {}
+    for key, amount in outflows.values():
+        deltas[key] = deltas.get(key, 0) - amount
+    add_committed_outflows(connection, deltas)
+    if uses_flow_engine(connection):
+        remove_stream_flows(connection, stream_ids)
+    if getattr(connection, "schedules", None) is not None:
+        for stream_id in stream_ids:
+            connection.schedules.stream_removed(stream_id)
 
 
 def delete_stream_by_id(connection, stream_id):
+    outflows = get_stream_outflows(connection, [stream_id])
     cursor = connection.cursor()
     cursor.execute(
         """
@@ -473,63 +1392,84 @@ def delete_stream_by_id(connection, stream_id):
         """,
         (stream_id,),
     )
+    add_committed_outflows(
+        connection, {key: -amount for key, amount in outflows.values()}
+    )
+    if uses_flow_engine(connection):
+        remove_stream_flows(connection, [stream_id])
+    if getattr(connection, "schedules", None) is not None:
+        connection.schedules.stream_removed(stream_id)
 
 
 def get_token_total_assets(connection, token_address) -> int:
-    create_token_if_not_exists(connection, token_address)
+    unit_of_work = get_unit_of_work(connection)
+    if unit_of_work is not None:
+        return unit_of_work.get_token_totals(connection, token_address)[0]
     cursor = connection.cursor()
     cursor.execute(
         """
         SELECT total_assets, total_shares FROM token
-        WHERE address = ?
+        WHERE id = ?
         """,
-        (token_address,),
+        (get_address_id(connection, token_address),),
     )
     row = cursor.fetchone()
 
     if row is None:
         return 0
 
-    return str_to_int(row[0])
+    return bytes32_to_int(row[0])
 
 
 def set_token_total_assets(connection, token_address: str, total_assets: int):
-    create_token_if_not_exists(connection, token_address)
+    unit_of_work = get_unit_of_work(connection)
+    if unit_of_work is not None:
+        return unit_of_work.set_token_totals(
+            connection, token_address, total_assets=total_assets
+        )
+    token_id = create_token_if_not_exists(connection, token_address)
     cursor = connection.cursor()
     cursor.execute(
         """
         UPDATE token
         SET total_assets = ?
-        WHERE address = ?
+        WHERE id = ?
         """,
-        (int_to_str(total_assets), token_address),
+        (int_to_bytes32(total_assets), token_id),
     )
 
 
 def get_token_total_shares(connection, token_address) -> int:
-    create_token_if_not_exists(connection, token_address)
+    unit_of_work = get_unit_of_work(connection)
+    if unit_of_work is not None:
+        return unit_of_work.get_token_totals(connection, token_address)[1]
     cursor = connection.cursor()
     cursor.execute(
         """
         SELECT total_shares FROM token
-        WHERE address = ?
+        WHERE id = ?
         """,
-        (token_address,),
+        (get_address_id(connection, token_address),),
     )
     row = cursor.fetchone()
-    return str_to_int(row[0]) if row else 0
+    return bytes32_to_int(row[0]) if row else 0
 
 
 def set_token_total_shares(connection, token_address: str, total_shares: int):
-    create_token_if_not_exists(connection, token_address)
+    unit_of_work = get_unit_of_work(connection)
+    if unit_of_work is not None:
+        return unit_of_work.set_token_totals(
+            connection, token_address, total_shares=total_shares
+        )
+    token_id = create_token_if_not_exists(connection, token_address)
     cursor = connection.cursor()
     cursor.execute(
         """
         UPDATE token
         SET total_shares = ?
-        WHERE address = ?
+        WHERE id = ?
         """,
-        (int_to_str(total_shares), token_address),
+        (int_to_bytes32(total_shares), token_id),
     )
 
 
@@ -541,11 +1481,11 @@ def set_last_timestamp_processed(
         """
         UPDATE pair
         SET last_timestamp_processed = ?
-        WHERE address = ?
+        WHERE token_id = ?
         """,
         (
             last_timestamp_processed,
-            pair_address,
+            get_address_id(connection, pair_address),
         ),
     )
 
@@ -554,19 +1494,19 @@ def store_spot_prices(connection, spot_prices):
     cursor = connection.cursor()
     cursor.executemany(
         """
-        INSERT INTO spot_price (pair_address, token_0_address, token_1_address, price, timestamp)
+        INSERT INTO spot_price (pair_id, token_0_id, token_1_id, price, timestamp)
         VALUES (?, ?, ?, ?, ?)
-        ON CONFLICT(pair_address, timestamp) DO UPDATE SET
-            token_0_address = excluded.token_0_address,
-            token_1_address = excluded.token_1_address,
+        ON CONFLICT(pair_id, timestamp) DO UPDATE SET
+            token_0_id = excluded.token_0_id,
+            token_1_id = excluded.token_1_id,
             price = excluded.price
         """,
         [
             (
-                s["pair_address"],
-                s["token_0_address"],
-                s["token_1_address"],
-                int_to_str(s["price"]),
+                create_account_if_not_exists(connection, s["pair_address"]),
+                create_account_if_not_exists(connection, s["token_0_address"]),
+                create_account_if_not_exists(connection, s["token_1_address"]),
+                int_to_bytes32(s["price"]),
                 s["timestamp"],
             )
             for s in spot_prices
@@ -578,11 +1518,11 @@ def store_swap_executions(connection, swap_executions):
     cursor = connection.cursor()
     cursor.executemany(
         """
-        INSERT INTO swap_execution (swap_id, token_to_pair_address, token_from_pair_address, amount_to_pair, amount_from_pair, refund_from_pair, from_timestamp, to_timestamp)
+        INSERT INTO swap_execution (swap_id, token_to_pair_id, token_from_pair_id, amount_to_pair, amount_from_pair, refund_from_pair, from_timestamp, to_timestamp)
         VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         ON CONFLICT(swap_id, from_timestamp, to_timestamp) DO UPDATE SET
-            token_to_pair_address = excluded.token_to_pair_address,
-            token_from_pair_address = excluded.token_from_pair_address,
+            token_to_pair_id = excluded.token_to_pair_id,
+            token_from_pair_id = excluded.token_from_pair_id,
             amount_to_pair = excluded.amount_to_pair,
             amount_from_pair = excluded.amount_from_pair,
             refund_from_pair = excluded.refund_from_pair,
@@ -592,11 +1532,11 @@ def store_swap_executions(connection, swap_executions):
         [
             (
                 s["swap_id"],
-                s["token_to_pair_address"],
-                s["token_from_pair_address"],
-                int_to_str(s["amount_to_pair"]),
-                int_to_str(s["amount_from_pair"]),
-                int_to_str(s["refund_from_pair"]),
+                create_account_if_not_exists(connection, s["token_to_pair_address"]),
+                create_account_if_not_exists(connection, s["token_from_pair_address"]),
+                int_to_bytes32(s["amount_to_pair"]),
+                int_to_bytes32(s["amount_from_pair"]),
+                int_to_bytes32(s["refund_from_pair"]),
                 s["from_timestamp"],
                 s["to_timestamp"],
             )
@@ -614,34 +1554,47 @@ def stream_test(payload, sender, start_timestamp, connection):
     receiver_checksum = to_checksum_address(payload["args"]["receiver"])
     token_checksum = to_checksum_address(payload["args"]["token"])
 
-    create_account_if_not_exists(connection, sender_checksum)
-    create_account_if_not_exists(connection, receiver_checksum)
-    create_token_if_not_exists(connection, token_checksum)
+    sender_id = create_account_if_not_exists(connection, sender_checksum)
+    receiver_id = create_account_if_not_exists(connection, receiver_checksum)
+    token_id = create_token_if_not_exists(connection, token_checksum)
     stream_data = []
-    amt = str(int(split_amount))
+    amt = int_to_bytes32(split_amount)
     duration = int(payload["args"]["duration"])
     for number in range(split_number):
         stream_data.append(
             (
-                sender_checksum,
-                receiver_checksum,
+                sender_id,
+                receiver_id,
                 start_timestamp,
                 duration + number,
                 amt,
-                token_checksum,
+                token_id,
                 0,
                 None,
+                start_timestamp + duration + number,
             )
         )
 
     cursor = connection.cursor()
+    last_id = cursor.execute("SELECT COALESCE(MAX(id), 0) FROM stream").fetchone()[0]
     cursor.executemany(
         """
-                INSERT INTO stream (from_address, to_address, start_timestamp, duration, amount, token_address, accrued, swap_id)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                INSERT INTO stream (from_id, to_id, start_timestamp, duration, amount, token_id, accrued, swap_id, end_timestamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
                 """,
         stream_data,
     )
+    if uses_flow_engine(connection):
+        cursor.execute("SELECT * FROM stream WHERE id > ? ORDER BY id", (last_id,))
+        add_stream_flows(
+            connection,
+            [(row[0], stream_from_row(connection, row)) for row in cursor.fetchall()],
+        )
+    if sender_id != receiver_id:
+        add_committed_outflows(
+            connection, {(sender_id, token_id): split_amount * split_number}
+        )
+    drop_schedules(connection)
 
 
 @dataclass
@@ -656,39 +1609,47 @@ def get_updatable_pairs(connection, wallet_address, token_address, start_timesta
     cursor = connection.cursor()
     cursor.execute(
         """
-        SELECT DISTINCT s.pair_address, p.token_0_address, p.token_1_address, p.last_timestamp_processed
+        SELECT DISTINCT s.pair_id, p.token_0_id, p.token_1_id, p.last_timestamp_processed
         FROM swap s
         JOIN stream st ON s.id = st.swap_id
-        JOIN pair p ON s.pair_address = p.address
-        WHERE st.to_address = ? AND st.accrued = 0 
-        AND (p.token_0_address = ? OR p.token_1_address = ?)
+        JOIN pair p ON s.pair_id = p.token_id
+        WHERE st.to_id = ? AND st.accrued = 0 
+        AND (p.token_0_id = ? OR p.token_1_id = ?)
         AND st.start_timestamp <= ?
         """,
         (
-            wallet_address,
-            token_address,
-            token_address,
+            get_address_id(connection, wallet_address),
+            get_address_id(connection, token_address),
+            get_address_id(connection, token_address),
             start_timestamp,
         ),
     )
     result = cursor.fetchall()
-    return [PairInfo(*row) for row in result]
+    return [
+        PairInfo(
+            get_address(connection, row[0]),
+            get_address(connection, row[1]),
+            get_address(connection, row[2]),
+            row[3],
+        )
+        for row in result
+    ]
 
 
 def get_wallet_token_streamed(connection, wallet_address):
     cursor = connection.cursor()
     cursor.execute(
         """
-        SELECT DISTINCT token_address
+        SELECT DISTINCT token_id
         FROM stream
-        WHERE from_address = ? OR to_address = ?
+        WHERE from_id = ? OR to_id = ?
         """,
         (
-            wallet_address,
-            wallet_address,
+            get_address_id(connection, wallet_address),
+            get_address_id(connection, wallet_address),
         ),
     )
-    return cursor.fetchall()
+    return [(get_address(connection, row[0]),) for row in cursor.fetchall()]
 
 
 @dataclass
@@ -696,9 +1657,9 @@ class Swap:
     id: int
     from_pair_id: str
     from_pair_to_address: str
-    from_pair_amount: str
+    from_pair_amount: int
     from_pair_duration: int
-    to_pair_amount: str
+    to_pair_amount: int
     to_pair_start_timestamp: int
     to_pair_duration: int
     to_pair_token_address: str
@@ -709,6 +1670,7 @@ class Swap:
 
 def get_swaps_for_pair_address(connection, pair_address: str, to_timestamp: int):
 
+    pair_id = get_address_id(connection, pair_address)
     cursor = connection.cursor()
 
     # Execute the SQL query
@@ -721,10 +1683,10 @@ def get_swaps_for_pair_address(connection, pair_address: str, to_timestamp: int)
             st_to_pair.amount AS to_pair_amount, 
             st_to_pair.start_timestamp AS to_pair_start_timestamp,
             st_to_pair.duration AS to_pair_duration,
-            st_to_pair.token_address AS to_pair_token_address,
+            st_to_pair.token_id AS to_pair_token_id,
             s.condition_type,
             s.condition_value,
-            st_from_pair.to_address,
+            st_from_pair.to_id,
             s.id
         FROM 
             swap s
@@ -733,21 +1695,21 @@ def get_swaps_for_pair_address(connection, pair_address: str, to_timestamp: int)
         JOIN 
             stream st_from_pair ON s.id = st_from_pair.swap_id
         WHERE 
-            s.pair_address = ?
+            s.pair_id = ?
         AND 
             st_to_pair.start_timestamp <= ?
         AND 
             st_from_pair.duration != st_to_pair.duration
         AND 
-            st_to_pair.to_address = ? AND st_from_pair.from_address = ?
+            st_to_pair.to_id = ? AND st_from_pair.from_id = ?
         AND 
             st_to_pair.duration > 0
         """,
         (
-            pair_address,
+            pair_id,
             to_timestamp,
-            pair_address,
-            pair_address,
+            pair_id,
+            pair_id,
         ),
     )
 
@@ -756,15 +1718,15 @@ def get_swaps_for_pair_address(connection, pair_address: str, to_timestamp: int)
         Swap(
             id=row[10],
             from_pair_id=row[0],
-            from_pair_amount=row[1],
+            from_pair_amount=bytes32_to_int(row[1]),
             from_pair_duration=row[2],
-            to_pair_amount=row[3],
+            to_pair_amount=bytes32_to_int(row[3]),
             to_pair_start_timestamp=row[4],
             to_pair_duration=row[5],
-            to_pair_token_address=row[6],
+            to_pair_token_address=get_address(connection, row[6]),
             condition_type=row[7],
-            condition_value=str_to_int(row[8]),
-            from_pair_to_address=row[9],
+            condition_value=bytes32_to_int(row[8]),
+            from_pair_to_address=get_address(connection, row[9]),
             rate=0,  # Initial default rate, can be adjusted later as needed
         )
         for row in result
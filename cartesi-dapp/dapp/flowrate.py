@@ -0,0 +1,317 @@
+import os
+from typing import Dict, Iterable, List, Tuple
+
+from dapp.addresses import get_address, get_address_book, get_address_id
+from dapp.stream import Stream
+from dapp.util import (
+    STREAM_IDS_CHUNK,
+    bytes32_to_int,
+    int_to_bytes32,
+    int_to_signed_bytes32,
+    signed_bytes32_to_int,
+)
+
+# Accounting engine of the streams, from the STREAM_ENGINE environment variable:
+#   rows      every balance read goes over the wallet's stream rows
+#   flowrate  the flow tables below are kept up to date by every stream
+#             write, and balance reads come from them
+STREAM_ENGINES = ("rows", "flowrate")
+DEFAULT_STREAM_ENGINE = "rows"
+
+
+def get_stream_engine() -> str:
+    engine = os.getenv("STREAM_ENGINE", DEFAULT_STREAM_ENGINE)
+    if engine not in STREAM_ENGINES:
+        raise ValueError(
+            f"STREAM_ENGINE must be one of {', '.join(STREAM_ENGINES)}, not {engine}"
+        )
+    return engine
+
+
+def stream_flows(
+    stream_id: int, stream: Stream, from_id: int, to_id: int, token_id: int
+) -> Tuple[List[tuple], List[tuple]]:
+    """flow_event and flow_remainder rows of a non-accrued stream.
+
+    The amount is split as quotient * duration + remainder. The quotient is
+    a rate that each side gains at the start and loses at the end. The
+    floor of remainder * elapsed // duration is kept per stream while it
+    runs and paid in full by the end event, so the sum matches
+    amount * elapsed // duration exactly. A stream to oneself only counts
+    as received, as in get_wallet_streamed_amount. The rows are keyed by
+    the account ids of the stream's addresses.
+    """
+    end_timestamp = stream.start_timestamp + stream.duration
+    if stream.duration:
+        quotient, remainder = divmod(stream.amount, stream.duration)
+    else:
+        quotient, remainder = 0, stream.amount
+    sides = [(to_id, 1)]
+    if from_id != to_id:
+        sides.append((from_id, -1))
+
+    events = []
+    remainders = []
+    for account_id, sign in sides:
+        key = (account_id, token_id)
+        if quotient:
+            events.append((*key, stream.start_timestamp, stream_id, sign * quotient, 0))
+        if quotient or remainder:
+            events.append(
+                (*key, end_timestamp, stream_id, -sign * quotient, sign * remainder)
+            )
+        if remainder and stream.duration:
+            remainders.append(
+                (
+                    stream_id,
+                    *key,
+                    stream.start_timestamp,
+                    end_timestamp,
+                    int_to_bytes32(remainder),
+                    sign,
+                )
+            )
+    return events, remainders
+
+
+def get_flow_states(connection, keys) -> Dict[Tuple[int, int], List[int]]:
+    """[settled_timestamp, settled, rate] of each (account id, token id), zero if unset."""
+    cursor = connection.cursor()
+    states = {}
+    for key in keys:
+        cursor.execute(
+            """
+            SELECT settled_timestamp, settled, rate FROM flow_state
+            WHERE account_id = ? AND token_id = ?
+            """,
+            key,
+        )
+        row = cursor.fetchone()
+        states[key] = (
+            [row[0], signed_bytes32_to_int(row[1]), signed_bytes32_to_int(row[2])]
+            if row
+            else [0, 0, 0]
+        )
+    return states
+
+
+def set_flow_states(connection, states) -> None:
+    connection.cursor().executemany(
+        """
+        INSERT INTO flow_state (account_id, token_id, settled_timestamp, settled, rate)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(account_id, token_id) DO UPDATE SET
+            settled_timestamp = excluded.settled_timestamp,
+            settled = excluded.settled,
+            rate = excluded.rate
+        """,
+        [
+            (
+                *key,
+                settled_timestamp,
+                int_to_signed_bytes32(settled),
+                int_to_signed_bytes32(rate),
+            )
+            for key, (settled_timestamp, settled, rate) in states.items()
+        ],
+    )
+
+
+def _apply_events(states, events, sign: int):
+    # Events up to a state's settled timestamp are already part of it
+    for account_id, token_id, timestamp, _, rate, amount in events:
+        state = states[(account_id, token_id)]
+        if timestamp <= state[0]:
+            state[1] += sign * (amount + rate * (state[0] - timestamp))
+            state[2] += sign * rate
+
+
+def add_stream_flows(connection, streams: Iterable[Tuple[int, Stream]]) -> None:
+    """Queues the events of each (stream id, stream) that is not accrued."""
+    book = get_address_book(connection)
+    events = []
+    remainders = []
+    for stream_id, stream in streams:
+        if not stream.accrued:
+            stream_events, stream_remainders = stream_flows(
+                stream_id,
+                stream,
+                book.id_of(connection, stream.from_address, create=True),
+                book.id_of(connection, stream.to_address, create=True),
+                book.id_of(connection, stream.token_address, create=True),
+            )
+            events += stream_events
+            remainders += stream_remainders
+    if not events:
+        return
+    states = get_flow_states(connection, {event[:2] for event in events})
+    _apply_events(states, events, 1)
+
+    cursor = connection.cursor()
+    cursor.executemany(
+        """
+        INSERT INTO flow_event (account_id, token_id, timestamp, stream_id, rate, amount)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        [
+            (
+                *event[:4],
+                int_to_signed_bytes32(event[4]),
+                int_to_signed_bytes32(event[5]),
+            )
+            for event in events
+        ],
+    )
+    cursor.executemany(
+        """
+        INSERT INTO flow_remainder (stream_id, account_id, token_id, start_timestamp, end_timestamp, remainder, sign)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+        remainders,
+    )
+    set_flow_states(connection, states)
+
+
+def remove_stream_flows(connection, stream_ids: List[int]) -> None:
+    """Takes the streams out of the flows, whatever they looked like when added."""
+    cursor = connection.cursor()
+    events = []
+    for i in range(0, len(stream_ids), STREAM_IDS_CHUNK):
+        chunk = stream_ids[i : i + STREAM_IDS_CHUNK]
+        placeholders = ", ".join("?" * len(chunk))
+        cursor.execute(
+            f"""
+            SELECT account_id, token_id, timestamp, stream_id, rate, amount
+            FROM flow_event
+            WHERE stream_id IN ({placeholders})
+            """,
+            chunk,
+        )
+        events += [
+            (*row[:4], signed_bytes32_to_int(row[4]), signed_bytes32_to_int(row[5]))
+            for row in cursor
+        ]
+        cursor.execute(
+            f"DELETE FROM flow_event WHERE stream_id IN ({placeholders})", chunk
+        )
+        cursor.execute(
+            f"DELETE FROM flow_remainder WHERE stream_id IN ({placeholders})", chunk
+        )
+    if events:
+        states = get_flow_states(connection, {event[:2] for event in events})
+        _apply_events(states, events, -1)
+        set_flow_states(connection, states)
+
+
+def _linear_amount(connection, key, state, timestamp: int) -> Tuple[int, int]:
+    """(streamed without running remainders, rate) at timestamp.
+
+    Starts from the settled state and adds, or takes back, the events
+    between its settled timestamp and timestamp.
+    """
+    settled_timestamp, streamed, rate = state
+    streamed += rate * (timestamp - settled_timestamp)
+    if timestamp == settled_timestamp:
+        return streamed, rate
+    sign = 1 if timestamp > settled_timestamp else -1
+    cursor = connection.cursor()
+    cursor.execute(
+        """
+        SELECT timestamp, rate, amount FROM flow_event
+        WHERE account_id = ? AND token_id = ?
+        AND timestamp > ? AND timestamp <= ?
+        """,
+        (*key, min(timestamp, settled_timestamp), max(timestamp, settled_timestamp)),
+    )
+    for event_timestamp, event_rate, amount in cursor:
+        event_rate = signed_bytes32_to_int(event_rate)
+        streamed += sign * (
+            signed_bytes32_to_int(amount) + event_rate * (timestamp - event_timestamp)
+        )
+        rate += sign * event_rate
+    return streamed, rate
+
+
+def get_flow_streamed_amount(
+    connection, account_address, token_address, until_timestamp
+) -> int:
+    """get_wallet_streamed_amount(until_timestamp, until_timestamp) from the flows.
+
+    One state row, the events between its settled timestamp and
+    until_timestamp, and the running streams whose amount does not divide
+    by their duration.
+    """
+    key = (
+        get_address_id(connection, account_address),
+        get_address_id(connection, token_address),
+    )
+    if None in key:
+        return 0
+    state = get_flow_states(connection, [key])[key]
+    streamed, _ = _linear_amount(connection, key, state, until_timestamp)
+
+    cursor = connection.cursor()
+    cursor.execute(
+        """
+        SELECT start_timestamp, end_timestamp, remainder, sign FROM flow_remainder
+        WHERE account_id = ? AND token_id = ?
+        AND end_timestamp > ? AND start_timestamp <= ?
+        """,
+        (*key, until_timestamp, until_timestamp),
+    )
+    for start_timestamp, end_timestamp, remainder, sign in cursor:
+        elapsed = until_timestamp - start_timestamp
+        streamed += sign * (
+            bytes32_to_int(remainder) * elapsed // (end_timestamp - start_timestamp)
+        )
+    return streamed
+
+
+def settle_flow(connection, account_address, token_address, timestamp: int) -> None:
+    """Folds the events up to timestamp into the (account, token) state."""
+    key = (
+        get_address_id(connection, account_address),
+        get_address_id(connection, token_address),
+    )
+    if None in key:
+        return
+    state = get_flow_states(connection, [key])[key]
+    if timestamp <= state[0]:
+        return
+    settled, rate = _linear_amount(connection, key, state, timestamp)
+    set_flow_states(connection, {key: [timestamp, settled, rate]})
+
+
+def rebuild_flows(connection) -> None:
+    """Rebuilds the flow tables from the non-accrued streams."""
+    cursor = connection.cursor()
+    cursor.execute("DELETE FROM flow_state")
+    cursor.execute("DELETE FROM flow_event")
+    cursor.execute("DELETE FROM flow_remainder")
+    cursor.execute(
+        """
+        SELECT id, from_id, to_id, start_timestamp, duration, amount, token_id
+        FROM stream
+        WHERE accrued = 0
+        ORDER BY id
+        """
+    )
+    add_stream_flows(
+        connection,
+        [
+            (
+                row[0],
+                Stream(
+                    stream_id=row[0],
+                    from_address=get_address(connection, row[1]),
+                    to_address=get_address(connection, row[2]),
+                    start_timestamp=row[3],
+                    duration=row[4],
+                    amount=bytes32_to_int(row[5]),
+                    token_address=get_address(connection, row[6]),
+                    accrued=False,
+                ),
+            )
+            for row in cursor.fetchall()
+        ],
+    )
@@ -1,7 +1,8 @@
+from dapp.actions import decode_action, is_binary_action
 from dapp.streamrebasetoken import StreamRebaseToken
 from dapp.db import (
     get_admin,
-    get_connection,
+    get_connection_manager,
     get_yield_bridge,
     set_admin,
     set_input_box_wrapper,
@@ -9,36 +10,27 @@ from dapp.db import (
     get_input_box_wrapper,
 )
 from dapp.logger import logger
+from dapp.reports import get_report_policy, success_report
+from dapp.rollup import get_rollup_client
+from dapp.settlement import run_settlement_job, settle_tokens
 from dapp.util import (
+    MAX_BALANCE_SERIES_POINTS,
+    MAX_BATCH_ACTIONS,
     ZERO_ADDRESS,
+    checksum_address,
     hex_to_str,
     logger,
-    rollup_server,
     str_to_hex,
 )
 
 from eth_abi import decode, encode
 from eth_utils import is_same_address
 import json
-import requests
 
 
 def send_post_request(endpoint, payload):
-    url = rollup_server + endpoint
     json_payload = {"payload": str_to_hex(json.dumps(payload))}
-
-    response = requests.post(url, json=json_payload)
-
-    if response.status_code not in (200, 202):
-        logger.error(
-            f"Failed POST request to {url}. Status: {response.status_code}. Response: {response.text}"
-        )
-    else:
-        logger.info(
-            f"Successful POST request to {url}. Status: {response.status_code}. Response: {response.text}"
-        )
-
-    return response
+    return get_rollup_client().post(endpoint, json_payload)
 
 
 def report_error(msg, payload):
@@ -88,15 +80,18 @@ def is_input_box_wrapper(sender, connection):
     return is_same_address(sender, input_box_wrapper_address)
 
 
-def handle_action(data, connection):
+def handle_action(data, connection, results=None):
+    """Applies one advance input. Batch results are appended to results."""
 
     binary = bytes.fromhex(data["payload"][2:])
     decoded = decode(["address", "address[]", "uint256[]", "bytes"], binary)
     logger.info(f"Received advance request data {decoded}")
 
     parent_sender = data["metadata"]["msg_sender"]
-    sender = decoded[0]
-    tokens_to_rebase = decoded[1]
+    # Addresses are checksummed once here; the token methods and hooks
+    # receive ChecksumAddress values and skip re-hashing them.
+    sender = checksum_address(decoded[0])
+    tokens_to_rebase = [checksum_address(token) for token in decoded[1]]
     amounts_to_rebase = decoded[2]
     encoded_action = decoded[3]
 
@@ -112,8 +107,8 @@ def handle_action(data, connection):
             ["address", "address", "uint256", "address", "bytes"], decoded[3]
         )
         assets_amount = decoded_deposit[2]
-        recipient = decoded_deposit[3]
-        StreamRebaseToken(connection, decoded_deposit[0]).mint_assets(
+        recipient = checksum_address(decoded_deposit[3])
+        StreamRebaseToken(connection, checksum_address(decoded_deposit[0])).mint_assets(
             assets_amount=assets_amount,
             wallet=recipient,
         )
@@ -128,8 +123,10 @@ def handle_action(data, connection):
     if not encoded_action:
         return "accept"
 
-    str_payload = encoded_action
-    payload = json.loads(str_payload)
+    if is_binary_action(encoded_action):
+        payload = decode_action(encoded_action)
+    else:
+        payload = json.loads(encoded_action)
 
     if payload["method"] == "claim_admin" and is_same_address(
         admin_address, ZERO_ADDRESS
@@ -151,12 +148,25 @@ def handle_action(data, connection):
         set_yield_bridge(connection, payload["args"]["yield_bridge"])
         return "accept"
 
+    if payload["method"] == "settle" and only_admin(decoded[0], connection):
+        token = payload["args"].get("token")
+        summary = settle_tokens(
+            connection,
+            timestamp,
+            None if token is None else [checksum_address(token)],
+        )
+        if results is not None:
+            results.append(summary)
+        return "accept"
+
     # From here on, only the input box wrapper can call these functions
     only_input_box_wrapper(parent_sender, connection)
 
     if payload["method"] == "stream":
-        StreamRebaseToken(connection, payload["args"]["token"]).transfer(
-            receiver=payload["args"]["receiver"],
+        StreamRebaseToken(
+            connection, checksum_address(payload["args"]["token"])
+        ).transfer(
+            receiver=checksum_address(payload["args"]["receiver"]),
             amount=int(payload["args"]["amount"]),
             duration=int(payload["args"]["duration"]),
             start_timestamp=int(payload["args"]["start"]),
@@ -164,53 +174,148 @@ def handle_action(data, connection):
             current_timestamp=timestamp,
         )
     elif payload["method"] == "withdraw":
-        token_address = payload["args"]["token"]
+        token_address = checksum_address(payload["args"]["token"])
         token = StreamRebaseToken(connection, token_address)
         amount = int(payload["args"]["amount"])
-        recipient = payload["args"]["recipient"]
+        recipient = checksum_address(payload["args"]["recipient"])
         token.burn_assets(
             assets_amount=amount,
             sender=sender,
             current_timestamp=timestamp,
         )
-
-        WITHDRAW_FUNCTION_SELECTOR = b"\x1fQ\x95\xb7"
-        withdraw_payload = WITHDRAW_FUNCTION_SELECTOR + encode(
-            ["address", "uint256", "address"],
-            [token_address, amount, recipient],
-        )
-        voucher = {
-            "destination": get_yield_bridge(connection),
-            "payload": "0x" + withdraw_payload.hex(),
-        }
-        logger.info(f"Issuing voucher {voucher}")
-        response = requests.post(rollup_server + "/voucher", json=voucher)
-        logger.info(
-            f"Received voucher status {response.status_code} body {response.content}"
-        )
+        issue_withdraw_voucher(connection, token_address, amount, recipient)
     elif payload["method"] == "cancel_stream":
-        token = StreamRebaseToken(connection, payload["args"]["token"]).cancel_stream(
+        token = StreamRebaseToken(
+            connection, checksum_address(payload["args"]["token"])
+        ).cancel_stream(
             stream_id=int(payload["args"]["stream_id"]),
             sender=sender,
             current_timestamp=timestamp,
         )
+    elif payload["method"] == "batch":
+        batch_results = handle_batch(
+            payload["args"]["actions"], sender, timestamp, connection
+        )
+        if results is not None:
+            results.extend(batch_results)
     else:
         raise Exception(f"Unknown method {payload['method']}")
 
     return "accept"
 
 
+def issue_withdraw_voucher(connection, token_address, amount, recipient):
+    WITHDRAW_FUNCTION_SELECTOR = b"\x1fQ\x95\xb7"
+    withdraw_payload = WITHDRAW_FUNCTION_SELECTOR + encode(
+        ["address", "uint256", "address"],
+        [token_address, amount, recipient],
+    )
+    voucher = {
+        "destination": get_yield_bridge(connection),
+        "payload": "0x" + withdraw_payload.hex(),
+    }
+    logger.info(f"Issuing voucher {voucher}")
+    response = get_rollup_client().voucher(**voucher)
+    logger.info(
+        f"Received voucher status {response.status_code} body {response.content}"
+    )
+
+
+BATCH_METHODS = ("stream", "withdraw", "cancel_stream")
+
+
+def handle_batch(actions, sender, timestamp, connection):
+    """Runs stream, withdraw and cancel_stream actions of one sender as a unit.
+
+    The sender's streams are settled once per token up front, and the funds
+    of every token streamed are checked once, after all actions, against
+    the combined outflow. Vouchers are only issued once every action has
+    succeeded. Any failure raises, so the advance rolls the whole batch back.
+    Returns one result per action.
+    """
+    if not isinstance(actions, list) or not actions:
+        raise Exception("Batch must hold a list of actions")
+    if len(actions) > MAX_BATCH_ACTIONS:
+        raise Exception(f"At most {MAX_BATCH_ACTIONS} actions per batch")
+
+    tokens = {}
+    for action in actions:
+        if action["method"] not in BATCH_METHODS:
+            raise Exception(f"Unknown batch method {action['method']}")
+        token_address = checksum_address(action["args"]["token"])
+        if token_address not in tokens:
+            tokens[token_address] = StreamRebaseToken(connection, token_address)
+
+    for token in tokens.values():
+        token.process_streams(sender, timestamp)
+
+    results = []
+    vouchers = []
+    streamed = set()
+    for i, action in enumerate(actions):
+        method = action["method"]
+        args = action["args"]
+        token_address = checksum_address(args["token"])
+        token = tokens[token_address]
+        try:
+            if method == "stream":
+                stream_id = token._transfer(
+                    receiver=checksum_address(args["receiver"]),
+                    amount=int(args["amount"]),
+                    duration=int(args["duration"]),
+                    start_timestamp=int(args["start"]),
+                    sender=sender,
+                    current_timestamp=timestamp,
+                    check_funds=False,
+                )
+                streamed.add(token_address)
+                results.append({"method": method, "stream_id": stream_id})
+            elif method == "withdraw":
+                amount = int(args["amount"])
+                recipient = checksum_address(args["recipient"])
+                token._burn_assets(amount, sender, timestamp)
+                vouchers.append((token_address, amount, recipient))
+                results.append(
+                    {
+                        "method": method,
+                        "token": token_address,
+                        "amount": str(amount),
+                        "recipient": recipient,
+                    }
+                )
+            else:
+                stream_id = int(args["stream_id"])
+                token._cancel_stream(stream_id, sender, timestamp)
+                results.append({"method": method, "stream_id": stream_id})
+        except Exception as e:
+            raise Exception(f"Action {i} ({method}) failed: {e}") from e
+
+    for token_address, token in tokens.items():
+        if token_address in streamed:
+            assert (
+                token.uncommitted_balance(sender, timestamp) >= 0
+            ), f"Not enough funds for the batch of {token_address}."
+
+    for voucher in vouchers:
+        issue_withdraw_voucher(connection, *voucher)
+    return results
+
+
 def handle_advance(data):
     logger.info(f"Received advance request data {data}")
-    connection = get_connection()
     status = "accept"
+    manager = get_connection_manager()
+    run_settlement_job(
+        manager, data["metadata"]["input_index"], data["metadata"]["timestamp"]
+    )
     try:
-        status = handle_action(data, connection)
-        report_success("Success", str_to_hex(json.dumps(data)))
-        connection.commit()
-        connection.close()
+        with manager.advance() as connection:
+            results = []
+            status = handle_action(data, connection, results)
+            report = success_report(data, results, get_report_policy())
+            if report is not None:
+                report_success(*report)
     except Exception as e:
-        connection.rollback()
         status = "reject"
         report_error(str(e), data["payload"])
 
@@ -224,17 +329,37 @@ def handle_inspect(data):
     try:
         payload = hex_to_str(data["payload"])
         json_payload = json.loads(payload)
-        connection = get_connection()
 
         if json_payload["data"] == "balance":
-            token_address = json_payload["token_address"]
-            wallet_address = json_payload["wallet_address"]
-            balance = StreamRebaseToken(connection, token_address).balance_of(
-                account_address=wallet_address,
-                at_timestamp=json_payload["timestamp"],
-            )
+            token_address = checksum_address(json_payload["token_address"])
+            wallet_address = checksum_address(json_payload["wallet_address"])
+            with get_connection_manager().inspect() as connection:
+                balance = StreamRebaseToken(connection, token_address).balance_of(
+                    account_address=wallet_address,
+                    at_timestamp=json_payload["timestamp"],
+                )
             return report_success(str(balance), data["payload"])
 
+        if json_payload["data"] == "balance_series":
+            token_address = checksum_address(json_payload["token_address"])
+            wallet_address = checksum_address(json_payload["wallet_address"])
+            timestamps = json_payload["timestamps"]
+            if not isinstance(timestamps, list) or not all(
+                type(timestamp) is int for timestamp in timestamps
+            ):
+                raise ValueError("timestamps must be a list of integers")
+            if len(timestamps) > MAX_BALANCE_SERIES_POINTS:
+                raise ValueError(
+                    f"At most {MAX_BALANCE_SERIES_POINTS} timestamps per series"
+                )
+            with get_connection_manager().inspect() as connection:
+                balances = StreamRebaseToken(connection, token_address).balance_series(
+                    wallet_address, timestamps
+                )
+            return report_success(
+                json.dumps([str(balance) for balance in balances]), data["payload"]
+            )
+
         return report_success("ok", data["payload"])
     except Exception as e:
         response = report_error(str(e), data["payload"])
@@ -0,0 +1,48 @@
+import json
+import os
+from typing import Any, List, Optional, Tuple
+
+from dapp.util import str_to_hex
+
+# What an accepted advance reports, from the REPORT_POLICY environment variable:
+#   none     no report
+#   compact  input index, status and a digest of the input payload
+#   full     the whole request, hex-encoded
+# Rejected inputs always report the error and their payload.
+REPORT_POLICIES = ("none", "compact", "full")
+DEFAULT_REPORT_POLICY = "full"
+# Leading bytes of the payload's keccak256 kept in a compact report
+DIGEST_BYTES = 8
+
+
+def get_report_policy() -> str:
+    policy = os.getenv("REPORT_POLICY", DEFAULT_REPORT_POLICY)
+    if policy not in REPORT_POLICIES:
+        raise ValueError(
+            f"REPORT_POLICY must be one of {', '.join(REPORT_POLICIES)}, not {policy}"
+        )
+    return policy
+
+
+def payload_digest(payload: str) -> str:
+    # Imported here as in dapp.util, to keep eth_utils off the boot path
+    from eth_utils import keccak
+
+    return "0x" + keccak(hexstr=payload)[:DIGEST_BYTES].hex()
+
+
+def success_report(data, results: List[Any], policy: str) -> Optional[Tuple[str, Any]]:
+    """(message, payload) to report for an accepted advance, None for no report.
+
+    The message is "Success", or the JSON list of batch results if any.
+    """
+    if policy == "none":
+        return None
+    message = json.dumps(results) if results else "Success"
+    if policy == "compact":
+        return message, {
+            "input_index": data["metadata"]["input_index"],
+            "status": "accept",
+            "digest": payload_digest(data["payload"]),
+        }
+    return message, str_to_hex(json.dumps(data))
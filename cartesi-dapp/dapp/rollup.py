@@ -0,0 +1,200 @@
+import http.client
+import json
+import time
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+from dapp.util import logger, rollup_server
+
+# While the rollup server has no input for us, /finish answers 202 and is
+# polled again after a delay that doubles up to the maximum.
+FINISH_BACKOFF_INITIAL = 0.01
+FINISH_BACKOFF_MAX = 1.0
+# Requests that could not be sent at all are retried this many times
+# before giving up.
+MAX_RETRIES = 5
+# How sending on a kept-alive connection fails once the server has closed
+# it: the write hits a closed socket, or the server resets or closes it
+# before the status line. RemoteDisconnected is a ConnectionResetError.
+STALE_CONNECTION_ERRORS = (BrokenPipeError, ConnectionResetError)
+
+
+class Response:
+    """The parts of a requests.Response the dapp reads."""
+
+    def __init__(self, status_code: int, content: bytes):
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", "replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class RequestNotSent(ConnectionError):
+    """The connection failed before any byte of the request went out.
+
+    Only these failures are safe to retry: once a request was sent, the
+    server may have acted on it, and a second /voucher or /notice would be
+    emitted twice, or a second /finish would finish the next input.
+    """
+
+
+def json_body(payload) -> bytes:
+    return json.dumps(payload).encode("utf-8")
+
+
+class HTTPSession:
+    """Keep-alive JSON POSTs over http.client.
+
+    Only JSON POSTs to the rollup server are needed, and requests alone
+    takes longer to import than the rest of the dapp's boot path. The
+    connection is reopened on the next call after any failure.
+
+    The server may close a kept-alive connection while it is idle. Sending
+    on it then fails with STALE_CONNECTION_ERRORS before any byte of a
+    response arrives, and the request is sent once more on a new connection.
+    """
+
+    def __init__(self):
+        self._connections = {}
+
+    def _connect(self, netloc: str, url: str) -> http.client.HTTPConnection:
+        connection = self._connections.get(netloc)
+        if connection is None:
+            connection = http.client.HTTPConnection(netloc)
+            self._connections[netloc] = connection
+        if connection.sock is None:
+            try:
+                connection.connect()
+            except OSError as e:
+                del self._connections[netloc]
+                raise RequestNotSent(f"POST {url} failed: {e!r}") from e
+        return connection
+
+    def _drop(self, netloc: str, url: str, error: Exception) -> ConnectionError:
+        self._connections.pop(netloc).close()
+        return ConnectionError(f"POST {url} failed: {error!r}")
+
+    def post(self, url: str, json=None) -> Response:
+        parts = urlsplit(url)
+        path = parts.path + ("?" + parts.query if parts.query else "")
+        body = json_body(json)
+        connection = self._connections.get(parts.netloc)
+        reused = connection is not None and connection.sock is not None
+        while True:
+            connection = self._connect(parts.netloc, url)
+            try:
+                connection.request(
+                    "POST",
+                    path,
+                    body=body,
+                    headers={"Content-Type": "application/json"},
+                )
+                response = connection.getresponse()
+            except STALE_CONNECTION_ERRORS as e:
+                connection.close()
+                if reused:
+                    logger.info(f"Connection to {url} was closed while idle, resending")
+                    reused = False
+                    continue
+                raise self._drop(parts.netloc, url, e) from e
+            except (http.client.HTTPException, OSError) as e:
+                raise self._drop(parts.netloc, url, e) from e
+            try:
+                content = response.read()
+            except (http.client.HTTPException, OSError) as e:
+                raise self._drop(parts.netloc, url, e) from e
+            return Response(response.status, content)
+
+
+class RollupClient:
+    """Client for the rollup HTTP server.
+
+    Every request goes through one keep-alive session, so the TCP
+    connection to the server is reused across inputs instead of being
+    opened for every finish, report, notice and voucher. A request is only
+    retried if it was never sent, see RequestNotSent. Any other failure is
+    raised, which rejects the input being handled.
+    """
+
+    def __init__(
+        self,
+        url: str = rollup_server,
+        session=None,
+        backoff_initial: float = FINISH_BACKOFF_INITIAL,
+        backoff_max: float = FINISH_BACKOFF_MAX,
+        max_retries: int = MAX_RETRIES,
+        sleep=time.sleep,
+    ):
+        self.url = url.rstrip("/")
+        self.session = session if session is not None else HTTPSession()
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.max_retries = max_retries
+        self.sleep = sleep
+
+    def post(self, endpoint: str, json_payload: Dict[str, Any]):
+        url = self.url + endpoint
+        delay = self.backoff_initial
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.post(url, json=json_payload)
+                break
+            except RequestNotSent:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"Connection to {url} failed, retrying")
+                self.sleep(delay)
+                delay = min(delay * 2, self.backoff_max)
+
+        if response.status_code not in (200, 202):
+            logger.error(
+                f"Failed POST request to {url}. Status: {response.status_code}. Response: {response.text}"
+            )
+        else:
+            logger.info(
+                f"Successful POST request to {url}. Status: {response.status_code}. Response: {response.text}"
+            )
+
+        return response
+
+    def finish(self, status: str) -> Dict[str, Any]:
+        """Reports the status of the last input and waits for the next one."""
+        delay = self.backoff_initial
+        while True:
+            logger.info("Sending finish")
+            response = self.post("/finish", {"status": status})
+            if response.status_code != 202:
+                return response.json()
+            logger.info("No pending rollup request, trying again")
+            self.sleep(delay)
+            delay = min(delay * 2, self.backoff_max)
+
+    def report(self, payload: str):
+        return self.post("/report", {"payload": payload})
+
+    def notice(self, payload: str):
+        return self.post("/notice", {"payload": payload})
+
+    def voucher(self, destination: str, payload: str):
+        return self.post("/voucher", {"destination": destination, "payload": payload})
+
+
+_rollup_client = None
+
+
+def get_rollup_client() -> RollupClient:
+    global _rollup_client
+    if _rollup_client is None:
+        _rollup_client = RollupClient()
+    return _rollup_client
+
+
+def set_rollup_client(client: Optional[RollupClient]):
+    """Replaces the process-wide client, e.g. with one using a stub session."""
+    global _rollup_client
+    _rollup_client = client
@@ -0,0 +1,237 @@
+from bisect import bisect_right
+from heapq import heappop, heappush
+from itertools import accumulate
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from dapp.stream import Stream
+
+# Schedules kept per connection; the least recently used one is dropped first
+SCHEDULE_CACHE_SIZE = 1024
+
+
+class VestingSchedule:
+    """Net amount streamed to (positive) or from (negative) one wallet of one token.
+
+    Holds the wallet's non-accrued streams with the rules of
+    get_wallet_streamed_amount: a stream counts from its start and in full
+    from its end, and one to oneself only counts as received. Each amount
+    is split as quotient * duration + remainder, so that
+
+        amount * elapsed // duration
+            == quotient * elapsed + remainder * elapsed // duration
+
+    Ended amounts and the quotient terms of running streams are prefix sums
+    found with a bisect. The remainder terms are evaluated one by one, over
+    whichever is shorter: the streams with a remainder not ended by the
+    timestamp, or those started in the longest duration before it. Reads
+    before or after most streams visit only a few of them, reads inside a
+    busy period at least every stream running then. Changes are applied per stream id and the
+    sorted arrays are rebuilt on the next read.
+    """
+
+    def __init__(self, wallet: str, streams: Iterable[Stream] = ()):
+        self.wallet = wallet
+        # stream id -> (start, duration, sign, amount)
+        self._entries: Dict[int, Tuple[int, int, int, int]] = {}
+        self._built = False
+        for stream in streams:
+            self.add(stream)
+
+    def stream_ids(self):
+        return self._entries.keys()
+
+    def add(self, stream: Stream, stream_id: Optional[int] = None):
+        """Adds a stream, under stream_id if it is not set on the stream yet."""
+        if stream.accrued:
+            return
+        if stream.to_address == self.wallet:
+            sign = 1
+        elif stream.from_address == self.wallet:
+            sign = -1
+        else:
+            return
+        self._entries[stream.id if stream_id is None else stream_id] = (
+            stream.start_timestamp,
+            stream.duration,
+            sign,
+            stream.amount,
+        )
+        self._built = False
+
+    def update(self, stream_id: int, duration: int, amount: int):
+        entry = self._entries.get(stream_id)
+        if entry is not None:
+            self._entries[stream_id] = (entry[0], duration, entry[2], amount)
+            self._built = False
+
+    def remove(self, stream_id: int):
+        if self._entries.pop(stream_id, None) is not None:
+            self._built = False
+
+    def _build(self):
+        starts = []
+        ends = []
+        remainders = []
+        for start, duration, sign, amount in self._entries.values():
+            quotient, remainder = divmod(amount, duration) if duration else (0, 0)
+            starts.append((start, sign * quotient, sign * quotient * start))
+            ends.append(
+                (
+                    start + duration,
+                    sign * amount,
+                    sign * quotient,
+                    sign * quotient * start,
+                )
+            )
+            if remainder:
+                remainders.append((start + duration, start, duration, sign, remainder))
+        starts.sort()
+        ends.sort()
+        remainders.sort()
+
+        self._starts = [row[0] for row in starts]
+        self._start_rates = list(accumulate((row[1] for row in starts), initial=0))
+        self._start_offsets = list(accumulate((row[2] for row in starts), initial=0))
+        self._ends = [row[0] for row in ends]
+        self._end_amounts = list(accumulate((row[1] for row in ends), initial=0))
+        self._end_rates = list(accumulate((row[2] for row in ends), initial=0))
+        self._end_offsets = list(accumulate((row[3] for row in ends), initial=0))
+        self._remainder_ends = [row[0] for row in remainders]
+        self._remainders = remainders
+        self._remainders_by_start = sorted(remainders, key=lambda row: row[1])
+        self._remainder_starts = [row[1] for row in self._remainders_by_start]
+        self._max_remainder_duration = max((row[2] for row in remainders), default=0)
+        self._built = True
+
+    def streamed_at(self, timestamp: int) -> int:
+        if not self._built:
+            self._build()
+        started = bisect_right(self._starts, timestamp)
+        ended = bisect_right(self._ends, timestamp)
+
+        streamed = self._end_amounts[ended]
+        # Quotient terms of the streams started but not ended by timestamp
+        rate = self._start_rates[started] - self._end_rates[ended]
+        offset = self._start_offsets[started] - self._end_offsets[ended]
+        streamed += rate * timestamp - offset
+
+        # Running streams are both started and not ended by timestamp. The
+        # ones started by timestamp - the longest duration have all ended.
+        first = bisect_right(
+            self._remainder_starts, timestamp - self._max_remainder_duration
+        )
+        started = bisect_right(self._remainder_starts, timestamp)
+        ended = bisect_right(self._remainder_ends, timestamp)
+        if started - first <= len(self._remainders) - ended:
+            candidates = self._remainders_by_start[first:started]
+        else:
+            candidates = self._remainders[ended:]
+        for end, start, duration, sign, remainder in candidates:
+            if start <= timestamp < end:
+                streamed += sign * (remainder * (timestamp - start) // duration)
+        return streamed
+
+    def streamed_series(self, timestamps: List[int]) -> List[int]:
+        """streamed_at for each timestamp, in one sweep over them in order.
+
+        The breakpoints are passed once, so the cost is a sort of the
+        timestamps plus, at each of them, the running streams with a
+        remainder.
+        """
+        if not self._built:
+            self._build()
+        series = [0] * len(timestamps)
+        started = ended = next_remainder = 0
+        # Running streams with a remainder, and a heap of their ends
+        running = {}
+        running_ends = []
+        for i in sorted(range(len(timestamps)), key=timestamps.__getitem__):
+            timestamp = timestamps[i]
+            while started < len(self._starts) and self._starts[started] <= timestamp:
+                started += 1
+            while ended < len(self._ends) and self._ends[ended] <= timestamp:
+                ended += 1
+            while (
+                next_remainder < len(self._remainders_by_start)
+                and self._remainders_by_start[next_remainder][1] <= timestamp
+            ):
+                end, start, duration, sign, remainder = self._remainders_by_start[
+                    next_remainder
+                ]
+                running[next_remainder] = (start, duration, sign, remainder)
+                heappush(running_ends, (end, next_remainder))
+                next_remainder += 1
+            while running_ends and running_ends[0][0] <= timestamp:
+                del running[heappop(running_ends)[1]]
+
+            streamed = self._end_amounts[ended]
+            rate = self._start_rates[started] - self._end_rates[ended]
+            offset = self._start_offsets[started] - self._end_offsets[ended]
+            streamed += rate * timestamp - offset
+            for start, duration, sign, remainder in running.values():
+                streamed += sign * (remainder * (timestamp - start) // duration)
+            series[i] = streamed
+        return series
+
+
+class ScheduleCache:
+    """VestingSchedules of one connection, kept in step with its stream writes.
+
+    The stream write functions in dapp.db apply each change to the cached
+    schedules it touches. data_version is SQLite's counter of commits by
+    other connections; the cache is dropped when it moves, and on rollback.
+    """
+
+    def __init__(self, data_version: int, size: int = SCHEDULE_CACHE_SIZE):
+        self.data_version = data_version
+        self.size = size
+        self._schedules: Dict[Tuple[str, str], VestingSchedule] = {}
+        self._keys_by_stream: Dict[int, List[Tuple[str, str]]] = {}
+
+    def get(self, wallet: str, token_address: str) -> Optional[VestingSchedule]:
+        key = (wallet, token_address)
+        schedule = self._schedules.pop(key, None)
+        if schedule is not None:
+            self._schedules[key] = schedule
+        return schedule
+
+    def put(self, token_address: str, schedule: VestingSchedule) -> VestingSchedule:
+        if len(self._schedules) >= self.size:
+            oldest = next(iter(self._schedules))
+            self._forget(oldest, self._schedules.pop(oldest))
+        key = (schedule.wallet, token_address)
+        self._schedules[key] = schedule
+        for stream_id in schedule.stream_ids():
+            self._keys_by_stream.setdefault(stream_id, []).append(key)
+        return schedule
+
+    def _forget(self, key, schedule: VestingSchedule):
+        for stream_id in schedule.stream_ids():
+            keys = self._keys_by_stream.get(stream_id)
+            if keys is not None and key in keys:
+                keys.remove(key)
+                if not keys:
+                    del self._keys_by_stream[stream_id]
+
+    def _schedules_of(self, stream_id: int):
+        for key in self._keys_by_stream.get(stream_id, ()):
+            schedule = self._schedules.get(key)
+            if schedule is not None:
+                yield schedule
+
+    def stream_added(self, stream_id: int, stream: Stream):
+        for wallet in dict.fromkeys((stream.from_address, stream.to_address)):
+            key = (wallet, stream.token_address)
+            schedule = self._schedules.get(key)
+            if schedule is not None:
+                schedule.add(stream, stream_id)
+                self._keys_by_stream.setdefault(stream_id, []).append(key)
+
+    def stream_updated(self, stream_id: int, duration: int, amount: int):
+        for schedule in self._schedules_of(stream_id):
+            schedule.update(stream_id, duration, amount)
+
+    def stream_removed(self, stream_id: int):
+        for schedule in self._schedules_of(stream_id):
+            schedule.remove(stream_id)
+        self._keys_by_stream.pop(stream_id, None)
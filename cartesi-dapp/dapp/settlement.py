@@ -0,0 +1,112 @@
+import os
+import time
+from typing import Dict, List, Optional
+
+from dapp.db import (
+    archive_accrued_streams,
+    get_dapp_state,
+    get_token_addresses,
+    set_dapp_state,
+)
+from dapp.logger import logger
+from dapp.streamrebasetoken import StreamRebaseToken
+
+# Inputs between two runs of the settlement job, from the SETTLEMENT_INTERVAL
+# environment variable. The first input at or after each multiple of it
+# settles every token, in its own transaction before the input's action.
+# 0 leaves ended streams to the admin "settle" action and to each wallet's
+# process_streams.
+DEFAULT_SETTLEMENT_INTERVAL = 0
+# Accrued streams each settlement run moves to stream_archive, from the
+# ARCHIVE_BATCH_SIZE environment variable. 0 keeps them in stream.
+DEFAULT_ARCHIVE_BATCH_SIZE = 0
+
+
+def _get_count(name: str, default: int) -> int:
+    value = os.getenv(name, str(default))
+    if not value.isdigit():
+        raise ValueError(f"{name} must be a non-negative integer, not {value}")
+    return int(value)
+
+
+def get_settlement_interval() -> int:
+    return _get_count("SETTLEMENT_INTERVAL", DEFAULT_SETTLEMENT_INTERVAL)
+
+
+def get_archive_batch_size() -> int:
+    return _get_count("ARCHIVE_BATCH_SIZE", DEFAULT_ARCHIVE_BATCH_SIZE)
+
+
+# dapp_state row holding the multiple of the interval last settled
+LAST_SETTLEMENT = "last_settlement_input"
+
+
+def settlement_due(input_index: int, interval: int, last_settled: int) -> bool:
+    """Whether the last multiple of interval up to input_index is unsettled.
+
+    A run that was rolled back, or an input the rollup node reverted, leaves
+    last_settled behind, so the next input runs it instead.
+    """
+    return interval > 0 and input_index - input_index % interval > last_settled
+
+
+def run_settlement_job(manager, input_index: int, current_timestamp: int):
+    """Runs the interval settlement before an input, if one is due.
+
+    It commits on its own, so what the input's action does cannot undo or
+    skip it. A failure is logged and leaves the run to the next input.
+    Returns the settle_tokens summary, or None if nothing ran.
+    """
+    interval = get_settlement_interval()
+    if interval == 0:
+        return None
+    last_settled = int(get_dapp_state(manager.connection, LAST_SETTLEMENT) or 0)
+    if not settlement_due(input_index, interval, last_settled):
+        return None
+    try:
+        with manager.advance() as connection:
+            summary = settle_tokens(connection, current_timestamp)
+            set_dapp_state(
+                connection, LAST_SETTLEMENT, str(input_index - input_index % interval)
+            )
+    except Exception as e:
+        logger.error(f"Settlement before input {input_index} failed: {e!r}")
+        return None
+    return summary
+
+
+def settle_tokens(
+    connection, current_timestamp: int, token_addresses: Optional[List[str]] = None
+) -> Dict:
+    """Accrues the ended streams of each token, every known token by default.
+
+    Then moves up to ARCHIVE_BATCH_SIZE accrued streams, of any token, to
+    stream_archive. Returns the number of tokens, streams accrued, wallets
+    updated and streams archived, and the milliseconds it took. The time
+    is only informative: it is logged and reported, never stored.
+    """
+    start = time.perf_counter()
+    if token_addresses is None:
+        token_addresses = get_token_addresses(connection)
+    streams = wallets = 0
+    for token_address in token_addresses:
+        token_streams, token_wallets = StreamRebaseToken(
+            connection, token_address
+        ).settle_ended_streams(current_timestamp)
+        streams += token_streams
+        wallets += token_wallets
+    archive_batch_size = get_archive_batch_size()
+    archived = archive_accrued_streams(connection, archive_batch_size)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    logger.info(
+        f"Settled {streams} ended streams of {wallets} wallets in"
+        f" {len(token_addresses)} tokens and archived {archived} in"
+        f" {elapsed_ms:.1f} ms"
+    )
+    return {
+        "tokens": len(token_addresses),
+        "streams": streams,
+        "wallets": wallets,
+        "archived": archived,
+        "elapsed_ms": round(elapsed_ms, 3),
+    }
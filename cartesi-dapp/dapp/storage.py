@@ -0,0 +1,63 @@
+import os
+
+# How SQLite stores the dapp's database, from the STORAGE_PROFILE
+# environment variable:
+#   rollup   inside the Cartesi machine. Durability comes from the machine
+#            snapshot, so nothing is fsynced and the rollback journal is
+#            kept in memory. It is still needed to undo a rejected input.
+#            The page cache fits the 128Mi of RAM of the machine.
+#   indexer  local runs next to an indexer. The writer uses WAL so the
+#            indexer's read-only connection never waits on it, and reads
+#            go through mmap.
+#   test     the unit tests: journal, temp tables and a page cache large
+#            enough for the whole test database in memory, no fsync, and
+#            foreign keys enforced so that a bad write fails the test.
+STORAGE_PROFILES = ("rollup", "indexer", "test")
+DEFAULT_STORAGE_PROFILE = "rollup"
+
+# PRAGMAs of the dapp's read-write connection under each profile. A
+# negative cache_size is in KiB.
+WRITER_PRAGMAS = {
+    "rollup": [
+        ("journal_mode", "MEMORY"),
+        ("synchronous", "OFF"),
+        ("temp_store", "MEMORY"),
+        ("cache_size", -16384),
+    ],
+    "indexer": [
+        ("journal_mode", "WAL"),
+        ("synchronous", "NORMAL"),
+        ("temp_store", "MEMORY"),
+        ("mmap_size", 256 * 2**20),
+    ],
+    "test": [
+        ("journal_mode", "MEMORY"),
+        ("synchronous", "OFF"),
+        ("temp_store", "MEMORY"),
+        ("cache_size", -65536),
+        ("foreign_keys", "ON"),
+    ],
+}
+# PRAGMAs of get_readonly_connection() under each profile
+READER_PRAGMAS = {
+    "rollup": [("temp_store", "MEMORY"), ("cache_size", -16384)],
+    "indexer": [("temp_store", "MEMORY"), ("mmap_size", 256 * 2**20)],
+    "test": [("temp_store", "MEMORY")],
+}
+
+
+def get_storage_profile() -> str:
+    profile = os.getenv("STORAGE_PROFILE", DEFAULT_STORAGE_PROFILE)
+    if profile not in STORAGE_PROFILES:
+        raise ValueError(
+            f"STORAGE_PROFILE must be one of {', '.join(STORAGE_PROFILES)}, "
+            f"not {profile}"
+        )
+    return profile
+
+
+def apply_pragmas(connection, pragmas):
+    cursor = connection.cursor()
+    for name, value in pragmas:
+        # journal_mode answers with a row, the others with none
+        cursor.execute(f"PRAGMA {name} = {value}").fetchall()
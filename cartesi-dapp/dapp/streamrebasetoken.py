@@ -1,28 +1,40 @@
-from typing import List, Optional
+from typing import Dict, Iterable, List, Optional, Tuple
 
 from dapp.db import (
     add_stream,
     delete_stream_by_id,
     get_user_shares,
     get_max_end_timestamp_for_wallet,
+    get_committed_outflow,
     get_stream_by_id,
+    get_token_ended_streams,
+    get_token_shares,
+    get_token_streamed_amounts,
+    get_vesting_schedule,
     get_wallet_endend_streams,
+    get_wallet_received_amount,
     get_wallet_streams,
     get_token_total_assets,
     get_token_total_shares,
     set_token_total_assets,
     set_token_total_shares,
     set_users_shares,
+    set_users_shares_batch,
     update_stream_accrued,
+    update_streams_accrued,
     update_stream_amount_duration,
-    get_wallet_non_accrued_streamed_amts,
+    get_wallet_streamed_amount,
+    uses_flow_engine,
 )
-from dapp.hook import hook
+from dapp.flowrate import get_flow_streamed_amount, settle_flow
+from dapp.hook import hook, project_hook
+from dapp.schedule import VestingSchedule
 from dapp.stream import Stream
 from dapp.util import (
     address_or_raise,
     apply,
     assets_to_shares,
+    checksum_address,
     process_streams_before,
     shares_to_assets,
     with_checksum_address,
@@ -74,29 +86,89 @@ class StreamRebaseToken:
         balance = self.get_stored_balance(account_address)
         total_assets = get_token_total_assets(self._connection, self._address)
         total_shares = get_token_total_shares(self._connection, self._address)
+
+        # Counterparties are settled in memory one stream at a time, with the
+        # same shares -> assets -> shares round trip per stream as writing
+        # each one back, so rounding matches exactly. Everything is written
+        # once at the end.
+        shares_by_address = {}
+
+        def settle_counterparty(wallet: str, amount: int):
+            shares = shares_by_address.get(wallet)
+            if shares is None:
+                shares = get_user_shares(self._connection, wallet, self._address)
+            counterparty_balance = (
+                shares_to_assets(shares, total_shares, total_assets) + amount
+            )
+            shares_by_address[wallet] = assets_to_shares(
+                counterparty_balance, total_shares, total_assets
+            )
+
         for stream in ended_streams:
-            self.set_stream_accrued(stream.id)
             streamed_amount = stream.streamed_amt(current_timestamp)
             if stream.from_address == account_address:
                 balance -= streamed_amount
-                balance_to = (
-                    self.get_stored_balance(stream.to_address) + streamed_amount
-                )
-                shares = assets_to_shares(balance_to, total_shares, total_assets)
-                self.set_stored_user_shares(stream.to_address, shares)
+                settle_counterparty(stream.to_address, streamed_amount)
             if stream.to_address == account_address:
                 balance += streamed_amount
-                balance_from = (
-                    self.get_stored_balance(stream.from_address) - streamed_amount
-                )
-                shares = assets_to_shares(balance_from, total_shares, total_assets)
-                self.set_stored_user_shares(stream.from_address, shares)
+                settle_counterparty(stream.from_address, -streamed_amount)
 
-        shares = assets_to_shares(balance, total_shares, total_assets)
-        self.set_stored_user_shares(account_address, shares)
+        shares_by_address[account_address] = assets_to_shares(
+            balance, total_shares, total_assets
+        )
+        update_streams_accrued(
+            self._connection, [stream.id for stream in ended_streams]
+        )
+        set_users_shares_batch(self._connection, self._address, shares_by_address)
+        if uses_flow_engine(self._connection):
+            settle_flow(
+                self._connection, account_address, self._address, current_timestamp
+            )
 
         hook(self._connection, self._address, account_address, current_timestamp)
 
+    def settle_ended_streams(self, current_timestamp: int) -> Tuple[int, int]:
+        """Accrues every ended, non-swap stream of the token, whatever its wallets.
+
+        Unlike process_streams, which settles one wallet and round-trips each
+        counterparty per stream, the streamed amounts are netted per wallet
+        and every affected wallet gets a single shares update.
+        Returns (streams accrued, wallets updated).
+        """
+        ended_streams = get_token_ended_streams(
+            self._connection, self._address, current_timestamp
+        )
+        if not ended_streams:
+            return 0, 0
+
+        net_by_address = {}
+        for stream in ended_streams:
+            if stream.from_address == stream.to_address:
+                continue
+            net_by_address[stream.from_address] = (
+                net_by_address.get(stream.from_address, 0) - stream.amount
+            )
+            net_by_address[stream.to_address] = (
+                net_by_address.get(stream.to_address, 0) + stream.amount
+            )
+
+        total_assets = get_token_total_assets(self._connection, self._address)
+        total_shares = get_token_total_shares(self._connection, self._address)
+        shares_by_address = {}
+        for wallet, amount in net_by_address.items():
+            shares = get_user_shares(self._connection, wallet, self._address)
+            shares_by_address[wallet] = assets_to_shares(
+                shares_to_assets(shares, total_shares, total_assets) + amount,
+                total_shares,
+                total_assets,
+            )
+
+        update_streams_accrued(
+            self._connection, [stream.id for stream in ended_streams]
+        )
+        set_users_shares_batch(self._connection, self._address, shares_by_address)
+        return len(ended_streams), len(shares_by_address)
+
     def mint_shares(self, shares_amount: int, wallet: str):
         address_or_raise(wallet)
         if shares_amount <= 0:
@@ -138,6 +210,9 @@ class StreamRebaseToken:
 
     @process_streams_before
     def burn_assets(self, assets_amount: int, sender: str, current_timestamp: int):
+        self._burn_assets(assets_amount, sender, current_timestamp)
+
+    def _burn_assets(self, assets_amount: int, sender: str, current_timestamp: int):
         assert current_timestamp is not None, "Current timestamp must be provided."
         assert assets_amount > 0, "Asset amount must be positive."
 
@@ -171,60 +246,146 @@ class StreamRebaseToken:
     ):
         address_or_raise(account_address)
         balance = self.get_stored_balance(account_address)
-        streamed_amounts = get_wallet_non_accrued_streamed_amts(
-            self._connection,
-            account_address,
-            self._address,
-            at_timestamp,
-            recipient_until_timestamp=(
-                at_timestamp if count_received else recipient_until_timestamp
-            ),
-        )
-
-        balance += sum(streamed for streamed in streamed_amounts)
+        if count_received and uses_flow_engine(self._connection):
+            balance += get_flow_streamed_amount(
+                self._connection, account_address, self._address, at_timestamp
+            )
+        elif count_received:
+            balance += self.vesting_schedule(account_address).streamed_at(at_timestamp)
+        else:
+            balance += get_wallet_streamed_amount(
+                self._connection,
+                account_address,
+                self._address,
+                at_timestamp,
+                recipient_until_timestamp=recipient_until_timestamp,
+            )
 
         return balance
 
-    # Only used in the indexer and never during dapp execution
-    def future_balance_of(self, account_address: str, future_timestamp=None):
+    def balance_series(self, account_address: str, timestamps: List[int]) -> List[int]:
+        """balance_of at each of the timestamps, in the same order."""
         address_or_raise(account_address)
-        self._connection.execute("SAVEPOINT future_balance_of")
-        try:
-            max_timestamp = (
-                future_timestamp
-                if future_timestamp
-                else get_max_end_timestamp_for_wallet(self._connection, account_address)
+        balance = self.get_stored_balance(account_address)
+        return [
+            balance + streamed
+            for streamed in self.vesting_schedule(account_address).streamed_series(
+                timestamps
+            )
+        ]
+
+    def vesting_schedule(self, account_address: str) -> VestingSchedule:
+        return get_vesting_schedule(self._connection, account_address, self._address)
+
+    def balance_of_many(
+        self, wallets: Iterable[str], at_timestamp: int
+    ) -> Dict[str, int]:
+        """balance_of for many wallets, read with one query per table."""
+        # Like the str arguments of every method, each wallet is checksummed
+        wallets = [address_or_raise(checksum_address(wallet)) for wallet in wallets]
+        return self._balances(wallets, at_timestamp)
+
+    def token_holder_snapshot(self, at_timestamp: int) -> Dict[str, int]:
+        """balance_of for every wallet with shares or a live stream of the token."""
+        return self._balances(None, at_timestamp)
+
+    def _balances(self, wallets, at_timestamp):
+        shares_by_account = get_token_shares(self._connection, self._address)
+        streamed_by_address = get_token_streamed_amounts(
+            self._connection, self._address, at_timestamp
+        )
+        if wallets is None:
+            wallets = sorted({**shares_by_account, **streamed_by_address})
+        total_assets = get_token_total_assets(self._connection, self._address)
+        total_shares = get_token_total_shares(self._connection, self._address)
+        return {
+            wallet: shares_to_assets(
+                shares_by_account.get(wallet, 0), total_shares, total_assets
             )
-            hook(self._connection, self._address, account_address, max_timestamp)
-            balance = self.balance_of(account_address, max_timestamp)
-        finally:
-            self._connection.execute("ROLLBACK TO SAVEPOINT future_balance_of")
-            self._connection.execute("RELEASE SAVEPOINT future_balance_of")
+            + streamed_by_address.get(wallet, 0)
+            for wallet in wallets
+        }
+
+    # Only used in the indexer and never during dapp execution. Both future_*
+    # methods only read, so they can run on a get_readonly_connection().
+    def future_balance_of(self, account_address: str, future_timestamp=None):
+        address_or_raise(account_address)
+        max_timestamp, streams = self._project_streams(
+            account_address, future_timestamp
+        )
+        balance = self.get_stored_balance(account_address)
+        balance += VestingSchedule(account_address, streams).streamed_at(max_timestamp)
 
         return balance
 
-    def get_streams(self, account_address: str):
+    def get_streams(
+        self,
+        account_address: str,
+        include_archived=False,
+        after_id=0,
+        limit=None,
+    ):
+        """The wallet's streams, see get_wallet_streams for the history paging."""
         address_or_raise(account_address)
-        return get_wallet_streams(self._connection, account_address, self._address)
+        return get_wallet_streams(
+            self._connection,
+            account_address,
+            self._address,
+            include_archived=include_archived,
+            after_id=after_id,
+            limit=limit,
+        )
 
     # Only used in the indexer and never during dapp execution
-    def future_get_streams(self, account_address: str, future_timestamp=None):
+    def future_get_streams(
+        self,
+        account_address: str,
+        future_timestamp=None,
+        include_archived=False,
+        after_id=0,
+        limit=None,
+    ):
         address_or_raise(account_address)
-        self._connection.execute("SAVEPOINT future_get_streams")
-        try:
-            max_timestamp = (
-                future_timestamp
-                if future_timestamp
-                else get_max_end_timestamp_for_wallet(self._connection, account_address)
-            )
-            hook(self._connection, self._address, account_address, max_timestamp)
-            streams = self.get_streams(account_address)
-        finally:
-            self._connection.execute("ROLLBACK TO SAVEPOINT future_get_streams")
-            self._connection.execute("RELEASE SAVEPOINT future_get_streams")
-
+        _, streams = self._project_streams(
+            account_address,
+            future_timestamp,
+            include_archived=include_archived,
+            after_id=after_id,
+            limit=limit,
+        )
         return streams
 
+    def _project_streams(self, account_address: str, future_timestamp, **paging):
+        max_timestamp = (
+            future_timestamp
+            if future_timestamp
+            else get_max_end_timestamp_for_wallet(self._connection, account_address)
+        )
+        streams = project_hook(
+            self.get_streams(account_address, **paging),
+            self._address,
+            account_address,
+            max_timestamp,
+        )
+        return max_timestamp, streams
+
+    def uncommitted_balance(self, account_address: str, current_timestamp: int):
+        """What the wallet can still stream after paying every stream it sends.
+
+        Equal to balance_of(account_address, t, False, current_timestamp) for
+        any t past the end of all its streams and current_timestamp: every
+        outgoing stream counts in full and incoming ones as far as they have
+        been paid by current_timestamp. The outgoing side is read from the
+        maintained stream_outflow total instead of the streams themselves.
+        """
+        return (
+            self.get_stored_balance(account_address)
+            - get_committed_outflow(self._connection, account_address, self._address)
+            + get_wallet_received_amount(
+                self._connection, account_address, self._address, current_timestamp
+            )
+        )
+
     def _transfer(
         self,
         receiver: str,
@@ -234,7 +395,9 @@ class StreamRebaseToken:
         sender: str,
         current_timestamp: int,
         swap_id: Optional[int] = None,
+        check_funds: bool = True,
     ) -> int:
+        """Adds the stream; check_funds=False leaves the funds check to the caller."""
         address_or_raise(receiver)
         start_timestamp = current_timestamp if start_timestamp == 0 else start_timestamp
         assert (
@@ -244,15 +407,13 @@ class StreamRebaseToken:
         assert sender != receiver, "Sender and receiver must be different."
         assert amount >= 0, "Amount must be positive."
 
-        max_timestamp = max(
-            start_timestamp + duration,
-            get_max_end_timestamp_for_wallet(self._connection, sender),
-        )
-
-        future_balance_after_send = self.balance_of(
-            sender, max_timestamp, False, current_timestamp
-        )
-        assert future_balance_after_send >= amount, "Not enough funds for the transfer."
+        if check_funds:
+            future_balance_after_send = self.uncommitted_balance(
+                sender, current_timestamp
+            )
+            assert (
+                future_balance_after_send >= amount
+            ), "Not enough funds for the transfer."
 
         return self.add_stream(
             Stream(
@@ -291,6 +452,9 @@ class StreamRebaseToken:
 
     @process_streams_before
     def cancel_stream(self, stream_id: int, sender: str, current_timestamp: int):
+        self._cancel_stream(stream_id, sender, current_timestamp)
+
+    def _cancel_stream(self, stream_id: int, sender: str, current_timestamp: int):
         stream = self.get_stream_by_id(stream_id)
         assert stream is not None, "Stream not found."
         assert stream.from_address == sender, "Sender is not the stream owner."
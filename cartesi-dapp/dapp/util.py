@@ -1,13 +1,12 @@
 import json
 import logging
 import hashlib
+from functools import lru_cache
 from os import environ
 
-# External libraries
-from eth_abi.codec import ABICodec
-from eth_abi.decoding import AddressDecoder, BooleanDecoder, UnsignedIntegerDecoder
-from eth_abi.registry import BaseEquals, registry_packed
-from eth_utils import is_hex_address, to_checksum_address, is_checksum_address
+# eth_abi and eth_utils are imported on first use rather than here. This
+# module is on the boot path, and those imports dominate the time before the
+# dapp's first /finish.
 
 # Constants
 ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
@@ -17,31 +16,58 @@ MAX_UINT256 = 2**256 - 1
 USER_FEES = 30  # 0.3%
 DCA_INTERVAL_SECONDS = 60
 ONE_ETH = 10**18
+MAX_BALANCE_SERIES_POINTS = 1000
+MAX_BATCH_ACTIONS = 256
+# Bound on the IN (...) list so statements stay well under SQLite's variable
+# limit and only a few distinct shapes end up in the statement cache.
+STREAM_IDS_CHUNK = 256
 
 CONDITION_TYPES = {"GT", "LT", "GTE", "LTE"}
 
 
-# Custom Decoder Classes
-class PackedBooleanDecoder(BooleanDecoder):
-    data_byte_size = 1
+# Codec for packed data, with the custom decoders registered on first use
+@lru_cache(maxsize=None)
+def get_codec_packed():
+    from eth_abi.codec import ABICodec
+    from eth_abi.decoding import (
+        AddressDecoder,
+        BooleanDecoder,
+        UnsignedIntegerDecoder,
+    )
+    from eth_abi.registry import BaseEquals, registry_packed
 
+    class PackedBooleanDecoder(BooleanDecoder):
+        data_byte_size = 1
 
-class PackedAddressDecoder(AddressDecoder):
-    data_byte_size = 20
+    class PackedAddressDecoder(AddressDecoder):
+        data_byte_size = 20
 
+    registry_packed.register_decoder(
+        BaseEquals("bool"), PackedBooleanDecoder, label="bool"
+    )
+    registry_packed.register_decoder(
+        BaseEquals("address"), PackedAddressDecoder, label="address"
+    )
+    registry_packed.register_decoder(
+        BaseEquals("uint"), UnsignedIntegerDecoder, label="uint"
+    )
+    return ABICodec(registry_packed)
 
-# Registering Custom Decoders
-registry_packed.register_decoder(BaseEquals("bool"), PackedBooleanDecoder, label="bool")
-registry_packed.register_decoder(
-    BaseEquals("address"), PackedAddressDecoder, label="address"
-)
-registry_packed.register_decoder(
-    BaseEquals("uint"), UnsignedIntegerDecoder, label="uint"
-)
 
-# Codec for packed data
-default_codec_packed = ABICodec(registry_packed)
-decode_packed = default_codec_packed.decode
+def decode_packed(types, data):
+    return get_codec_packed().decode(types, data)
+
+
+def is_hex_address(value):
+    from eth_utils import is_hex_address
+
+    return is_hex_address(value)
+
+
+def to_checksum_address(value):
+    from eth_utils import to_checksum_address
+
+    return to_checksum_address(value)
 
 
 # Conversion utilities
@@ -71,16 +97,89 @@ def int_to_str(integer):
         return "0"
 
 
+def int_to_bytes32(integer):
+    """Encodes a uint256 as a 32-byte big-endian unsigned blob.
+
+    The blobs sort in numeric order when SQLite compares them, so columns
+    written with it (token totals, stream amounts, outflows, remainders and
+    the swap amounts) can be compared and take MIN/MAX in SQL. Raises
+    ValueError for a negative or too large value, which rejects the input
+    writing it. Encodes 0 if the input is None or not an integer.
+    """
+    try:
+        integer = int(integer)
+    except (TypeError, ValueError):
+        integer = 0
+    if not 0 <= integer < 2**256:
+        raise ValueError(f"{integer} does not fit in a uint256")
+    return integer.to_bytes(32, "big")
+
+
+def bytes32_to_int(blob):
+    """Decodes a blob written by int_to_bytes32. Returns 0 if the input is None."""
+    if blob is None:
+        return 0
+    return int.from_bytes(blob, "big")
+
+
+def int_to_signed_bytes32(integer):
+    """Encodes an int256 as a 32-byte big-endian two's complement blob.
+
+    Only for the columns that can hold a negative value: balance shares of
+    an over-withdrawn sender, and the net flows of dapp.flowrate. Negative
+    values sort above every positive one, so these columns must not be
+    compared or aggregated in SQL. Encodes 0 if the input is None or not
+    an integer.
+    """
+    try:
+        integer = int(integer)
+    except (TypeError, ValueError):
+        integer = 0
+    if not -(2**255) <= integer < 2**255:
+        raise ValueError(f"{integer} does not fit in an int256")
+    return integer.to_bytes(32, "big", signed=True)
+
+
+def signed_bytes32_to_int(blob):
+    """Decodes a blob written by int_to_signed_bytes32. Returns 0 if the input is None."""
+    if blob is None:
+        return 0
+    return int.from_bytes(blob, "big", signed=True)
+
+
+# Addresses
+class ChecksumAddress(str):
+    """A hex address already in EIP-55 checksum form.
+
+    Only checksum_address() creates these. with_checksum_address and
+    address_or_raise let them through without hashing them again.
+    """
+
+    __slots__ = ()
+
+
+CHECKSUM_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=CHECKSUM_CACHE_SIZE)
+def _checksum_address(value):
+    if not is_hex_address(value):
+        return value
+    return ChecksumAddress(to_checksum_address(value))
+
+
+def checksum_address(value):
+    """Returns value as a ChecksumAddress if it is a hex address, otherwise unchanged."""
+    if type(value) is ChecksumAddress or not isinstance(value, str):
+        return value
+    return _checksum_address(value)
+
+
 # Decorators
 def with_checksum_address(func):
     def wrapper(*args, **kwargs):
-        new_args = tuple(
-            to_checksum_address(arg) if is_hex_address(arg) else arg for arg in args
-        )
-        new_kwargs = {
-            key: to_checksum_address(value) if is_hex_address(value) else value
-            for key, value in kwargs.items()
-        }
+        new_args = tuple(checksum_address(arg) for arg in args)
+        new_kwargs = {key: checksum_address(value) for key, value in kwargs.items()}
         return func(*new_args, **new_kwargs)
 
     return wrapper
@@ -147,6 +246,9 @@ rollup_server = environ.get("ROLLUP_HTTP_SERVER_URL", "http://127.0.0.1:5004")
 
 # Utilities
 def address_or_raise(address):
-    if not is_checksum_address(address):
+    if type(address) is ChecksumAddress:
+        return address
+    normalized = checksum_address(address)
+    if type(normalized) is not ChecksumAddress or normalized != address:
         raise ValueError(f"Invalid address {address}")
-    return address
+    return normalized
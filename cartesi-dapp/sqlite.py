@@ -1,6 +1,7 @@
 import os
 
 from dapp.db import get_connection
+from dapp.util import bytes32_to_int, int_to_bytes32, int_to_signed_bytes32
 
 
 def initialise_db():
@@ -11,8 +12,13 @@ def initialise_db():
         pass
 
     conn = get_connection()
-    cursor = conn.cursor()
+    create_schema(conn.cursor())
+    conn.commit()
+
+    conn.close()
+
 
+def create_schema(cursor):
     cursor.execute(
         """
         CREATE TABLE IF NOT EXISTS dapp_addresses (
@@ -32,10 +38,13 @@ def initialise_db():
         ],
     )
 
+    # Address dictionary. Every other table stores an address as the INTEGER
+    # id of its row here, see dapp/addresses.py.
     cursor.execute(
         """
         CREATE TABLE IF NOT EXISTS account (
-            address TEXT PRIMARY KEY
+            id INTEGER PRIMARY KEY,
+            address TEXT NOT NULL UNIQUE
         )
         """
     )
@@ -43,18 +52,287 @@ def initialise_db():
     cursor.execute(
         """
         CREATE TABLE IF NOT EXISTS token (
+            id INTEGER PRIMARY KEY,
+            total_assets BLOB NOT NULL,
+            total_shares BLOB NOT NULL,
+            FOREIGN KEY (id) REFERENCES account(id)
+        )
+        """
+    )
+
+    # Key columns first: SQLite 3.40's integrity_check reports NULLs in the
+    # non-key columns of a WITHOUT ROWID table that lists them before its key.
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS balance (
+            account_id INTEGER NOT NULL,
+            token_id INTEGER NOT NULL,
+            shares BLOB NOT NULL,
+            FOREIGN KEY (account_id) REFERENCES account(id),
+            FOREIGN KEY (token_id) REFERENCES token(id),
+            PRIMARY KEY (account_id, token_id)
+        ) WITHOUT ROWID
+        """
+    )
+
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS stream (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            from_id INTEGER NOT NULL,
+            to_id INTEGER NOT NULL,
+            start_timestamp INTEGER NOT NULL,
+            duration INTEGER NOT NULL,
+            amount BLOB NOT NULL,
+            token_id INTEGER NOT NULL,
+            accrued INTEGER NOT NULL,
+            swap_id TEXT,
+            end_timestamp INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (token_id) REFERENCES token(id),
+            FOREIGN KEY (from_id) REFERENCES account(id),
+            FOREIGN KEY (to_id) REFERENCES account(id)
+        )
+        """
+    )
+
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_stream_token_id ON stream(token_id)")
+    create_stream_indexes(cursor)
+
+    # Sum of the amounts of each wallet's non-accrued streams to others, kept
+    # up to date by every stream write so the transfer check needs no scan.
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS stream_outflow (
+            account_id INTEGER NOT NULL,
+            token_id INTEGER NOT NULL,
+            committed BLOB NOT NULL,
+            PRIMARY KEY (account_id, token_id)
+        ) WITHOUT ROWID
+        """
+    )
+
+    create_flow_tables(cursor)
+    create_dapp_state(cursor)
+
+    # Accrued streams moved out of stream by archive_accrued_streams. They
+    # are only read for history, so the table keeps no accrued, swap or
+    # end_timestamp column and only the two wallet indexes.
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS stream_archive (
+            id INTEGER PRIMARY KEY,
+            from_id INTEGER NOT NULL,
+            to_id INTEGER NOT NULL,
+            start_timestamp INTEGER NOT NULL,
+            duration INTEGER NOT NULL,
+            amount BLOB NOT NULL,
+            token_id INTEGER NOT NULL
+        )
+        """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_stream_archive_from
+        ON stream_archive(from_id, token_id)
+        """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_stream_archive_to
+        ON stream_archive(to_id, token_id)
+        """
+    )
+
+    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def create_stream_indexes(cursor):
+    # Every hot stream query filters on one side of the stream, mostly with
+    # the token. Splitting the OR into UNION ALL branches lets each branch
+    # seek one of these, and the partial indexes only hold the live
+    # (non-accrued) rows. end_timestamp is stored so that "has ended" is a
+    # range on the index rather than an expression evaluated on every row.
+    # The live indexes carry every column the balance query reads; accrued is
+    # listed too because SQLite only treats a partial index as covering when
+    # the columns in its WHERE clause are part of the index.
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_stream_from_token
+        ON stream(from_id, token_id)
+        """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_stream_to_token
+        ON stream(to_id, token_id)
+        """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_stream_from_end
+        ON stream(from_id, end_timestamp)
+        """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_stream_to_end
+        ON stream(to_id, end_timestamp)
+        """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_stream_live_from
+        ON stream(from_id, token_id, end_timestamp, start_timestamp, duration, amount, to_id, accrued)
+        WHERE accrued = 0
+        """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_stream_live_to
+        ON stream(to_id, token_id, end_timestamp, start_timestamp, duration, amount, accrued)
+        WHERE accrued = 0
+        """
+    )
+    # The settlement job reads every ended live stream of a token at once
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_stream_live_end
+        ON stream(token_id, end_timestamp)
+        WHERE accrued = 0
+        """
+    )
+    # Rows waiting to be moved to stream_archive, empty once compacted
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_stream_archivable
+        ON stream(id)
+        WHERE accrued = 1 AND swap_id IS NULL
+        """
+    )
+
+
+def create_flow_tables(cursor):
+    # Net flow of each (wallet, token) for the flowrate stream engine, see
+    # dapp/flowrate.py. Only written while STREAM_ENGINE=flowrate.
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS flow_state (
+            account_id INTEGER NOT NULL,
+            token_id INTEGER NOT NULL,
+            settled_timestamp INTEGER NOT NULL,
+            settled BLOB NOT NULL,
+            rate BLOB NOT NULL,
+            PRIMARY KEY (account_id, token_id)
+        ) WITHOUT ROWID
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS flow_event (
+            account_id INTEGER NOT NULL,
+            token_id INTEGER NOT NULL,
+            timestamp INTEGER NOT NULL,
+            stream_id INTEGER NOT NULL,
+            rate BLOB NOT NULL,
+            amount BLOB NOT NULL
+        )
+        """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_flow_event_account
+        ON flow_event(account_id, token_id, timestamp)
+        """
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_flow_event_stream ON flow_event(stream_id)"
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS flow_remainder (
+            stream_id INTEGER NOT NULL,
+            account_id INTEGER NOT NULL,
+            token_id INTEGER NOT NULL,
+            start_timestamp INTEGER NOT NULL,
+            end_timestamp INTEGER NOT NULL,
+            remainder BLOB NOT NULL,
+            sign INTEGER NOT NULL,
+            PRIMARY KEY (stream_id, account_id)
+        )
+        """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_flow_remainder_account
+        ON flow_remainder(account_id, token_id, end_timestamp)
+        """
+    )
+
+
+# Migrations bring an existing dapp.sqlite up to date. Entry i upgrades a
+# database from user_version i to i + 1, while initialise_db() creates the
+# latest schema directly. Migrations are frozen, so they must not call the
+# create_* helpers above, which always describe the latest schema.
+def migrate_stream_indexes(cursor):
+    cursor.execute("DROP INDEX IF EXISTS idx_stream_from_address")
+    cursor.execute("DROP INDEX IF EXISTS idx_stream_to_address")
+    cursor.execute("DROP INDEX IF EXISTS idx_stream_accrued")
+    cursor.execute(
+        "CREATE INDEX idx_stream_from_token ON stream(from_address, token_address)"
+    )
+    cursor.execute(
+        "CREATE INDEX idx_stream_to_token ON stream(to_address, token_address)"
+    )
+    cursor.execute(
+        """
+        CREATE INDEX idx_stream_live_from
+        ON stream(from_address, token_address, start_timestamp, duration, amount, to_address, accrued)
+        WHERE accrued = 0
+        """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX idx_stream_live_to
+        ON stream(to_address, token_address, start_timestamp, duration, amount, accrued)
+        WHERE accrued = 0
+        """
+    )
+
+
+def migrate_amounts_to_blobs(cursor):
+    # Amounts were decimal TEXT. Rebuild the tables with BLOB columns and
+    # convert every value with the same codecs dapp.db uses. Shares can be
+    # negative, so they are the only signed column.
+    cursor.connection.create_function(
+        "int_to_bytes32", 1, int_to_bytes32, deterministic=True
+    )
+    cursor.connection.create_function(
+        "int_to_signed_bytes32", 1, int_to_signed_bytes32, deterministic=True
+    )
+    cursor.execute(
+        """
+        CREATE TABLE token_blob (
             address TEXT PRIMARY KEY,
-            total_assets TEXT NOT NULL,
-            total_shares TEXT NOT NULL,
+            total_assets BLOB NOT NULL,
+            total_shares BLOB NOT NULL,
             FOREIGN KEY (address) REFERENCES account(address)
         )
         """
     )
+    cursor.execute(
+        """
+        INSERT INTO token_blob (address, total_assets, total_shares)
+        SELECT address, int_to_bytes32(total_assets), int_to_bytes32(total_shares)
+        FROM token
+        """
+    )
+    cursor.execute("DROP TABLE token")
+    cursor.execute("ALTER TABLE token_blob RENAME TO token")
 
     cursor.execute(
         """
-        CREATE TABLE IF NOT EXISTS balance (
-            shares TEXT NOT NULL,
+        CREATE TABLE balance_blob (
+            shares BLOB NOT NULL,
             account_address TEXT NOT NULL,
             token_address TEXT NOT NULL,
             FOREIGN KEY (account_address) REFERENCES account(address),
@@ -63,16 +341,28 @@ def initialise_db():
         )
         """
     )
+    cursor.execute(
+        """
+        INSERT INTO balance_blob (shares, account_address, token_address)
+        SELECT int_to_signed_bytes32(shares), account_address, token_address
+        FROM balance
+        """
+    )
+    cursor.execute("DROP TABLE balance")
+    cursor.execute("ALTER TABLE balance_blob RENAME TO balance")
 
+    row = cursor.execute(
+        "SELECT seq FROM sqlite_sequence WHERE name = 'stream'"
+    ).fetchone()
     cursor.execute(
         """
-        CREATE TABLE IF NOT EXISTS stream (
+        CREATE TABLE stream_blob (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             from_address TEXT NOT NULL,
             to_address TEXT NOT NULL,
             start_timestamp INTEGER NOT NULL,
             duration INTEGER NOT NULL,
-            amount TEXT NOT NULL,
+            amount BLOB NOT NULL,
             token_address TEXT NOT NULL,
             accrued INTEGER NOT NULL,
             swap_id TEXT,
@@ -82,21 +372,584 @@ def initialise_db():
         )
         """
     )
+    cursor.execute(
+        """
+        INSERT INTO stream_blob (id, from_address, to_address, start_timestamp, duration, amount, token_address, accrued, swap_id)
+        SELECT id, from_address, to_address, start_timestamp, duration, int_to_bytes32(amount), token_address, accrued, swap_id
+        FROM stream
+        """
+    )
+    cursor.execute("DROP TABLE stream")
+    cursor.execute("ALTER TABLE stream_blob RENAME TO stream")
+    if row is not None:
+        # Keep ids of deleted streams from being handed out again
+        cursor.execute(
+            "UPDATE sqlite_sequence SET seq = ? WHERE name = 'stream'", (row[0],)
+        )
+    cursor.execute("CREATE INDEX idx_stream_token_address ON stream(token_address)")
+    cursor.execute(
+        "CREATE INDEX idx_stream_from_token ON stream(from_address, token_address)"
+    )
+    cursor.execute(
+        "CREATE INDEX idx_stream_to_token ON stream(to_address, token_address)"
+    )
+    cursor.execute(
+        """
+        CREATE INDEX idx_stream_live_from
+        ON stream(from_address, token_address, start_timestamp, duration, amount, to_address, accrued)
+        WHERE accrued = 0
+        """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX idx_stream_live_to
+        ON stream(to_address, token_address, start_timestamp, duration, amount, accrued)
+        WHERE accrued = 0
+        """
+    )
+
+    # The swap tables are not created by this schema, convert them in place
+    # for databases that have them.
+    swap_amount_columns = {
+        "swap_refund": ["amount"],
+        "spot_price": ["price"],
+        "swap_execution": ["amount_to_pair", "amount_from_pair", "refund_from_pair"],
+    }
+    for table, columns in swap_amount_columns.items():
+        exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+            (table,),
+        ).fetchone()
+        if exists:
+            assignments = ", ".join(f"{c} = int_to_bytes32({c})" for c in columns)
+            cursor.execute(f"UPDATE {table} SET {assignments}")
 
+
+def migrate_stream_end_timestamp(cursor):
+    cursor.execute(
+        "ALTER TABLE stream ADD COLUMN end_timestamp INTEGER NOT NULL DEFAULT 0"
+    )
+    cursor.execute("UPDATE stream SET end_timestamp = start_timestamp + duration")
+    cursor.execute("DROP INDEX IF EXISTS idx_stream_live_from")
+    cursor.execute("DROP INDEX IF EXISTS idx_stream_live_to")
     cursor.execute(
-        "CREATE INDEX IF NOT EXISTS idx_stream_from_address ON stream(from_address)"
+        "CREATE INDEX idx_stream_from_end ON stream(from_address, end_timestamp)"
     )
     cursor.execute(
-        "CREATE INDEX IF NOT EXISTS idx_stream_to_address ON stream(to_address)"
+        "CREATE INDEX idx_stream_to_end ON stream(to_address, end_timestamp)"
     )
     cursor.execute(
-        "CREATE INDEX IF NOT EXISTS idx_stream_token_address ON stream(token_address)"
+        """
+        CREATE INDEX idx_stream_live_from
+        ON stream(from_address, token_address, end_timestamp, start_timestamp, duration, amount, to_address, accrued)
+        WHERE accrued = 0
+        """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX idx_stream_live_to
+        ON stream(to_address, token_address, end_timestamp, start_timestamp, duration, amount, accrued)
+        WHERE accrued = 0
+        """
     )
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_stream_accrued ON stream(accrued)")
 
-    conn.commit()
 
-    conn.close()
+def migrate_stream_outflow(cursor):
+    cursor.execute(
+        """
+        CREATE TABLE stream_outflow (
+            account_address TEXT NOT NULL,
+            token_address TEXT NOT NULL,
+            committed BLOB NOT NULL,
+            PRIMARY KEY (account_address, token_address)
+        )
+        """
+    )
+    committed = {}
+    for from_address, token_address, amount in cursor.execute(
+        """
+        SELECT from_address, token_address, amount FROM stream
+        WHERE accrued = 0 AND from_address != to_address
+        ORDER BY id
+        """
+    ).fetchall():
+        key = (from_address, token_address)
+        committed[key] = committed.get(key, 0) + bytes32_to_int(amount)
+    cursor.executemany(
+        """
+        INSERT INTO stream_outflow (account_address, token_address, committed)
+        VALUES (?, ?, ?)
+        """,
+        [(*key, int_to_bytes32(amount)) for key, amount in committed.items()],
+    )
+
+
+def migrate_flow_tables(cursor):
+    # Left empty: the dapp fills them at boot when STREAM_ENGINE=flowrate
+    cursor.execute(
+        """
+        CREATE TABLE flow_state (
+            account_address TEXT NOT NULL,
+            token_address TEXT NOT NULL,
+            settled_timestamp INTEGER NOT NULL,
+            settled BLOB NOT NULL,
+            rate BLOB NOT NULL,
+            PRIMARY KEY (account_address, token_address)
+        )
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE flow_event (
+            account_address TEXT NOT NULL,
+            token_address TEXT NOT NULL,
+            timestamp INTEGER NOT NULL,
+            stream_id INTEGER NOT NULL,
+            rate BLOB NOT NULL,
+            amount BLOB NOT NULL
+        )
+        """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX idx_flow_event_account
+        ON flow_event(account_address, token_address, timestamp)
+        """
+    )
+    cursor.execute("CREATE INDEX idx_flow_event_stream ON flow_event(stream_id)")
+    cursor.execute(
+        """
+        CREATE TABLE flow_remainder (
+            stream_id INTEGER NOT NULL,
+            account_address TEXT NOT NULL,
+            token_address TEXT NOT NULL,
+            start_timestamp INTEGER NOT NULL,
+            end_timestamp INTEGER NOT NULL,
+            remainder BLOB NOT NULL,
+            sign INTEGER NOT NULL,
+            PRIMARY KEY (stream_id, account_address)
+        )
+        """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX idx_flow_remainder_account
+        ON flow_remainder(account_address, token_address, end_timestamp)
+        """
+    )
+
+
+def migrate_stream_live_end(cursor):
+    cursor.execute(
+        """
+        CREATE INDEX idx_stream_live_end
+        ON stream(token_address, end_timestamp)
+        WHERE accrued = 0
+        """
+    )
+
+
+def migrate_stream_archive(cursor):
+    cursor.execute(
+        """
+        CREATE TABLE stream_archive (
+            id INTEGER PRIMARY KEY,
+            from_address TEXT NOT NULL,
+            to_address TEXT NOT NULL,
+            start_timestamp INTEGER NOT NULL,
+            duration INTEGER NOT NULL,
+            amount BLOB NOT NULL,
+            token_address TEXT NOT NULL
+        )
+        """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX idx_stream_archive_from
+        ON stream_archive(from_address, token_address)
+        """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX idx_stream_archive_to
+        ON stream_archive(to_address, token_address)
+        """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX idx_stream_archivable
+        ON stream(id)
+        WHERE accrued = 1 AND swap_id IS NULL
+        """
+    )
+
+
+def migrate_address_ids(cursor):
+    # Addresses were TEXT in every table. account becomes a dictionary that
+    # gives each address an INTEGER id, and the tables are rebuilt with ids
+    # in place of addresses. Foreign keys were never enforced, so addresses
+    # that only appear in other tables get an account row too.
+    cursor.execute(
+        """
+        CREATE TABLE account_int (
+            id INTEGER PRIMARY KEY,
+            address TEXT NOT NULL UNIQUE
+        )
+        """
+    )
+    cursor.execute(
+        "INSERT INTO account_int (address) SELECT address FROM account ORDER BY rowid"
+    )
+    address_columns = {
+        "token": ["address"],
+        "balance": ["account_address", "token_address"],
+        "stream": ["from_address", "to_address", "token_address"],
+        "stream_outflow": ["account_address", "token_address"],
+        "stream_archive": ["from_address", "to_address", "token_address"],
+    }
+    for table, columns in address_columns.items():
+        for column in columns:
+            cursor.execute(
+                f"""
+                INSERT OR IGNORE INTO account_int (address)
+                SELECT {column} FROM {table} ORDER BY rowid
+                """
+            )
+
+    cursor.execute(
+        """
+        CREATE TABLE token_int (
+            id INTEGER PRIMARY KEY,
+            total_assets BLOB NOT NULL,
+            total_shares BLOB NOT NULL,
+            FOREIGN KEY (id) REFERENCES account(id)
+        )
+        """
+    )
+    cursor.execute(
+        """
+        INSERT INTO token_int (id, total_assets, total_shares)
+        SELECT a.id, t.total_assets, t.total_shares
+        FROM token t JOIN account_int a ON a.address = t.address
+        """
+    )
+
+    cursor.execute(
+        """
+        CREATE TABLE balance_int (
+            account_id INTEGER NOT NULL,
+            token_id INTEGER NOT NULL,
+            shares BLOB NOT NULL,
+            FOREIGN KEY (account_id) REFERENCES account(id),
+            FOREIGN KEY (token_id) REFERENCES token(id),
+            PRIMARY KEY (account_id, token_id)
+        ) WITHOUT ROWID
+        """
+    )
+    cursor.execute(
+        """
+        INSERT INTO balance_int (shares, account_id, token_id)
+        SELECT b.shares, a.id, t.id
+        FROM balance b
+        JOIN account_int a ON a.address = b.account_address
+        JOIN account_int t ON t.address = b.token_address
+        """
+    )
+
+    row = cursor.execute(
+        "SELECT seq FROM sqlite_sequence WHERE name = 'stream'"
+    ).fetchone()
+    cursor.execute(
+        """
+        CREATE TABLE stream_int (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            from_id INTEGER NOT NULL,
+            to_id INTEGER NOT NULL,
+            start_timestamp INTEGER NOT NULL,
+            duration INTEGER NOT NULL,
+            amount BLOB NOT NULL,
+            token_id INTEGER NOT NULL,
+            accrued INTEGER NOT NULL,
+            swap_id TEXT,
+            end_timestamp INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (token_id) REFERENCES token(id),
+            FOREIGN KEY (from_id) REFERENCES account(id),
+            FOREIGN KEY (to_id) REFERENCES account(id)
+        )
+        """
+    )
+    cursor.execute(
+        """
+        INSERT INTO stream_int (id, from_id, to_id, start_timestamp, duration, amount, token_id, accrued, swap_id, end_timestamp)
+        SELECT s.id, f.id, r.id, s.start_timestamp, s.duration, s.amount, t.id, s.accrued, s.swap_id, s.end_timestamp
+        FROM stream s
+        JOIN account_int f ON f.address = s.from_address
+        JOIN account_int r ON r.address = s.to_address
+        JOIN account_int t ON t.address = s.token_address
+        """
+    )
+
+    cursor.execute(
+        """
+        CREATE TABLE stream_outflow_int (
+            account_id INTEGER NOT NULL,
+            token_id INTEGER NOT NULL,
+            committed BLOB NOT NULL,
+            PRIMARY KEY (account_id, token_id)
+        ) WITHOUT ROWID
+        """
+    )
+    cursor.execute(
+        """
+        INSERT INTO stream_outflow_int (account_id, token_id, committed)
+        SELECT a.id, t.id, o.committed
+        FROM stream_outflow o
+        JOIN account_int a ON a.address = o.account_address
+        JOIN account_int t ON t.address = o.token_address
+        """
+    )
+
+    cursor.execute(
+        """
+        CREATE TABLE stream_archive_int (
+            id INTEGER PRIMARY KEY,
+            from_id INTEGER NOT NULL,
+            to_id INTEGER NOT NULL,
+            start_timestamp INTEGER NOT NULL,
+            duration INTEGER NOT NULL,
+            amount BLOB NOT NULL,
+            token_id INTEGER NOT NULL
+        )
+        """
+    )
+    cursor.execute(
+        """
+        INSERT INTO stream_archive_int (id, from_id, to_id, start_timestamp, duration, amount, token_id)
+        SELECT s.id, f.id, r.id, s.start_timestamp, s.duration, s.amount, t.id
+        FROM stream_archive s
+        JOIN account_int f ON f.address = s.from_address
+        JOIN account_int r ON r.address = s.to_address
+        JOIN account_int t ON t.address = s.token_address
+        """
+    )
+
+    for table in ["account", *address_columns]:
+        cursor.execute(f"DROP TABLE {table}")
+        cursor.execute(f"ALTER TABLE {table}_int RENAME TO {table}")
+    if row is not None:
+        # Keep ids of deleted streams from being handed out again
+        cursor.execute(
+            "UPDATE sqlite_sequence SET seq = ? WHERE name = 'stream'", (row[0],)
+        )
+
+    cursor.execute("CREATE INDEX idx_stream_token_id ON stream(token_id)")
+    cursor.execute("CREATE INDEX idx_stream_from_token ON stream(from_id, token_id)")
+    cursor.execute("CREATE INDEX idx_stream_to_token ON stream(to_id, token_id)")
+    cursor.execute("CREATE INDEX idx_stream_from_end ON stream(from_id, end_timestamp)")
+    cursor.execute("CREATE INDEX idx_stream_to_end ON stream(to_id, end_timestamp)")
+    cursor.execute(
+        """
+        CREATE INDEX idx_stream_live_from
+        ON stream(from_id, token_id, end_timestamp, start_timestamp, duration, amount, to_id, accrued)
+        WHERE accrued = 0
+        """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX idx_stream_live_to
+        ON stream(to_id, token_id, end_timestamp, start_timestamp, duration, amount, accrued)
+        WHERE accrued = 0
+        """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX idx_stream_live_end
+        ON stream(token_id, end_timestamp)
+        WHERE accrued = 0
+        """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX idx_stream_archivable
+        ON stream(id)
+        WHERE accrued = 1 AND swap_id IS NULL
+        """
+    )
+    cursor.execute(
+        "CREATE INDEX idx_stream_archive_from ON stream_archive(from_id, token_id)"
+    )
+    cursor.execute(
+        "CREATE INDEX idx_stream_archive_to ON stream_archive(to_id, token_id)"
+    )
+
+    # Left empty like in migrate_flow_tables: the dapp fills them at boot
+    cursor.execute("DROP TABLE flow_state")
+    cursor.execute("DROP TABLE flow_event")
+    cursor.execute("DROP TABLE flow_remainder")
+    cursor.execute(
+        """
+        CREATE TABLE flow_state (
+            account_id INTEGER NOT NULL,
+            token_id INTEGER NOT NULL,
+            settled_timestamp INTEGER NOT NULL,
+            settled BLOB NOT NULL,
+            rate BLOB NOT NULL,
+            PRIMARY KEY (account_id, token_id)
+        ) WITHOUT ROWID
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE flow_event (
+            account_id INTEGER NOT NULL,
+            token_id INTEGER NOT NULL,
+            timestamp INTEGER NOT NULL,
+            stream_id INTEGER NOT NULL,
+            rate BLOB NOT NULL,
+            amount BLOB NOT NULL
+        )
+        """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX idx_flow_event_account
+        ON flow_event(account_id, token_id, timestamp)
+        """
+    )
+    cursor.execute("CREATE INDEX idx_flow_event_stream ON flow_event(stream_id)")
+    cursor.execute(
+        """
+        CREATE TABLE flow_remainder (
+            stream_id INTEGER NOT NULL,
+            account_id INTEGER NOT NULL,
+            token_id INTEGER NOT NULL,
+            start_timestamp INTEGER NOT NULL,
+            end_timestamp INTEGER NOT NULL,
+            remainder BLOB NOT NULL,
+            sign INTEGER NOT NULL,
+            PRIMARY KEY (stream_id, account_id)
+        )
+        """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX idx_flow_remainder_account
+        ON flow_remainder(account_id, token_id, end_timestamp)
+        """
+    )
+
+    # The swap tables are not created by this schema. For databases that
+    # have them, rename their address columns and replace the values in place.
+    swap_address_columns = {
+        "pair": [
+            ("address", "token_id"),
+            ("token_0_address", "token_0_id"),
+            ("token_1_address", "token_1_id"),
+        ],
+        "swap": [("pair_address", "pair_id")],
+        "spot_price": [
+            ("pair_address", "pair_id"),
+            ("token_0_address", "token_0_id"),
+            ("token_1_address", "token_1_id"),
+        ],
+        "swap_refund": [("token_address", "token_id")],
+        "swap_execution": [
+            ("token_to_pair_address", "token_to_pair_id"),
+            ("token_from_pair_address", "token_from_pair_id"),
+        ],
+    }
+    for table, columns in swap_address_columns.items():
+        existing = {
+            row[1] for row in cursor.execute(f"PRAGMA table_info({table})").fetchall()
+        }
+        for address_column, id_column in columns:
+            if address_column not in existing:
+                continue
+            cursor.execute(
+                f"""
+                INSERT OR IGNORE INTO account (address)
+                SELECT {address_column} FROM {table}
+                WHERE {address_column} IS NOT NULL
+                """
+            )
+            cursor.execute(
+                f"ALTER TABLE {table} RENAME COLUMN {address_column} TO {id_column}"
+            )
+            cursor.execute(
+                f"""
+                UPDATE {table}
+                SET {id_column} = (SELECT id FROM account WHERE address = {id_column})
+                WHERE {id_column} IS NOT NULL
+                """
+            )
+
+
+def create_dapp_state(cursor):
+    # Named values the dapp keeps between inputs, see get_dapp_state
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS dapp_state (
+            name TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+        """
+    )
+
+
+def migrate_dapp_state(cursor):
+    cursor.execute(
+        """
+        CREATE TABLE dapp_state (
+            name TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+        """
+    )
+
+
+MIGRATIONS = [
+    migrate_stream_indexes,
+    migrate_amounts_to_blobs,
+    migrate_stream_end_timestamp,
+    migrate_stream_outflow,
+    migrate_flow_tables,
+    migrate_stream_live_end,
+    migrate_stream_archive,
+    migrate_address_ids,
+    migrate_dapp_state,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def migrate_db(conn):
+    cursor = conn.cursor()
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    if (
+        version == 0
+        and not cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stream'"
+        ).fetchone()
+    ):
+        # A brand new database file gets the latest schema directly
+        create_schema(cursor)
+        conn.commit()
+        return SCHEMA_VERSION
+    # The migrations rebuild tables that others reference. As SQLite
+    # recommends, foreign keys are off while they run, and the setting can
+    # only change outside a transaction.
+    foreign_keys = cursor.execute("PRAGMA foreign_keys").fetchone()[0]
+    if foreign_keys and version < SCHEMA_VERSION:
+        conn.commit()
+        cursor.execute("PRAGMA foreign_keys = OFF")
+    for migration in MIGRATIONS[version:]:
+        migration(cursor)
+        version += 1
+        cursor.execute(f"PRAGMA user_version = {version}")
+        conn.commit()
+    if foreign_keys:
+        cursor.execute("PRAGMA foreign_keys = ON")
+    return version
 
 
 if __name__ == "__main__":
@@ -0,0 +1,162 @@
+import json
+import os
+import unittest
+import sys
+from unittest.mock import Mock
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from eth_abi import encode
+
+from dapp.actions import ACTION_FORMAT_VERSION, decode_action, encode_action
+from dapp.db import close_connection_manager, get_connection_manager
+from dapp.handlers import handle_advance
+from dapp.rollup import RollupClient, set_rollup_client
+from dapp.streamrebasetoken import StreamRebaseToken
+from dapp.util import checksum_address
+from sqlite import initialise_db
+
+TOKEN = "0x1234567890abcdEf1234567890abcDEf12345673"
+ADMIN = checksum_address("0x" + "ad" * 20)
+INPUT_BOX_WRAPPER = checksum_address("0x" + "1b" * 20)
+YIELD_BRIDGE = checksum_address("0x" + "b1" * 20)
+SENDER = checksum_address("0x" + "5e" * 20)
+RECEIVER = checksum_address("0x" + "7e" * 20)
+
+
+class TestActionEncoding(unittest.TestCase):
+    def test_decodes_abi_encoded_args(self):
+        cases = [
+            (
+                "stream",
+                ["address", "address", "uint256", "uint64", "uint64"],
+                [TOKEN, RECEIVER, 2**256 - 1, 3600, 2**64 - 1],
+                ["token", "receiver", "amount", "duration", "start"],
+            ),
+            (
+                "withdraw",
+                ["address", "uint256", "address"],
+                [TOKEN, 10**18, SENDER],
+                ["token", "amount", "recipient"],
+            ),
+            (
+                "cancel_stream",
+                ["address", "uint64"],
+                [TOKEN, 7],
+                ["token", "stream_id"],
+            ),
+        ]
+        for selector, (method, types, values, names) in enumerate(cases, start=1):
+            encoded = bytes([ACTION_FORMAT_VERSION, selector]) + encode(types, values)
+            action = decode_action(encoded)
+            self.assertEqual(
+                action, {"method": method, "args": dict(zip(names, values))}
+            )
+            self.assertEqual(encode_action(method, action["args"]), encoded)
+
+    def test_rejects_malformed_actions(self):
+        stream = encode_action(
+            "stream",
+            {
+                "token": TOKEN,
+                "receiver": RECEIVER,
+                "amount": 1,
+                "duration": 1,
+                "start": 0,
+            },
+        )
+        dirty_address = bytearray(stream)
+        dirty_address[2] = 1
+        too_long_duration = bytearray(stream)
+        too_long_duration[2 + 3 * 32 + 23] = 1
+        for encoded in (
+            b"",
+            b"\x01",
+            b"\x02" + stream[1:],
+            b"\x01\x09" + stream[2:],
+            stream[:-1],
+            stream + b"\x00",
+            bytes(dirty_address),
+            bytes(too_long_duration),
+        ):
+            with self.assertRaises(ValueError):
+                decode_action(encoded)
+
+
+class TestBinaryActionAdvance(unittest.TestCase):
+    def setUp(self):
+        os.environ["DB_FILE_PATH"] = "test-dapp.sqlite"
+        initialise_db()
+        self.session = Mock()
+        self.session.post.return_value.status_code = 200
+        set_rollup_client(RollupClient(session=self.session))
+        for method, arg, value in (
+            ("claim_admin", "admin", ADMIN),
+            ("set_input_box_wrapper", "input_box_wrapper", INPUT_BOX_WRAPPER),
+            ("set_yield_bridge", "yield_bridge", YIELD_BRIDGE),
+        ):
+            action = json.dumps({"method": method, "args": {arg: value}})
+            self.assertEqual(self.advance(ADMIN, action.encode(), ADMIN), "accept")
+        with get_connection_manager().advance() as connection:
+            StreamRebaseToken(connection, TOKEN).mint_assets(1000, SENDER)
+
+    def tearDown(self):
+        close_connection_manager()
+        set_rollup_client(None)
+
+    def advance(self, sender, action, msg_sender=INPUT_BOX_WRAPPER, timestamp=100):
+        payload = encode(
+            ["address", "address[]", "uint256[]", "bytes"], [sender, [], [], action]
+        )
+        return handle_advance(
+            {
+                "metadata": {
+                    "msg_sender": msg_sender,
+                    "epoch_index": 0,
+                    "input_index": 1,
+                    "block_number": 1,
+                    "timestamp": timestamp,
+                },
+                "payload": "0x" + payload.hex(),
+            }
+        )
+
+    def balance(self, wallet, timestamp):
+        with get_connection_manager().inspect() as connection:
+            return StreamRebaseToken(connection, TOKEN).balance_of(wallet, timestamp)
+
+    def test_binary_and_json_actions_agree(self):
+        args = {
+            "token": TOKEN,
+            "receiver": RECEIVER,
+            "amount": 300,
+            "duration": 100,
+            "start": 100,
+        }
+        json_action = json.dumps(
+            {"method": "stream", "args": {k: str(v) for k, v in args.items()}}
+        ).encode()
+        self.assertEqual(self.advance(SENDER, encode_action("stream", args)), "accept")
+        self.assertEqual(self.advance(SENDER, json_action), "accept")
+        self.assertEqual(self.balance(RECEIVER, 150), 300)
+        self.assertEqual(self.balance(SENDER, 200), 400)
+
+        status = self.advance(
+            SENDER, encode_action("cancel_stream", {"token": TOKEN, "stream_id": 1})
+        )
+        self.assertEqual(status, "accept")
+        self.assertEqual(self.balance(RECEIVER, 200), 300)
+
+        withdraw = encode_action(
+            "withdraw", {"token": TOKEN, "amount": 100, "recipient": SENDER}
+        )
+        self.assertEqual(self.advance(SENDER, withdraw), "accept")
+        self.assertEqual(self.balance(SENDER, 200), 600)
+        voucher = self.session.post.call_args_list[-2]
+        self.assertTrue(voucher.args[0].endswith("/voucher"))
+
+        self.assertEqual(self.advance(SENDER, b"\x01\x09"), "reject")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+DAPP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Budgets for everything the dapp imports before its first /finish, and for
+# its resident memory at that point. The machine has 128Mi of RAM in total.
+# They depend on the machine running the tests, so they are only checked
+# with CHECK_BOOT_BUDGET=1.
+CHECK_BOOT_BUDGET = os.getenv("CHECK_BOOT_BUDGET") == "1"
+IMPORT_BUDGET_MS = float(os.getenv("BOOT_IMPORT_BUDGET_MS", "200"))
+RSS_BUDGET_MB = float(os.getenv("BOOT_RSS_BUDGET_MB", "40"))
+# Only needed once inputs arrive, so they must not be imported at boot
+DEFERRED_MODULES = ["eth_abi", "eth_utils", "requests", "scipy", "dapp.handlers"]
+
+
+def parse_importtime(stderr):
+    """Returns (name, cumulative_us, depth) for each -X importtime line."""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports.append((name.strip(), int(cumulative), depth))
+    return imports
+
+
+def rss_mb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+class FinishRecorder(BaseHTTPRequestHandler):
+    """Stand-in rollup server that samples the dapp at its first /finish."""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        if self.path == "/finish" and not self.server.finished.is_set():
+            self.server.rss_mb = rss_mb(self.server.pid)
+            self.server.finished.set()
+        # No pending input: the dapp keeps polling without handling anything
+        self.send_response(202)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@unittest.skipUnless(os.path.exists("/proc/self/status"), "needs /proc")
+class TestBoot(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FinishRecorder)
+        self.server.daemon_threads = True
+        self.server.finished = threading.Event()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def boot(self):
+        env = dict(
+            os.environ,
+            ROLLUP_HTTP_SERVER_URL=f"http://127.0.0.1:{self.server.server_address[1]}",
+            DB_FILE_PATH=os.path.join(self.tmp.name, "dapp.sqlite"),
+        )
+        process = subprocess.Popen(
+            [sys.executable, "-X", "importtime", "-m", "dapp.dapp"],
+            cwd=DAPP_DIR,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        self.server.pid = process.pid
+        try:
+            reached = self.server.finished.wait(timeout=30)
+        finally:
+            process.kill()
+            _, stderr = process.communicate()
+        self.assertTrue(reached, f"dapp never sent /finish:\n{stderr[-2000:]}")
+        return stderr
+
+    def test_deferred_modules(self):
+        names = [name for name, _, _ in parse_importtime(self.boot())]
+        for module in DEFERRED_MODULES:
+            self.assertNotIn(module, names, f"{module} is imported at boot")
+
+    @unittest.skipUnless(CHECK_BOOT_BUDGET, "set CHECK_BOOT_BUDGET=1 to check")
+    def test_boot_budget(self):
+        imports = parse_importtime(self.boot())
+        names = [name for name, _, _ in imports]
+        # Interpreter start-up (site and what it imports) is not the dapp's
+        site = names.index("site") if "site" in names else -1
+        boot_ms = sum(us for _, us, depth in imports[site + 1 :] if depth == 0) / 1000
+        self.assertLess(boot_ms, IMPORT_BUDGET_MS, f"Boot imports took {boot_ms:.1f}ms")
+        self.assertLess(
+            self.server.rss_mb,
+            RSS_BUDGET_MB,
+            f"RSS at first finish was {self.server.rss_mb:.1f}MB",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,623 @@
+import os
+import random
+import sqlite3
+import unittest
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from dapp.addresses import get_address, get_address_id
+from dapp.db import (
+    ConnectionManager,
+    add_stream,
+    archive_accrued_streams,
+    create_account_if_not_exists,
+    get_committed_outflow,
+    get_connection,
+    get_max_end_timestamp_for_wallet,
+    get_token_total_assets,
+    get_token_total_shares,
+    get_user_shares,
+    get_wallet_endend_streams,
+    get_wallet_non_accrued_streamed_amts,
+    get_wallet_received_amount,
+    get_wallet_streamed_amount,
+    get_wallet_streams,
+    set_token_total_assets,
+    update_stream_amount_duration,
+    update_stream_amount_duration_batch,
+)
+from dapp.stream import Stream
+from dapp.streamrebasetoken import StreamRebaseToken
+from dapp.flowrate import get_flow_streamed_amount, rebuild_flows
+from sqlite import SCHEMA_VERSION, initialise_db, migrate_db
+from tests.utils import create_legacy_db, random_stream, wallet_addresses
+
+
+class TestConnectionManager(unittest.TestCase):
+    def setUp(self):
+        os.environ["DB_FILE_PATH"] = "test-dapp.sqlite"
+        initialise_db()
+        self.manager = ConnectionManager()
+        self.token_address = "0x1234567890abcdEf1234567890abcDEf12345673"
+
+    def tearDown(self):
+        self.manager.close()
+
+    def test_connection_is_reused(self):
+        with self.manager.advance() as first:
+            pass
+        with self.manager.inspect() as second:
+            pass
+        self.assertIs(first, second, "Manager should keep a single connection.")
+
+    def test_advance_commits(self):
+        with self.manager.advance() as connection:
+            set_token_total_assets(connection, self.token_address, 1000)
+
+        other = get_connection()
+        self.assertEqual(get_token_total_assets(other, self.token_address), 1000)
+        other.close()
+
+    def test_advance_rolls_back_on_error(self):
+        with self.manager.advance() as connection:
+            set_token_total_assets(connection, self.token_address, 1000)
+
+        with self.assertRaises(ValueError):
+            with self.manager.advance() as connection:
+                set_token_total_assets(connection, self.token_address, 2000)
+                raise ValueError("rejected input")
+
+        with self.manager.inspect() as connection:
+            self.assertEqual(
+                get_token_total_assets(connection, self.token_address), 1000
+            )
+
+    def test_inspect_is_read_only(self):
+        with self.manager.inspect() as connection:
+            with self.assertRaises(sqlite3.OperationalError):
+                set_token_total_assets(connection, self.token_address, 1000)
+
+        with self.manager.inspect() as connection:
+            self.assertEqual(get_token_total_assets(connection, self.token_address), 0)
+
+    def test_reads_do_not_write(self):
+        token = StreamRebaseToken(self.manager.connection, self.token_address)
+        with self.manager.inspect():
+            token.balance_of(self.token_address, 0)
+            token.get_streams(self.token_address)
+            token.get_stored_total_supply()
+
+        self.assertEqual(self.manager.connection.total_changes, 0)
+
+
+class TestUnitOfWork(unittest.TestCase):
+    def setUp(self):
+        os.environ["DB_FILE_PATH"] = "test-dapp.sqlite"
+        initialise_db()
+        self.manager = ConnectionManager()
+        self.token_address = "0x1234567890abcdEf1234567890abcDEf12345673"
+        self.sender_address = "0x1234567890ABcDeF1234567890AbcDef12345672"
+        self.receiver_address = "0xabCDEF1234567890ABcDEF1234567890aBCDeF12"
+
+    def tearDown(self):
+        self.manager.close()
+
+    def test_repeat_reads_served_from_memory(self):
+        with self.manager.advance() as connection:
+            token = StreamRebaseToken(connection, self.token_address)
+            token.mint_assets(1000, self.sender_address)
+
+        statements = []
+        with self.manager.advance() as connection:
+            connection.set_trace_callback(statements.append)
+            token = StreamRebaseToken(connection, self.token_address)
+            for _ in range(3):
+                token.get_stored_balance(self.sender_address)
+            connection.set_trace_callback(None)
+
+        selects = [
+            sql for sql in statements if "FROM token" in sql or "FROM balance" in sql
+        ]
+        self.assertEqual(len(selects), 2, "Token and balance should be read once.")
+
+    def test_flush_on_commit(self):
+        with self.manager.advance() as connection:
+            token = StreamRebaseToken(connection, self.token_address)
+            token.mint_assets(1000, self.sender_address)
+            token.mint_assets(500, self.receiver_address)
+            token.rebase(3000)
+            token.burn_assets(
+                assets_amount=1000,
+                sender=self.sender_address,
+                current_timestamp=0,
+            )
+
+        other = get_connection()
+        self.assertEqual(get_token_total_assets(other, self.token_address), 2000)
+        self.assertEqual(get_token_total_shares(other, self.token_address), 1000)
+        self.assertEqual(
+            get_user_shares(other, self.sender_address, self.token_address), 500
+        )
+        self.assertEqual(
+            get_user_shares(other, self.receiver_address, self.token_address), 500
+        )
+        other.close()
+
+    def test_rollback_drops_cache(self):
+        with self.manager.advance() as connection:
+            StreamRebaseToken(connection, self.token_address).mint_assets(
+                1000, self.sender_address
+            )
+
+        with self.assertRaises(AssertionError):
+            with self.manager.advance() as connection:
+                token = StreamRebaseToken(connection, self.token_address)
+                token.mint_assets(500, self.sender_address)
+                token.burn_assets(
+                    assets_amount=5000,
+                    sender=self.sender_address,
+                    current_timestamp=0,
+                )
+
+        self.assertIsNone(self.manager.connection.unit_of_work)
+        with self.manager.advance() as connection:
+            token = StreamRebaseToken(connection, self.token_address)
+            self.assertEqual(token.get_stored_balance(self.sender_address), 1000)
+            self.assertEqual(token.get_stored_total_supply(), 1000)
+
+    def test_registry_skips_known_addresses(self):
+        with self.manager.advance() as connection:
+            StreamRebaseToken(connection, self.token_address).mint_assets(
+                1000, self.sender_address
+            )
+        self.assertIn(self.sender_address, self.manager.connection.addresses)
+        self.assertIn(self.token_address, self.manager.registry.tokens)
+
+        statements = []
+        with self.manager.advance() as connection:
+            connection.set_trace_callback(statements.append)
+            StreamRebaseToken(connection, self.token_address).transfer(
+                receiver=self.receiver_address,
+                amount=100,
+                duration=10,
+                start_timestamp=0,
+                sender=self.sender_address,
+                current_timestamp=0,
+            )
+        self.manager.connection.set_trace_callback(None)
+
+        inserts = [
+            sql
+            for sql in statements
+            if "INSERT OR IGNORE" in sql or "INSERT INTO account" in sql
+        ]
+        self.assertEqual(
+            len(inserts), 1, "Only the new receiver account should be inserted."
+        )
+        self.assertIn(self.receiver_address, self.manager.connection.addresses)
+        self.assertGreater(self.manager.registry.skipped_upserts, 0)
+
+    def test_registry_ignores_rolled_back_addresses(self):
+        with self.assertRaises(ValueError):
+            with self.manager.advance() as connection:
+                StreamRebaseToken(connection, self.token_address).mint_assets(
+                    1000, self.sender_address
+                )
+                raise ValueError("rejected input")
+
+        self.assertNotIn(self.sender_address, self.manager.connection.addresses)
+        self.assertNotIn(self.token_address, self.manager.registry.tokens)
+
+    def test_address_ids_of_rolled_back_inputs_are_not_cached(self):
+        with self.assertRaises(ValueError):
+            with self.manager.advance() as connection:
+                sender_id = create_account_if_not_exists(
+                    connection, self.sender_address
+                )
+                raise ValueError("rejected input")
+
+        # SQLite hands the freed id out again, to another address
+        with self.manager.advance() as connection:
+            receiver_id = create_account_if_not_exists(
+                connection, self.receiver_address
+            )
+        self.assertEqual(receiver_id, sender_id)
+        connection = self.manager.connection
+        self.assertEqual(get_address(connection, receiver_id), self.receiver_address)
+        self.assertEqual(get_address_id(connection, self.receiver_address), receiver_id)
+        self.assertIsNone(get_address_id(connection, self.sender_address))
+
+    def test_address_book_matches_account_table(self):
+        with self.manager.advance() as connection:
+            token = StreamRebaseToken(connection, self.token_address)
+            token.mint_assets(1000, self.sender_address)
+            token.transfer(
+                receiver=self.receiver_address,
+                amount=100,
+                duration=10,
+                start_timestamp=0,
+                sender=self.sender_address,
+                current_timestamp=0,
+            )
+        other = get_connection()
+        for account_id, address in other.execute("SELECT id, address FROM account"):
+            self.assertEqual(get_address(self.manager.connection, account_id), address)
+            self.assertEqual(
+                get_address_id(self.manager.connection, address), account_id
+            )
+        self.assertEqual(
+            get_wallet_streams(other, self.receiver_address, self.token_address)[
+                0
+            ].from_address,
+            self.sender_address,
+        )
+        other.close()
+
+
+class TestSchema(unittest.TestCase):
+    def setUp(self):
+        os.environ["DB_FILE_PATH"] = "test-dapp.sqlite"
+        self.wallet = "0x1234567890ABcDeF1234567890AbcDef12345672"
+        self.token_address = "0x1234567890abcdEf1234567890abcDEf12345673"
+
+    def query_plan(self, connection, func, *args):
+        statements = []
+        connection.set_trace_callback(statements.append)
+        result = func(connection, *args)
+        if not isinstance(result, (int, list)):
+            list(result)
+        connection.set_trace_callback(None)
+        plan = []
+        for sql in statements:
+            rows = connection.execute("EXPLAIN QUERY PLAN " + sql).fetchall()
+            plan.extend(row[3] for row in rows)
+        return plan
+
+    def assert_uses_indexes(self, plan, indexes):
+        for detail in plan:
+            self.assertFalse(
+                detail.startswith("SCAN stream"), f"Full scan in plan: {plan}"
+            )
+        for index in indexes:
+            self.assertTrue(
+                any(index in detail for detail in plan),
+                f"{index} not used in plan: {plan}",
+            )
+
+    def test_stream_queries_use_indexes(self):
+        initialise_db()
+        connection = get_connection()
+
+        plan = self.query_plan(
+            connection,
+            get_wallet_non_accrued_streamed_amts,
+            self.wallet,
+            self.token_address,
+            100,
+        )
+        self.assert_uses_indexes(
+            plan,
+            [
+                "COVERING INDEX idx_stream_live_from",
+                "COVERING INDEX idx_stream_live_to",
+            ],
+        )
+
+        plan = self.query_plan(
+            connection,
+            get_wallet_streamed_amount,
+            self.wallet,
+            self.token_address,
+            100,
+            50,
+        )
+        self.assert_uses_indexes(
+            plan,
+            [
+                "COVERING INDEX idx_stream_live_from",
+                "COVERING INDEX idx_stream_live_to",
+            ],
+        )
+
+        plan = self.query_plan(
+            connection, get_wallet_endend_streams, self.wallet, self.token_address, 100
+        )
+        self.assert_uses_indexes(plan, ["idx_stream_live_from", "idx_stream_live_to"])
+
+        plan = self.query_plan(
+            connection, get_wallet_streams, self.wallet, self.token_address
+        )
+        self.assert_uses_indexes(plan, ["idx_stream_from_token", "idx_stream_to_token"])
+
+        plan = self.query_plan(
+            connection,
+            get_wallet_received_amount,
+            self.wallet,
+            self.token_address,
+            100,
+        )
+        self.assert_uses_indexes(plan, ["COVERING INDEX idx_stream_live_to"])
+
+        plan = self.query_plan(
+            connection, get_max_end_timestamp_for_wallet, self.wallet
+        )
+        self.assert_uses_indexes(
+            plan,
+            [
+                "SEARCH stream USING COVERING INDEX idx_stream_from_end",
+                "SEARCH stream USING COVERING INDEX idx_stream_to_end",
+                "SEARCH stream_archive USING INDEX idx_stream_archive_from",
+                "SEARCH stream_archive USING INDEX idx_stream_archive_to",
+            ],
+        )
+        connection.close()
+
+    def test_migrate_legacy_db_with_uint256_amounts(self):
+        # Above 2**255 an amount only decodes right as unsigned
+        amount = 2**255 + 5
+        connection = create_legacy_db()
+        connection.execute(
+            """
+            INSERT INTO stream (from_address, to_address, start_timestamp, duration, amount, token_address, accrued)
+            VALUES (?, ?, 0, 100, ?, ?, 0)
+            """,
+            (self.wallet, self.token_address, str(amount), self.token_address),
+        )
+        connection.commit()
+
+        self.assertEqual(migrate_db(connection), SCHEMA_VERSION)
+        self.assertEqual(
+            get_committed_outflow(connection, self.wallet, self.token_address), amount
+        )
+        [stream] = get_wallet_streams(connection, self.wallet, self.token_address)
+        self.assertEqual(stream.amount, amount)
+        connection.close()
+
+    def test_migrate_legacy_db(self):
+        connection = create_legacy_db()
+        connection.execute(
+            "INSERT INTO token (address, total_assets, total_shares) VALUES (?, ?, ?)",
+            (self.token_address, "3000", "1500"),
+        )
+        connection.execute(
+            "INSERT INTO balance (shares, account_address, token_address) VALUES (?, ?, ?)",
+            ("1500", self.wallet, self.token_address),
+        )
+        connection.executemany(
+            """
+            INSERT INTO stream (id, from_address, to_address, start_timestamp, duration, amount, token_address, accrued)
+            VALUES (?, ?, ?, 0, 100, ?, ?, 0)
+            """,
+            [
+                (1, self.wallet, self.token_address, "1000", self.token_address),
+                (7, self.token_address, self.wallet, str(2**200), self.token_address),
+            ],
+        )
+        connection.execute("DELETE FROM stream WHERE id = 7")
+        connection.commit()
+
+        self.assertEqual(migrate_db(connection), SCHEMA_VERSION)
+        self.assertEqual(
+            connection.execute("PRAGMA user_version").fetchone()[0], SCHEMA_VERSION
+        )
+        indexes = {
+            row[0]
+            for row in connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'stream'"
+            )
+        }
+        self.assertNotIn("idx_stream_accrued", indexes)
+        self.assertIn("idx_stream_live_from", indexes)
+        self.assertIn("idx_stream_from_end", indexes)
+        self.assertEqual(
+            connection.execute("SELECT id, end_timestamp FROM stream").fetchall(),
+            [(1, 100)],
+        )
+        self.assertEqual(get_max_end_timestamp_for_wallet(connection, self.wallet), 100)
+        self.assertEqual(
+            sum(
+                get_wallet_non_accrued_streamed_amts(
+                    connection, self.wallet, self.token_address, 50, 50
+                )
+            ),
+            -500,
+        )
+        self.assertEqual(get_token_total_assets(connection, self.token_address), 3000)
+        self.assertEqual(get_token_total_shares(connection, self.token_address), 1500)
+        self.assertEqual(
+            get_user_shares(connection, self.wallet, self.token_address), 1500
+        )
+        self.assertEqual(
+            get_committed_outflow(connection, self.wallet, self.token_address), 1000
+        )
+        rebuild_flows(connection)
+        self.assertEqual(
+            get_flow_streamed_amount(connection, self.wallet, self.token_address, 50),
+            -500,
+        )
+        self.assertEqual(
+            connection.execute("SELECT DISTINCT typeof(amount) FROM stream").fetchall(),
+            [("blob",)],
+        )
+        # Deleted stream ids are not reused after the stream table is rebuilt
+        self.assertEqual(
+            connection.execute(
+                "SELECT seq FROM sqlite_sequence WHERE name = 'stream'"
+            ).fetchone()[0],
+            7,
+        )
+        self.assertEqual(archive_accrued_streams(connection, 10), 0)
+        # Addresses with no account row, as in this database, get an id too
+        self.assertEqual(
+            [
+                (stream.from_address, stream.to_address, stream.token_address)
+                for stream in get_wallet_streams(
+                    connection, self.wallet, self.token_address
+                )
+            ],
+            [(self.wallet, self.token_address, self.token_address)],
+        )
+        self.assertEqual(
+            connection.execute(
+                "SELECT DISTINCT typeof(from_id), typeof(token_id) FROM stream"
+            ).fetchall(),
+            [("integer", "integer")],
+        )
+        self.assertEqual(
+            connection.execute("PRAGMA integrity_check").fetchall(), [("ok",)]
+        )
+        # Migrating an up to date database is a no-op
+        self.assertEqual(migrate_db(connection), SCHEMA_VERSION)
+        connection.close()
+
+    def test_end_timestamp_follows_duration(self):
+        initialise_db()
+        connection = get_connection()
+        ids = [
+            add_stream(
+                connection,
+                Stream(
+                    stream_id="",
+                    from_address=self.wallet,
+                    to_address=self.token_address,
+                    start_timestamp=start,
+                    duration=100,
+                    amount=1000,
+                    token_address=self.token_address,
+                    accrued=False,
+                ),
+            )
+            for start in (10, 20, 30)
+        ]
+        self.assertEqual(get_max_end_timestamp_for_wallet(connection, self.wallet), 130)
+
+        update_stream_amount_duration(connection, ids[2], 5, 50)
+        update_stream_amount_duration_batch(connection, [(0, 0, ids[0])])
+        self.assertEqual(
+            connection.execute(
+                "SELECT id, end_timestamp FROM stream ORDER BY id"
+            ).fetchall(),
+            [(ids[0], 10), (ids[1], 120), (ids[2], 35)],
+        )
+        self.assertEqual(get_max_end_timestamp_for_wallet(connection, self.wallet), 120)
+        self.assertEqual(
+            [
+                stream.id
+                for stream in get_wallet_endend_streams(
+                    connection, self.wallet, self.token_address, 35
+                )
+            ],
+            [ids[0], ids[2]],
+        )
+        connection.close()
+
+
+class TestStreamedAmount(unittest.TestCase):
+    def setUp(self):
+        os.environ["DB_FILE_PATH"] = "test-dapp.sqlite"
+        initialise_db()
+        self.connection = get_connection()
+        self.wallets = wallet_addresses(5)
+        self.tokens = wallet_addresses(2, first=0xA0)
+
+    def tearDown(self):
+        self.connection.close()
+
+    def reference_streamed(self, streams, wallet, token, until, recipient_until):
+        # Semantics of the original OR query and per-row generator
+        total = 0
+        for stream in streams:
+            if stream.token_address != token or stream.accrued:
+                continue
+            if wallet not in (stream.from_address, stream.to_address):
+                continue
+            if stream.start_timestamp > until:
+                continue
+            is_recipient = stream.to_address == wallet
+            streamed = stream.streamed_amt(recipient_until if is_recipient else until)
+            total += streamed if is_recipient else -streamed
+        return total
+
+    def test_aggregate_matches_generator(self):
+        rng = random.Random(6)
+        streams = []
+        for _ in range(400):
+            stream = random_stream(
+                rng,
+                rng.choice(self.tokens),
+                self.wallets,
+                max_amount=2**200,
+                accrued_ratio=0.2,
+                edge_cases=True,
+            )
+            add_stream(self.connection, stream)
+            streams.append(stream)
+
+        for _ in range(300):
+            wallet = rng.choice(self.wallets)
+            token = rng.choice(self.tokens)
+            until = rng.randrange(-10, 1600)
+            recipient_until = rng.choice([until, rng.randrange(-10, 1600)])
+            expected = self.reference_streamed(
+                streams, wallet, token, until, recipient_until
+            )
+            self.assertEqual(
+                sum(
+                    get_wallet_non_accrued_streamed_amts(
+                        self.connection, wallet, token, until, recipient_until
+                    )
+                ),
+                expected,
+            )
+            self.assertEqual(
+                get_wallet_streamed_amount(
+                    self.connection, wallet, token, until, recipient_until
+                ),
+                expected,
+            )
+
+
+class TestPlainConnection(unittest.TestCase):
+    """dapp.db and StreamRebaseToken also work on a plain sqlite3 connection."""
+
+    def setUp(self):
+        os.environ["DB_FILE_PATH"] = "test-dapp.sqlite"
+        initialise_db()
+        self.connection = sqlite3.connect(os.environ["DB_FILE_PATH"])
+        self.token_address = "0x1234567890abcdEf1234567890abcDEf12345673"
+        self.wallets = wallet_addresses(2)
+
+    def tearDown(self):
+        self.connection.close()
+
+    def test_token_operations(self):
+        token = StreamRebaseToken(self.connection, self.token_address)
+        token.mint_assets(1000, self.wallets[0])
+        token.transfer(
+            self.wallets[1], 600, 100, 10, sender=self.wallets[0], current_timestamp=0
+        )
+        self.assertEqual(token.balance_of(self.wallets[1], 60), 300)
+        self.assertEqual(token.balance_of(self.wallets[0], 60), 700)
+        [stream] = get_wallet_streams(
+            self.connection, self.wallets[1], self.token_address
+        )
+        self.assertEqual(
+            (stream.from_address, stream.to_address, stream.token_address),
+            (self.wallets[0], self.wallets[1], self.token_address),
+        )
+        self.connection.commit()
+
+        # Nothing was cached on the connection, so another one sees the same
+        other = get_connection()
+        self.assertEqual(
+            StreamRebaseToken(other, self.token_address).balance_of(
+                self.wallets[1], 60
+            ),
+            300,
+        )
+        other.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,156 @@
+import os
+import random
+import unittest
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from dapp.db import (
+    get_connection,
+    get_wallet_streamed_amount,
+    stream_test,
+    sync_flow_tables,
+)
+from dapp.flowrate import get_flow_streamed_amount, rebuild_flows
+from dapp.streamrebasetoken import StreamRebaseToken
+from dapp.util import checksum_address
+from sqlite import initialise_db
+
+TOKEN = "0x1234567890abcdEf1234567890abcDEf12345673"
+WALLETS = [checksum_address("0x" + f"{i:02x}" * 20) for i in range(1, 5)]
+
+
+class TestFlowRate(unittest.TestCase):
+    def setUp(self):
+        os.environ["DB_FILE_PATH"] = "test-dapp.sqlite"
+        initialise_db()
+        self.connection = get_connection()
+        self.connection.flow_engine = True
+        self.token = StreamRebaseToken(self.connection, TOKEN)
+        for wallet in WALLETS:
+            self.token.mint_assets(10**9, wallet)
+
+    def tearDown(self):
+        self.connection.close()
+
+    def timestamps(self, now):
+        timestamps = {0, now - 1, now, now + 1, 2**40}
+        for row in self.connection.execute(
+            "SELECT start_timestamp, duration FROM stream"
+        ):
+            end = row[0] + row[1]
+            timestamps |= {row[0] - 1, row[0], end - 1, end, end + 1}
+        return sorted(t for t in timestamps if t >= 0)
+
+    def streamed(self, now):
+        return {
+            (wallet, t): get_flow_streamed_amount(self.connection, wallet, TOKEN, t)
+            for wallet in WALLETS
+            for t in self.timestamps(now)
+        }
+
+    def assertMatchesRows(self, now):
+        streamed = self.streamed(now)
+        for (wallet, t), amount in streamed.items():
+            self.assertEqual(
+                amount,
+                get_wallet_streamed_amount(self.connection, wallet, TOKEN, t, t),
+                f"{wallet} at {t}",
+            )
+            balance = self.token.balance_of(wallet, t)
+            self.connection.flow_engine = False
+            self.assertEqual(balance, self.token.balance_of(wallet, t))
+            self.connection.flow_engine = True
+        return streamed
+
+    def random_operation(self, rng, now):
+        sender, receiver = rng.sample(WALLETS, 2)
+        operation = rng.choice(["transfer", "cancel", "process", "stream_test"])
+        if operation == "transfer":
+            self.token.transfer(
+                receiver,
+                rng.choice([0, 1, 7, 1000, rng.randrange(10**6)]),
+                rng.choice([0, 1, 3, 10, rng.randrange(1, 500)]),
+                rng.choice([0, now + rng.randrange(1, 100)]),
+                sender=sender,
+                current_timestamp=now,
+            )
+        elif operation == "cancel":
+            streams = self.connection.execute(
+                """
+                SELECT stream.id, account.address FROM stream
+                JOIN account ON account.id = stream.from_id
+                WHERE accrued = 0 AND start_timestamp + duration >= ?
+                """,
+                (now,),
+            ).fetchall()
+            if streams:
+                stream_id, owner = rng.choice(streams)
+                self.token.cancel_stream(stream_id, sender=owner, current_timestamp=now)
+        elif operation == "process":
+            self.token.process_streams(sender, now)
+        else:
+            stream_test(
+                {
+                    "args": {
+                        "split_number": rng.randrange(1, 4),
+                        "amount": rng.randrange(1, 1000),
+                        "duration": rng.randrange(0, 50),
+                        "receiver": receiver,
+                        "token": TOKEN,
+                    }
+                },
+                sender,
+                now,
+                self.connection,
+            )
+
+    def test_matches_rows_under_random_operations(self):
+        rng = random.Random(21)
+        now = 100
+        for _ in range(60):
+            now += rng.randrange(0, 40)
+            self.random_operation(rng, now)
+            self.assertMatchesRows(now)
+
+        streamed = self.streamed(now)
+        rebuild_flows(self.connection)
+        self.assertEqual(self.streamed(now), streamed)
+
+    def test_rebuild_matches_engine_off_writes(self):
+        self.connection.flow_engine = False
+        rng = random.Random(5)
+        now = 100
+        for _ in range(30):
+            now += rng.randrange(0, 40)
+            self.random_operation(rng, now)
+        rebuild_flows(self.connection)
+        self.connection.flow_engine = True
+        self.assertMatchesRows(now)
+
+    def test_sync_only_rebuilds_stale_tables(self):
+        self.connection.flow_engine = False
+        rng = random.Random(8)
+        now = 100
+        for _ in range(20):
+            now += rng.randrange(0, 40)
+            self.random_operation(rng, now)
+        self.assertFalse(sync_flow_tables(self.connection))
+
+        # Turned on after streams were written without it
+        self.connection.flow_engine = True
+        self.assertTrue(sync_flow_tables(self.connection))
+        self.assertMatchesRows(now)
+        self.assertFalse(sync_flow_tables(self.connection))
+
+        # Off for a while, then on again
+        self.connection.flow_engine = False
+        self.assertFalse(sync_flow_tables(self.connection))
+        self.random_operation(rng, now)
+        self.connection.flow_engine = True
+        self.assertTrue(sync_flow_tables(self.connection))
+        self.assertMatchesRows(now)
+
+
+if __name__ == "__main__":
+    unittest.main()
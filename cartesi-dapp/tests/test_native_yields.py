@@ -13,11 +13,19 @@ from eth_utils import to_checksum_address
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 import requests
-from dapp.db import get_connection, get_dapp_addresses, get_admin
+from dapp.db import (
+    close_connection_manager,
+    get_admin,
+    get_connection,
+    get_connection_manager,
+    get_dapp_addresses,
+)
+from dapp.rollup import RollupClient, set_rollup_client
+from dapp.util import MAX_BALANCE_SERIES_POINTS
 from dapp.streamrebasetoken import StreamRebaseToken
 from sqlite import initialise_db
 from tests.utils import calculate_total_supply_token
-from dapp.handlers import handle_action
+from dapp.handlers import handle_action, handle_advance, handle_inspect
 
 # {'metadata': {'msg_sender': '0xf39fd6e51aad88f6f4ce6ab8827279cfffb92266', 'epoch_index': 0, 'input_index': 1, 'block_number': 30334, 'timestamp': 1722152540}, 'payload': '0xdeadbeef'}
 
@@ -109,6 +117,7 @@ class TestNativeYields(unittest.TestCase):
             total_supply,
             "Total supply is not equal to calculated supply.",
         )
+        self.connection.close()
 
     def claim_admin(self, address: str):
         set_admin_input = format_json_data(
@@ -243,5 +252,259 @@ class TestNativeYields(unittest.TestCase):
         self.assertEqual(balance, deposit_amount, "Balance should be 1.")
 
 
+class TestBalanceSeriesInspect(unittest.TestCase):
+    def setUp(self):
+        os.environ["DB_FILE_PATH"] = "test-dapp.sqlite"
+        initialise_db()
+        self.session = Mock()
+        self.session.post.return_value.status_code = 200
+        set_rollup_client(RollupClient(session=self.session))
+        self.token_address = generate_random_address()
+        self.sender_address = generate_random_address()
+        self.receiver_address = generate_random_address()
+        with get_connection_manager().advance() as connection:
+            token = StreamRebaseToken(connection, self.token_address)
+            token.mint_assets(1000, self.sender_address)
+            token.transfer(
+                receiver=self.receiver_address,
+                amount=700,
+                duration=90,
+                start_timestamp=10,
+                sender=self.sender_address,
+                current_timestamp=0,
+            )
+
+    def tearDown(self):
+        close_connection_manager()
+        set_rollup_client(None)
+
+    def inspect(self, payload):
+        data = {"payload": "0x" + json.dumps(payload).encode("utf-8").hex()}
+        status = handle_inspect(data)
+        report = self.session.post.call_args.kwargs["json"]["payload"]
+        return status, json.loads(bytes.fromhex(report[2:]))
+
+    def test_series_matches_balance(self):
+        timestamps = [200, 0, 55, 10, 99, 100]
+        status, report = self.inspect(
+            {
+                "data": "balance_series",
+                "token_address": self.token_address,
+                "wallet_address": self.receiver_address,
+                "timestamps": timestamps,
+            }
+        )
+        self.assertEqual(status, "accept")
+        with get_connection_manager().inspect() as connection:
+            token = StreamRebaseToken(connection, self.token_address)
+            expected = [
+                str(token.balance_of(self.receiver_address, timestamp))
+                for timestamp in timestamps
+            ]
+        self.assertEqual(json.loads(report["message"]), expected)
+        self.assertEqual(expected, ["700", "0", "350", "0", "692", "700"])
+
+    def test_series_rejects_bad_timestamps(self):
+        for timestamps in ("0", [0, "1"], list(range(MAX_BALANCE_SERIES_POINTS + 1))):
+            status, report = self.inspect(
+                {
+                    "data": "balance_series",
+                    "token_address": self.token_address,
+                    "wallet_address": self.receiver_address,
+                    "timestamps": timestamps,
+                }
+            )
+            self.assertEqual(status, "reject")
+            self.assertTrue(report["error"])
+
+
+class TestBatchAction(unittest.TestCase):
+    def setUp(self):
+        os.environ["DB_FILE_PATH"] = "test-dapp.sqlite"
+        initialise_db()
+        self.session = Mock()
+        self.session.post.return_value.status_code = 200
+        set_rollup_client(RollupClient(session=self.session))
+        self.admin_address = generate_random_address()
+        self.input_box_wrapper_address = generate_random_address()
+        self.yield_bridge_address = generate_random_address()
+        self.token_address = generate_random_address()
+        self.sender_address = generate_random_address()
+        self.receivers = [generate_random_address() for _ in range(3)]
+        self.timestamp = 1722152540
+        for method, args in (
+            ("claim_admin", {"admin": self.admin_address}),
+            (
+                "set_input_box_wrapper",
+                {"input_box_wrapper": self.input_box_wrapper_address},
+            ),
+            ("set_yield_bridge", {"yield_bridge": self.yield_bridge_address}),
+        ):
+            self.advance(self.admin_address, method, args)
+        with get_connection_manager().advance() as connection:
+            StreamRebaseToken(connection, self.token_address).mint_assets(
+                1000, self.sender_address
+            )
+
+    def tearDown(self):
+        with get_connection_manager().inspect() as connection:
+            self.assertEqual(
+                calculate_total_supply_token(connection, self.token_address),
+                StreamRebaseToken(
+                    connection, self.token_address
+                ).get_stored_total_supply(),
+            )
+        close_connection_manager()
+        set_rollup_client(None)
+
+    def advance(self, sender, method, args, msg_sender=None):
+        self.session.post.reset_mock()
+        data = {
+            "metadata": {
+                "msg_sender": msg_sender or self.input_box_wrapper_address,
+                "epoch_index": 0,
+                "input_index": 1,
+                "block_number": 1,
+                "timestamp": self.timestamp,
+            },
+            "payload": encode_input_box_wrapper_input(
+                sender, [], [], format_json_data(method, args)
+            ),
+        }
+        status = handle_advance(data)
+        report = [
+            call.kwargs["json"]["payload"]
+            for call in self.session.post.call_args_list
+            if call.args[0].endswith("/report")
+        ]
+        self.assertEqual(len(report), 1)
+        return status, json.loads(bytes.fromhex(report[0][2:]))
+
+    def posted(self, endpoint):
+        return [
+            call
+            for call in self.session.post.call_args_list
+            if call.args[0].endswith(endpoint)
+        ]
+
+    def stream_action(self, receiver, amount, duration=100):
+        return {
+            "method": "stream",
+            "args": {
+                "token": self.token_address,
+                "receiver": receiver,
+                "amount": str(amount),
+                "duration": str(duration),
+                "start": str(self.timestamp),
+            },
+        }
+
+    def balance(self, wallet, timestamp):
+        with get_connection_manager().inspect() as connection:
+            return StreamRebaseToken(connection, self.token_address).balance_of(
+                wallet, timestamp
+            )
+
+    def test_batch_reports_each_action(self):
+        actions = [self.stream_action(receiver, 200) for receiver in self.receivers]
+        actions.append(
+            {
+                "method": "withdraw",
+                "args": {
+                    "token": self.token_address,
+                    "amount": "100",
+                    "recipient": self.sender_address,
+                },
+            }
+        )
+        status, report = self.advance(
+            self.sender_address, "batch", {"actions": actions}
+        )
+        self.assertEqual(status, "accept")
+        results = json.loads(report["message"])
+        self.assertEqual([r["method"] for r in results], ["stream"] * 3 + ["withdraw"])
+        self.assertEqual(len({r["stream_id"] for r in results[:3]}), 3)
+        self.assertEqual(len(self.posted("/voucher")), 1)
+        end = self.timestamp + 100
+        self.assertEqual(self.balance(self.sender_address, end), 300)
+        for receiver in self.receivers:
+            self.assertEqual(self.balance(receiver, end), 200)
+
+        status, report = self.advance(
+            self.sender_address,
+            "batch",
+            {
+                "actions": [
+                    {
+                        "method": "cancel_stream",
+                        "args": {
+                            "token": self.token_address,
+                            "stream_id": str(results[0]["stream_id"]),
+                        },
+                    }
+                ]
+            },
+        )
+        self.assertEqual(status, "accept")
+        self.assertEqual(
+            json.loads(report["message"]),
+            [{"method": "cancel_stream", "stream_id": results[0]["stream_id"]}],
+        )
+        self.assertEqual(self.balance(self.receivers[0], end), 0)
+
+    def test_combined_outflow_is_checked(self):
+        # Each stream fits the balance on its own, not all of them together
+        actions = [self.stream_action(receiver, 400) for receiver in self.receivers]
+        status, report = self.advance(
+            self.sender_address, "batch", {"actions": actions}
+        )
+        self.assertEqual(status, "reject")
+        self.assertIn("Not enough funds", report["message"])
+        self.assertEqual(self.balance(self.sender_address, self.timestamp + 100), 1000)
+
+    def test_failed_action_rolls_back_the_batch(self):
+        actions = [
+            self.stream_action(self.receivers[0], 100),
+            {
+                "method": "withdraw",
+                "args": {
+                    "token": self.token_address,
+                    "amount": "100",
+                    "recipient": self.sender_address,
+                },
+            },
+            self.stream_action(self.sender_address, 100),
+        ]
+        status, report = self.advance(
+            self.sender_address, "batch", {"actions": actions}
+        )
+        self.assertEqual(status, "reject")
+        self.assertTrue(report["message"].startswith("Action 2 (stream) failed"))
+        self.assertEqual(self.posted("/voucher"), [])
+        self.assertEqual(self.balance(self.sender_address, self.timestamp + 100), 1000)
+        self.assertEqual(self.balance(self.receivers[0], self.timestamp + 100), 0)
+
+    def test_rejects_bad_batches(self):
+        for actions in (
+            [],
+            "stream",
+            [{"method": "batch", "args": {"token": self.token_address}}],
+            [self.stream_action(self.receivers[0], 1)] * 257,
+        ):
+            status, report = self.advance(
+                self.sender_address, "batch", {"actions": actions}
+            )
+            self.assertEqual(status, "reject")
+            self.assertTrue(report["error"])
+        # Only the input box wrapper may relay a batch
+        status, _ = self.advance(
+            self.sender_address,
+            "batch",
+            {"actions": [self.stream_action(self.receivers[0], 1)]},
+            msg_sender=self.sender_address,
+        )
+        self.assertEqual(status, "reject")
+
+
 if __name__ == "__main__":
     unittest.main()
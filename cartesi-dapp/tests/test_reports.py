@@ -0,0 +1,101 @@
+import json
+import os
+import unittest
+import sys
+from unittest.mock import Mock
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from eth_abi import encode
+from eth_utils import keccak
+
+from dapp.db import close_connection_manager
+from dapp.handlers import handle_advance
+from dapp.reports import DIGEST_BYTES, get_report_policy
+from dapp.rollup import RollupClient, set_rollup_client
+from dapp.util import checksum_address
+from sqlite import initialise_db
+
+ADMIN = checksum_address("0x" + "ad" * 20)
+
+
+def advance_request(action: dict, input_index: int = 3):
+    payload = encode(
+        ["address", "address[]", "uint256[]", "bytes"],
+        [ADMIN, [], [], json.dumps(action).encode()],
+    )
+    return {
+        "metadata": {
+            "msg_sender": ADMIN,
+            "epoch_index": 0,
+            "input_index": input_index,
+            "block_number": 1,
+            "timestamp": 100,
+        },
+        "payload": "0x" + payload.hex(),
+    }
+
+
+class TestReportPolicy(unittest.TestCase):
+    def setUp(self):
+        os.environ["DB_FILE_PATH"] = "test-dapp.sqlite"
+        initialise_db()
+        self.session = Mock()
+        self.session.post.return_value.status_code = 200
+        set_rollup_client(RollupClient(session=self.session))
+        self.claim = advance_request(
+            {"method": "claim_admin", "args": {"admin": ADMIN}}
+        )
+
+    def tearDown(self):
+        os.environ.pop("REPORT_POLICY", None)
+        close_connection_manager()
+        set_rollup_client(None)
+
+    def reports(self):
+        return [
+            json.loads(bytes.fromhex(call.kwargs["json"]["payload"][2:]))
+            for call in self.session.post.call_args_list
+            if call.args[0].endswith("/report")
+        ]
+
+    def test_full_echoes_the_request(self):
+        self.assertEqual(handle_advance(self.claim), "accept")
+        [report] = self.reports()
+        self.assertEqual(report["message"], "Success")
+        self.assertEqual(json.loads(bytes.fromhex(report["payload"][2:])), self.claim)
+
+    def test_compact_reports_a_digest(self):
+        os.environ["REPORT_POLICY"] = "compact"
+        self.assertEqual(handle_advance(self.claim), "accept")
+        [report] = self.reports()
+        self.assertFalse(report["error"])
+        self.assertEqual(
+            report["payload"],
+            {
+                "input_index": 3,
+                "status": "accept",
+                "digest": "0x"
+                + keccak(hexstr=self.claim["payload"])[:DIGEST_BYTES].hex(),
+            },
+        )
+
+    def test_none_only_reports_errors(self):
+        os.environ["REPORT_POLICY"] = "none"
+        self.assertEqual(handle_advance(self.claim), "accept")
+        self.assertEqual(self.reports(), [])
+
+        unknown = advance_request({"method": "unknown", "args": {}})
+        self.assertEqual(handle_advance(unknown), "reject")
+        [report] = self.reports()
+        self.assertTrue(report["error"])
+        self.assertEqual(report["payload"], unknown["payload"])
+
+    def test_rejects_unknown_policy(self):
+        os.environ["REPORT_POLICY"] = "verbose"
+        with self.assertRaises(ValueError):
+            get_report_policy()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+import os
+import socket
+import threading
+import unittest
+from unittest.mock import Mock
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from dapp.rollup import HTTPSession, RequestNotSent, RollupClient
+
+
+def read_request(connection) -> bytes:
+    """Body of the next HTTP request on a server-side socket."""
+    with connection.makefile("rb") as stream:
+        length = 0
+        for line in iter(stream.readline, b"\r\n"):
+            name, _, value = line.partition(b":")
+            if name.lower() == b"content-length":
+                length = int(value)
+        return stream.read(length)
+
+
+def response(status_code, body=None):
+    mock_response = Mock()
+    mock_response.status_code = status_code
+    mock_response.json.return_value = body
+    return mock_response
+
+
+class TestRollupClient(unittest.TestCase):
+    def setUp(self):
+        self.session = Mock()
+        self.sleep = Mock()
+        self.client = RollupClient(
+            url="http://rollup/",
+            session=self.session,
+            backoff_initial=0.01,
+            backoff_max=0.03,
+            max_retries=2,
+            sleep=self.sleep,
+        )
+
+    def test_finish_backs_off_while_idle(self):
+        request = {"request_type": "advance_state", "data": {}}
+        self.session.post.side_effect = [
+            response(202),
+            response(202),
+            response(202),
+            response(200, request),
+        ]
+
+        self.assertEqual(self.client.finish("reject"), request)
+        self.session.post.assert_called_with(
+            "http://rollup/finish", json={"status": "reject"}
+        )
+        self.assertEqual(self.session.post.call_count, 4)
+        self.assertEqual(
+            [call.args[0] for call in self.sleep.call_args_list], [0.01, 0.02, 0.03]
+        )
+
+    def test_helpers_share_the_session(self):
+        self.session.post.return_value = response(200)
+        self.client.report("0x01")
+        self.client.notice("0x02")
+        self.client.voucher("0xdestination", "0x03")
+
+        self.assertEqual(
+            [
+                (call.args[0], call.kwargs["json"])
+                for call in self.session.post.call_args_list
+            ],
+            [
+                ("http://rollup/report", {"payload": "0x01"}),
+                ("http://rollup/notice", {"payload": "0x02"}),
+                (
+                    "http://rollup/voucher",
+                    {"destination": "0xdestination", "payload": "0x03"},
+                ),
+            ],
+        )
+
+    def test_unsent_requests_are_retried(self):
+        self.session.post.side_effect = [RequestNotSent(), response(200)]
+        self.assertEqual(self.client.voucher("0xdestination", "0x01").status_code, 200)
+        self.assertEqual(self.sleep.call_count, 1)
+
+        self.session.post.side_effect = RequestNotSent()
+        with self.assertRaises(RequestNotSent):
+            self.client.report("0x01")
+        self.assertEqual(self.session.post.call_count, 2 + 3)
+
+    def test_sent_requests_are_not_retried(self):
+        # The server may have emitted the voucher before the connection dropped
+        for send in (
+            lambda: self.client.voucher("0xdestination", "0x01"),
+            lambda: self.client.notice("0x01"),
+            lambda: self.client.finish("accept"),
+        ):
+            self.session.post.reset_mock()
+            self.session.post.side_effect = [ConnectionError(), response(200)]
+            with self.assertRaises(ConnectionError):
+                send()
+            self.assertEqual(self.session.post.call_count, 1)
+        self.sleep.assert_not_called()
+
+
+class TestHTTPSession(unittest.TestCase):
+    def test_refused_connection_is_not_sent(self):
+        with socket.socket() as listener:
+            listener.bind(("127.0.0.1", 0))
+            port = listener.getsockname()[1]
+        with self.assertRaises(RequestNotSent):
+            HTTPSession().post(f"http://127.0.0.1:{port}/voucher", json={})
+
+    def test_dropped_connection_after_send_is_not_retryable(self):
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen()
+
+        def read_then_drop():
+            connection, _ = listener.accept()
+            connection.recv(65536)
+            connection.close()
+
+        thread = threading.Thread(target=read_then_drop)
+        thread.start()
+        port = listener.getsockname()[1]
+        with self.assertRaises(ConnectionError) as raised:
+            HTTPSession().post(f"http://127.0.0.1:{port}/voucher", json={})
+        self.assertNotIsInstance(raised.exception, RequestNotSent)
+        thread.join()
+        listener.close()
+
+    def test_idle_connection_closed_by_server_is_resent_once(self):
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen()
+        closed = threading.Event()
+        requests = []
+
+        def answer_then_close():
+            # Each connection answers one request, then the server closes it
+            for _ in range(2):
+                connection, _ = listener.accept()
+                requests.append(read_request(connection))
+                connection.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n{}")
+                connection.close()
+                closed.set()
+
+        thread = threading.Thread(target=answer_then_close)
+        thread.start()
+        url = f"http://127.0.0.1:{listener.getsockname()[1]}/notice"
+        session = HTTPSession()
+        self.assertEqual(session.post(url, json={"payload": "0x01"}).status_code, 200)
+        closed.wait()
+        self.assertEqual(session.post(url, json={"payload": "0x02"}).status_code, 200)
+        thread.join()
+        listener.close()
+        self.assertEqual(requests, [b'{"payload": "0x01"}', b'{"payload": "0x02"}'])
+
+
+if __name__ == "__main__":
+    unittest.main()
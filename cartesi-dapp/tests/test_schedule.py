@@ -0,0 +1,168 @@
+import os
+import random
+import unittest
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from dapp.db import (
+    add_stream,
+    get_connection,
+    get_wallet_streamed_amount,
+    get_wallet_streams,
+)
+from dapp.schedule import VestingSchedule
+from dapp.stream import Stream
+from dapp.streamrebasetoken import StreamRebaseToken
+from sqlite import initialise_db
+from tests.utils import random_stream, wallet_addresses
+
+TOKEN = "0x1234567890abcdEf1234567890abcDEf12345673"
+WALLETS = wallet_addresses(6)
+
+
+class TestVestingSchedule(unittest.TestCase):
+    def setUp(self):
+        os.environ["DB_FILE_PATH"] = "test-dapp.sqlite"
+        initialise_db()
+        self.connection = get_connection()
+        self.rng = random.Random(0)
+        for _ in range(300):
+            add_stream(
+                self.connection,
+                random_stream(
+                    self.rng, TOKEN, WALLETS, accrued_ratio=0.1, edge_cases=True
+                ),
+            )
+
+    def tearDown(self):
+        self.connection.close()
+
+    def assert_matches_sql(self, timestamps):
+        token = StreamRebaseToken(self.connection, TOKEN)
+        for wallet in WALLETS:
+            schedule = token.vesting_schedule(wallet)
+            for timestamp in timestamps:
+                self.assertEqual(
+                    schedule.streamed_at(timestamp),
+                    get_wallet_streamed_amount(
+                        self.connection, wallet, TOKEN, timestamp, timestamp
+                    ),
+                    f"{wallet} at {timestamp}",
+                )
+
+    def test_matches_per_stream_floor(self):
+        timestamps = [0, 2**63 - 1]
+        for stream in get_wallet_streams(self.connection, WALLETS[0], TOKEN):
+            end = stream.start_timestamp + stream.duration
+            timestamps += [stream.start_timestamp - 1, stream.start_timestamp, end]
+            timestamps += [end - 1, end + 1]
+        self.assert_matches_sql(timestamps)
+
+    def test_built_from_streams(self):
+        streams = get_wallet_streams(self.connection, WALLETS[1], TOKEN)
+        schedule = VestingSchedule(WALLETS[1], streams)
+        for timestamp in range(0, 1400, 13):
+            self.assertEqual(
+                schedule.streamed_at(timestamp),
+                get_wallet_streamed_amount(
+                    self.connection, WALLETS[1], TOKEN, timestamp, timestamp
+                ),
+            )
+
+    def test_remainders_of_long_and_short_streams(self):
+        # Short streams through the whole span and one long stream, so the
+        # longest duration reaches back past most of them
+        streams = [
+            Stream(i, WALLETS[1], WALLETS[0], 10 * i, 7, 1000 + i, TOKEN, False)
+            for i in range(100)
+        ]
+        streams.append(
+            Stream(100, WALLETS[1], WALLETS[0], 500, 300, 1001, TOKEN, False)
+        )
+        schedule = VestingSchedule(WALLETS[0], streams)
+        for timestamp in range(-5, 1200, 3):
+            self.assertEqual(
+                schedule.streamed_at(timestamp),
+                sum(
+                    stream.amount
+                    * min(max(timestamp - stream.start_timestamp, 0), stream.duration)
+                    // stream.duration
+                    for stream in streams
+                ),
+                timestamp,
+            )
+
+    def test_series_matches_balance_of(self):
+        token = StreamRebaseToken(self.connection, TOKEN)
+        token.mint_assets(10**21, WALLETS[2])
+        timestamps = [self.rng.randrange(-10, 1400) for _ in range(200)]
+        timestamps += [0, 2**63 - 1, 500, 500]
+        for wallet in WALLETS:
+            self.assertEqual(
+                token.balance_series(wallet, timestamps),
+                [token.balance_of(wallet, timestamp) for timestamp in timestamps],
+            )
+        self.assertEqual(token.balance_series(WALLETS[0], []), [])
+
+    def test_cached_schedule_follows_writes(self):
+        token = StreamRebaseToken(self.connection, TOKEN)
+        for wallet in WALLETS:
+            token.mint_assets(10**21, wallet)
+        timestamps = [0, 250, 500, 777, 1300]
+        # Warm the cache, then change streams only through the token
+        self.assert_matches_sql(timestamps)
+        for now in range(0, 1000, 50):
+            sender, receiver = self.rng.sample(WALLETS, 2)
+            token.transfer(
+                receiver=receiver,
+                amount=self.rng.randrange(1, 10**15),
+                duration=self.rng.randrange(0, 300),
+                start_timestamp=now + self.rng.randrange(0, 100),
+                sender=sender,
+                current_timestamp=now,
+            )
+            running = [
+                stream
+                for stream in token.get_streams(sender)
+                if stream.from_address == sender
+                and not stream.accrued
+                and stream.start_timestamp + stream.duration >= now
+            ]
+            # Cancelling a started stream shortens it, otherwise it is deleted
+            started = [s for s in running if s.start_timestamp < now] or running
+            if started:
+                token.cancel_stream(
+                    self.rng.choice(started).id,
+                    sender=sender,
+                    current_timestamp=now,
+                )
+            token.process_streams(self.rng.choice(WALLETS), now)
+            self.assert_matches_sql(timestamps)
+
+    def test_rollback_and_other_connections_drop_the_cache(self):
+        self.connection.commit()
+        token = StreamRebaseToken(self.connection, TOKEN)
+        before = token.vesting_schedule(WALLETS[0]).streamed_at(2000)
+
+        add_stream(
+            self.connection,
+            Stream("", WALLETS[1], WALLETS[0], 0, 0, 5, TOKEN, False),
+        )
+        self.assertEqual(
+            token.vesting_schedule(WALLETS[0]).streamed_at(2000), before + 5
+        )
+        self.connection.rollback()
+        self.assertEqual(token.vesting_schedule(WALLETS[0]).streamed_at(2000), before)
+
+        other = get_connection()
+        add_stream(other, Stream("", WALLETS[1], WALLETS[0], 0, 0, 7, TOKEN, False))
+        other.commit()
+        other.close()
+        self.assertEqual(
+            token.vesting_schedule(WALLETS[0]).streamed_at(2000), before + 7
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
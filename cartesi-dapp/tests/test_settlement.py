@@ -0,0 +1,325 @@
+import json
+import os
+import unittest
+import sys
+from unittest.mock import Mock, patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from eth_abi import encode
+
+from dapp.db import (
+    archive_accrued_streams,
+    close_connection_manager,
+    get_connection,
+    get_max_end_timestamp_for_wallet,
+)
+from dapp.handlers import handle_advance
+from dapp.rollup import RollupClient, set_rollup_client
+from dapp import settlement
+from dapp.settlement import get_settlement_interval, settle_tokens
+from dapp.stream import Stream
+from dapp.streamrebasetoken import StreamRebaseToken
+from dapp.util import checksum_address
+from sqlite import initialise_db
+
+TOKEN = "0x1234567890abcdEf1234567890abcDEf12345673"
+ADMIN = checksum_address("0x" + "ad" * 20)
+WALLETS = [checksum_address("0x" + f"{i:02x}" * 20) for i in range(1, 5)]
+
+
+def advance_request(action: dict, sender=ADMIN, input_index=1, timestamp=1000):
+    payload = encode(
+        ["address", "address[]", "uint256[]", "bytes"],
+        [sender, [], [], json.dumps(action).encode()],
+    )
+    return {
+        "metadata": {
+            "msg_sender": sender,
+            "epoch_index": 0,
+            "input_index": input_index,
+            "block_number": 1,
+            "timestamp": timestamp,
+        },
+        "payload": "0x" + payload.hex(),
+    }
+
+
+def fill(connection):
+    """Ended, running, future, self and swap streams between WALLETS."""
+    token = StreamRebaseToken(connection, TOKEN)
+    for wallet in WALLETS:
+        token.mint_assets(10_000, wallet)
+    a, b, c, d = WALLETS
+    for sender, receiver, amount, start, duration in [
+        (a, b, 100, 10, 50),
+        (b, c, 70, 20, 30),
+        (c, a, 33, 0, 7),
+        (a, d, 500, 900, 200),
+        (d, b, 40, 2000, 10),
+        (a, c, 9, 100, 0),
+    ]:
+        token.transfer(
+            receiver, amount, duration, start, sender=sender, current_timestamp=0
+        )
+    token.add_stream(
+        Stream(
+            stream_id="",
+            from_address=b,
+            to_address=d,
+            start_timestamp=0,
+            duration=10,
+            amount=25,
+            token_address=TOKEN,
+            accrued=False,
+            swap_id="1",
+        )
+    )
+    return token
+
+
+def accrued_ids(connection):
+    return [
+        row[0]
+        for row in connection.execute(
+            "SELECT id FROM stream WHERE accrued = 1 ORDER BY id"
+        )
+    ]
+
+
+class TestSettleEndedStreams(unittest.TestCase):
+    def setUp(self):
+        os.environ["DB_FILE_PATH"] = "test-dapp.sqlite"
+        initialise_db()
+        self.connection = get_connection()
+        self.token = fill(self.connection)
+
+    def tearDown(self):
+        self.connection.close()
+
+    def balances(self, timestamp):
+        return [self.token.balance_of(wallet, timestamp) for wallet in WALLETS]
+
+    def test_accrues_ended_streams_without_moving_balances(self):
+        before = [self.balances(t) for t in (1000, 1100, 3000)]
+        uncommitted = self.token.uncommitted_balance(WALLETS[0], 1000)
+
+        self.assertEqual(self.token.settle_ended_streams(1000), (4, 3))
+
+        self.assertEqual(accrued_ids(self.connection), [1, 2, 3, 6])
+        self.assertEqual([self.balances(t) for t in (1000, 1100, 3000)], before)
+        self.assertEqual(self.token.uncommitted_balance(WALLETS[0], 1000), uncommitted)
+
+    def test_matches_settling_every_wallet(self):
+        self.token.settle_ended_streams(1000)
+        settled = [self.token.get_stored_balance(wallet) for wallet in WALLETS]
+
+        self.connection.close()
+        initialise_db()
+        self.connection = get_connection()
+        token = fill(self.connection)
+        for wallet in WALLETS:
+            token.process_streams(wallet, 1000)
+        self.assertEqual(
+            [token.get_stored_balance(wallet) for wallet in WALLETS], settled
+        )
+
+    def test_skips_swap_and_self_streams(self):
+        self.connection.execute("UPDATE stream SET to_id = from_id WHERE id = 6")
+        self.assertEqual(self.token.settle_ended_streams(3000), (6, 4))
+        self.assertEqual(accrued_ids(self.connection), [1, 2, 3, 4, 5, 6])
+        self.assertEqual(self.token.settle_ended_streams(3000), (0, 0))
+
+    def test_settle_tokens_reports_counts(self):
+        summary = settle_tokens(self.connection, 1000)
+        self.assertEqual(
+            {key: summary[key] for key in ("tokens", "streams", "wallets")},
+            {"tokens": 1, "streams": 4, "wallets": 3},
+        )
+        self.assertGreaterEqual(summary["elapsed_ms"], 0)
+
+
+class TestStreamArchive(unittest.TestCase):
+    def setUp(self):
+        os.environ["DB_FILE_PATH"] = "test-dapp.sqlite"
+        initialise_db()
+        self.connection = get_connection()
+        self.token = fill(self.connection)
+        self.token.settle_ended_streams(1000)
+
+    def tearDown(self):
+        os.environ.pop("ARCHIVE_BATCH_SIZE", None)
+        self.connection.close()
+
+    def history(self, wallet, **paging):
+        return [
+            vars(stream)
+            for stream in self.token.get_streams(
+                wallet, include_archived=True, **paging
+            )
+        ]
+
+    def test_moves_accrued_streams_oldest_first(self):
+        histories = {wallet: self.history(wallet) for wallet in WALLETS}
+        balances = [self.token.balance_of(wallet, 1100) for wallet in WALLETS]
+        end_timestamps = [
+            get_max_end_timestamp_for_wallet(self.connection, wallet)
+            for wallet in WALLETS
+        ]
+        future_balances = [self.token.future_balance_of(wallet) for wallet in WALLETS]
+
+        self.assertEqual(archive_accrued_streams(self.connection, 3), 3)
+        self.assertEqual(archive_accrued_streams(self.connection, 3), 1)
+        self.assertEqual(archive_accrued_streams(self.connection, 3), 0)
+
+        live = [
+            row[0]
+            for row in self.connection.execute("SELECT id FROM stream ORDER BY id")
+        ]
+        self.assertEqual(live, [4, 5, 7])
+        self.assertEqual(
+            [stream.id for stream in self.token.get_streams(WALLETS[0])], [4]
+        )
+        self.assertEqual(
+            {wallet: self.history(wallet) for wallet in WALLETS}, histories
+        )
+        self.assertEqual(
+            [self.token.balance_of(wallet, 1100) for wallet in WALLETS], balances
+        )
+        self.assertEqual(
+            [
+                get_max_end_timestamp_for_wallet(self.connection, wallet)
+                for wallet in WALLETS
+            ],
+            end_timestamps,
+        )
+        self.assertEqual(
+            [self.token.future_balance_of(wallet) for wallet in WALLETS],
+            future_balances,
+        )
+
+    def test_pages_through_history(self):
+        archive_accrued_streams(self.connection, 2)
+        history = self.history(WALLETS[0])
+        pages = []
+        after_id = 0
+        while True:
+            page = self.history(WALLETS[0], after_id=after_id, limit=2)
+            if not page:
+                break
+            pages += page
+            after_id = page[-1]["id"]
+        self.assertEqual(pages, history)
+        self.assertEqual(
+            [
+                stream.id
+                for stream in self.token.future_get_streams(
+                    WALLETS[0], 3000, include_archived=True, after_id=1, limit=2
+                )
+            ],
+            [3, 4],
+        )
+
+    def test_settlement_archives_in_batches(self):
+        os.environ["ARCHIVE_BATCH_SIZE"] = "2"
+        summary = settle_tokens(self.connection, 3000)
+        self.assertEqual((summary["streams"], summary["archived"]), (2, 2))
+        self.assertEqual(settle_tokens(self.connection, 3000)["archived"], 2)
+        self.assertEqual(settle_tokens(self.connection, 3000)["archived"], 2)
+        live = [
+            row[0]
+            for row in self.connection.execute("SELECT id FROM stream ORDER BY id")
+        ]
+        self.assertEqual(live, [7])
+
+
+class TestSettlementJob(unittest.TestCase):
+    def setUp(self):
+        os.environ["DB_FILE_PATH"] = "test-dapp.sqlite"
+        initialise_db()
+        connection = get_connection()
+        fill(connection)
+        connection.commit()
+        connection.close()
+        self.session = Mock()
+        self.session.post.return_value.status_code = 200
+        set_rollup_client(RollupClient(session=self.session))
+        claim = {"method": "claim_admin", "args": {"admin": ADMIN}}
+        self.assertEqual(handle_advance(advance_request(claim)), "accept")
+
+    def tearDown(self):
+        os.environ.pop("SETTLEMENT_INTERVAL", None)
+        close_connection_manager()
+        set_rollup_client(None)
+
+    def accrued_ids(self):
+        connection = get_connection()
+        ids = accrued_ids(connection)
+        connection.close()
+        return ids
+
+    def test_admin_action_reports_summary(self):
+        settle = {"method": "settle", "args": {"token": TOKEN}}
+        self.assertEqual(handle_advance(advance_request(settle)), "accept")
+        self.assertEqual(self.accrued_ids(), [1, 2, 3, 6])
+
+        report = self.session.post.call_args.kwargs["json"]
+        [summary] = json.loads(
+            json.loads(bytes.fromhex(report["payload"][2:]))["message"]
+        )
+        self.assertEqual((summary["streams"], summary["wallets"]), (4, 3))
+
+    def test_admin_action_is_admin_only(self):
+        settle = {"method": "settle", "args": {}}
+        self.assertEqual(
+            handle_advance(advance_request(settle, sender=WALLETS[0])), "reject"
+        )
+        self.assertEqual(self.accrued_ids(), [])
+
+    def test_interval_settles_before_the_input(self):
+        os.environ["SETTLEMENT_INTERVAL"] = "4"
+        unknown = {"method": "unknown", "args": {}}
+        handle_advance(advance_request(unknown, input_index=3))
+        self.assertEqual(self.accrued_ids(), [])
+
+        noop = {"method": "set_admin", "args": {"admin": ADMIN}}
+        self.assertEqual(handle_advance(advance_request(noop, input_index=4)), "accept")
+        self.assertEqual(self.accrued_ids(), [1, 2, 3, 6])
+
+    def test_interval_settlement_survives_a_rejected_input(self):
+        os.environ["SETTLEMENT_INTERVAL"] = "4"
+        unknown = {"method": "unknown", "args": {}}
+        self.assertEqual(
+            handle_advance(advance_request(unknown, input_index=4)), "reject"
+        )
+        self.assertEqual(self.accrued_ids(), [1, 2, 3, 6])
+
+    def test_failed_settlement_runs_on_the_next_input(self):
+        os.environ["SETTLEMENT_INTERVAL"] = "4"
+        noop = {"method": "set_admin", "args": {"admin": ADMIN}}
+        with patch.object(settlement, "settle_tokens", side_effect=RuntimeError):
+            self.assertEqual(
+                handle_advance(advance_request(noop, input_index=4)), "accept"
+            )
+        self.assertEqual(self.accrued_ids(), [])
+
+        with patch.object(
+            settlement, "settle_tokens", wraps=settle_tokens
+        ) as settle_spy:
+            self.assertEqual(
+                handle_advance(advance_request(noop, input_index=5)), "accept"
+            )
+            self.assertEqual(self.accrued_ids(), [1, 2, 3, 6])
+            # Once per multiple of the interval
+            handle_advance(advance_request(noop, input_index=6))
+            self.assertEqual(settle_spy.call_count, 1)
+
+    def test_rejects_bad_interval(self):
+        for value in ("-1", "hourly", ""):
+            os.environ["SETTLEMENT_INTERVAL"] = value
+            with self.assertRaises(ValueError):
+                get_settlement_interval()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,199 @@
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+from unittest.mock import Mock
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from eth_abi import encode
+
+from dapp.actions import encode_action
+from dapp.db import (
+    close_connection_manager,
+    get_connection,
+    get_connection_manager,
+    get_readonly_connection,
+)
+from dapp.handlers import handle_advance
+from dapp.rollup import RollupClient, set_rollup_client
+from dapp.storage import STORAGE_PROFILES, get_storage_profile
+from dapp.streamrebasetoken import StreamRebaseToken
+from dapp.util import checksum_address
+from sqlite import initialise_db
+from tests.utils import wallet_addresses
+
+TOKEN = "0x1234567890abcdEf1234567890abcDEf12345673"
+ADMIN = checksum_address("0x" + "ad" * 20)
+INPUT_BOX_WRAPPER = checksum_address("0x" + "1b" * 20)
+YIELD_BRIDGE = checksum_address("0x" + "b1" * 20)
+WALLETS = [checksum_address(wallet) for wallet in wallet_addresses(6)]
+JOURNAL_MODES = {"rollup": "memory", "indexer": "wal", "test": "memory"}
+
+
+def advance(sender, action, msg_sender=INPUT_BOX_WRAPPER, timestamp=100):
+    payload = encode(
+        ["address", "address[]", "uint256[]", "bytes"], [sender, [], [], action]
+    )
+    return handle_advance(
+        {
+            "metadata": {
+                "msg_sender": msg_sender,
+                "epoch_index": 0,
+                "input_index": 1,
+                "block_number": 1,
+                "timestamp": timestamp,
+            },
+            "payload": "0x" + payload.hex(),
+        }
+    )
+
+
+def run_inputs():
+    """Same inputs under every profile, with rejected ones in between."""
+    statuses = []
+    for method, arg, value in (
+        ("claim_admin", "admin", ADMIN),
+        ("set_input_box_wrapper", "input_box_wrapper", INPUT_BOX_WRAPPER),
+        ("set_yield_bridge", "yield_bridge", YIELD_BRIDGE),
+    ):
+        action = json.dumps({"method": method, "args": {arg: value}})
+        statuses.append(advance(ADMIN, action.encode(), ADMIN))
+    with get_connection_manager().advance() as connection:
+        token = StreamRebaseToken(connection, TOKEN)
+        for wallet in WALLETS[:3]:
+            token.mint_assets(10**6, wallet)
+    for i, wallet in enumerate(WALLETS):
+        stream = {
+            "token": TOKEN,
+            "receiver": WALLETS[(i + 1) % len(WALLETS)],
+            "amount": 10**5 * (i + 1),
+            "duration": 50 * (i + 1),
+            "start": 100 + 10 * i,
+        }
+        # The last three have no balance and are rejected
+        statuses.append(advance(wallet, encode_action("stream", stream)))
+    statuses.append(
+        advance(
+            WALLETS[0],
+            encode_action("cancel_stream", {"token": TOKEN, "stream_id": 1}),
+            timestamp=120,
+        )
+    )
+    statuses.append(
+        advance(
+            WALLETS[1],
+            encode_action(
+                "withdraw", {"token": TOKEN, "amount": 1000, "recipient": WALLETS[1]}
+            ),
+            timestamp=400,
+        )
+    )
+    return statuses
+
+
+def dump(db_file_path):
+    connection = sqlite3.connect(db_file_path)
+    tables = [
+        row[0]
+        for row in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name"
+        )
+    ]
+    content = {
+        table: sorted(connection.execute(f"SELECT * FROM {table}").fetchall())
+        for table in tables
+    }
+    integrity = connection.execute("PRAGMA integrity_check").fetchall()
+    foreign_keys = connection.execute("PRAGMA foreign_key_check").fetchall()
+    connection.close()
+    return content, integrity, foreign_keys
+
+
+class TestStorageProfiles(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.session = Mock()
+        self.session.post.return_value.status_code = 200
+        set_rollup_client(RollupClient(session=self.session))
+
+    def tearDown(self):
+        os.environ.pop("STORAGE_PROFILE", None)
+        os.environ["DB_FILE_PATH"] = "test-dapp.sqlite"
+        close_connection_manager()
+        set_rollup_client(None)
+        self.tmp.cleanup()
+
+    def use_profile(self, profile):
+        close_connection_manager()
+        os.environ["STORAGE_PROFILE"] = profile
+        os.environ["DB_FILE_PATH"] = os.path.join(self.tmp.name, f"{profile}.sqlite")
+        initialise_db()
+        return os.environ["DB_FILE_PATH"]
+
+    def test_profiles_store_the_same_database(self):
+        dumps = {}
+        for profile in STORAGE_PROFILES:
+            db_file_path = self.use_profile(profile)
+            statuses = run_inputs()
+            close_connection_manager()
+            self.assertIn("reject", statuses)
+            content, integrity, foreign_keys = dump(db_file_path)
+            self.assertEqual(integrity, [("ok",)], profile)
+            self.assertEqual(foreign_keys, [], profile)
+            dumps[profile] = (statuses, content)
+        for profile in STORAGE_PROFILES[1:]:
+            self.assertEqual(dumps[profile], dumps[STORAGE_PROFILES[0]], profile)
+
+    def test_rolls_back_a_failed_advance(self):
+        for profile in STORAGE_PROFILES:
+            self.use_profile(profile)
+            manager = get_connection_manager()
+            with self.assertRaises(RuntimeError):
+                with manager.advance() as connection:
+                    StreamRebaseToken(connection, TOKEN).mint_assets(10, WALLETS[0])
+                    raise RuntimeError("rejected")
+            with manager.inspect() as connection:
+                self.assertEqual(
+                    connection.execute("SELECT COUNT(*) FROM balance").fetchone()[0],
+                    0,
+                    profile,
+                )
+
+    def test_applies_the_profile(self):
+        for profile in STORAGE_PROFILES:
+            self.use_profile(profile)
+            connection = get_connection()
+            self.assertEqual(
+                connection.execute("PRAGMA journal_mode").fetchone()[0],
+                JOURNAL_MODES[profile],
+            )
+            self.assertEqual(
+                connection.execute("PRAGMA foreign_keys").fetchone()[0],
+                int(profile == "test"),
+            )
+            connection.close()
+
+    def test_indexer_reads_next_to_an_open_write(self):
+        self.use_profile("indexer")
+        with get_connection_manager().advance() as connection:
+            StreamRebaseToken(connection, TOKEN).mint_assets(10, WALLETS[0])
+            readonly = get_readonly_connection()
+            self.assertEqual(
+                readonly.execute("SELECT COUNT(*) FROM balance").fetchone()[0], 0
+            )
+        self.assertEqual(
+            readonly.execute("SELECT COUNT(*) FROM balance").fetchone()[0], 1
+        )
+        readonly.close()
+
+    def test_rejects_unknown_profile(self):
+        os.environ["STORAGE_PROFILE"] = "durable"
+        with self.assertRaises(ValueError):
+            get_storage_profile()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,4 +1,5 @@
 import os
+import random
 import unittest
 from unittest.mock import MagicMock, Mock, patch
 import sys
@@ -6,10 +7,31 @@ import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 import requests
-from dapp.db import get_connection, get_token_total_assets, get_token_total_shares
+from dapp.addresses import get_address_id
+from dapp.db import (
+    UnitOfWork,
+    add_stream,
+    delete_stream_by_id,
+    get_committed_outflow,
+    get_connection,
+    get_max_end_timestamp_for_wallet,
+    get_readonly_connection,
+    get_token_total_assets,
+    get_token_total_shares,
+    update_stream_accrued,
+    update_stream_amount_duration,
+)
+from dapp.hook import hook
+from dapp.stream import Stream
 from dapp.streamrebasetoken import StreamRebaseToken
+from dapp.util import assets_to_shares, bytes32_to_int, checksum_address
 from sqlite import initialise_db
-from tests.utils import calculate_total_supply_token
+from tests.utils import (
+    calculate_total_supply_token,
+    fill_random_streams,
+    random_stream,
+    wallet_addresses,
+)
 
 
 class TestStreamRebaseToken(unittest.TestCase):
@@ -42,6 +64,7 @@ class TestStreamRebaseToken(unittest.TestCase):
             total_supply,
             "Total supply is not equal to calculated supply.",
         )
+        self.connection.close()
 
     def test_initialization(self):
         total_supply = self.token.get_stored_total_supply()
@@ -342,5 +365,349 @@ class TestStreamRebaseToken(unittest.TestCase):
         )
 
 
+def process_streams_per_stream(token, account_address, current_timestamp):
+    # Settlement as it was before batching: every stream is written back
+    # before the next counterparty balance is read.
+    ended_streams = token.get_wallet_endend_streams(account_address, current_timestamp)
+    connection = token._connection
+    balance = token.get_stored_balance(account_address)
+    total_assets = get_token_total_assets(connection, token.get_address())
+    total_shares = get_token_total_shares(connection, token.get_address())
+    for stream in ended_streams:
+        token.set_stream_accrued(stream.id)
+        streamed_amount = stream.streamed_amt(current_timestamp)
+        if stream.from_address == account_address:
+            balance -= streamed_amount
+            balance_to = token.get_stored_balance(stream.to_address) + streamed_amount
+            shares = assets_to_shares(balance_to, total_shares, total_assets)
+            token.set_stored_user_shares(stream.to_address, shares)
+        if stream.to_address == account_address:
+            balance += streamed_amount
+            balance_from = (
+                token.get_stored_balance(stream.from_address) - streamed_amount
+            )
+            shares = assets_to_shares(balance_from, total_shares, total_assets)
+            token.set_stored_user_shares(stream.from_address, shares)
+
+    shares = assets_to_shares(balance, total_shares, total_assets)
+    token.set_stored_user_shares(account_address, shares)
+    hook(connection, token.get_address(), account_address, current_timestamp)
+
+
+class TestProcessStreams(unittest.TestCase):
+    def setUp(self):
+        os.environ["DB_FILE_PATH"] = "test-dapp.sqlite"
+        self.token_address = "0x1234567890abcdEf1234567890abcDEf12345673"
+        self.wallets = wallet_addresses(6)
+
+    def run_scenario(self, seed, process):
+        initialise_db()
+        connection = get_connection()
+        rng = random.Random(seed)
+        token = fill_random_streams(
+            connection, self.token_address, self.wallets, rng, 300, accrued_ratio=0.1
+        )
+        for timestamp in (300, 700, 1300):
+            for wallet in rng.sample(self.wallets, 3):
+                process(token, wallet, timestamp)
+
+        balances = connection.execute(
+            """
+            SELECT account.address, shares FROM balance
+            JOIN account ON account.id = balance.account_id
+            ORDER BY account.address
+            """
+        ).fetchall()
+        accrued = connection.execute(
+            "SELECT id, accrued FROM stream ORDER BY id"
+        ).fetchall()
+        connection.close()
+        return balances, accrued
+
+    def test_batched_settlement_matches_per_stream(self):
+        for seed in range(3):
+            expected = self.run_scenario(seed, process_streams_per_stream)
+            actual = self.run_scenario(
+                seed,
+                lambda token, wallet, timestamp: token.process_streams(
+                    wallet, timestamp
+                ),
+            )
+            self.assertEqual(actual, expected, f"Settlement differs for seed {seed}")
+            self.assertGreater(sum(accrued for _, accrued in actual[1]), 100)
+
+
+class TestBalanceOfMany(unittest.TestCase):
+    def setUp(self):
+        os.environ["DB_FILE_PATH"] = "test-dapp.sqlite"
+        initialise_db()
+        self.connection = get_connection()
+        self.token_address = "0x1234567890abcdEf1234567890abcDEf12345673"
+        self.wallets = wallet_addresses(8)
+        # The last two wallets only ever receive streams
+        self.token = fill_random_streams(
+            self.connection,
+            self.token_address,
+            self.wallets,
+            random.Random(0),
+            300,
+            senders=self.wallets[:6],
+            accrued_ratio=0.1,
+        )
+        for wallet in self.wallets[:3]:
+            self.token.process_streams(wallet, 500)
+
+    def tearDown(self):
+        self.connection.close()
+
+    def test_matches_balance_of(self):
+        for timestamp in (0, 499, 500, 750, 1300, 2**63 - 1):
+            expected = {
+                wallet: self.token.balance_of(wallet, timestamp)
+                for wallet in self.wallets
+            }
+            self.assertEqual(
+                self.token.balance_of_many(self.wallets, timestamp), expected
+            )
+            self.assertEqual(self.token.token_holder_snapshot(timestamp), expected)
+
+    def test_unknown_and_invalid_wallets(self):
+        unknown = "0x" + "ab" * 20
+        self.assertEqual(
+            self.token.balance_of_many([unknown], 500)[checksum_address(unknown)], 0
+        )
+        with self.assertRaises(ValueError):
+            self.token.balance_of_many(["not an address"], 500)
+
+    def test_sees_unit_of_work_writes(self):
+        self.connection.unit_of_work = UnitOfWork()
+        try:
+            self.token.process_streams(self.wallets[3], 1300)
+            expected = {
+                wallet: self.token.balance_of(wallet, 1300) for wallet in self.wallets
+            }
+            self.assertEqual(self.token.token_holder_snapshot(1300), expected)
+        finally:
+            self.connection.unit_of_work = None
+
+
+def future_balance_of_savepoint(token, account_address, future_timestamp=None):
+    # The projection as it was before it became read-only: run the hook in a
+    # savepoint, read the balance and roll back.
+    connection = token._connection
+    connection.execute("SAVEPOINT future_balance_of")
+    try:
+        max_timestamp = (
+            future_timestamp
+            if future_timestamp
+            else get_max_end_timestamp_for_wallet(connection, account_address)
+        )
+        hook(connection, token.get_address(), account_address, max_timestamp)
+        return token.balance_of(account_address, max_timestamp)
+    finally:
+        connection.execute("ROLLBACK TO SAVEPOINT future_balance_of")
+        connection.execute("RELEASE SAVEPOINT future_balance_of")
+
+
+def future_get_streams_savepoint(token, account_address, future_timestamp=None):
+    connection = token._connection
+    connection.execute("SAVEPOINT future_get_streams")
+    try:
+        max_timestamp = (
+            future_timestamp
+            if future_timestamp
+            else get_max_end_timestamp_for_wallet(connection, account_address)
+        )
+        hook(connection, token.get_address(), account_address, max_timestamp)
+        return token.get_streams(account_address)
+    finally:
+        connection.execute("ROLLBACK TO SAVEPOINT future_get_streams")
+        connection.execute("RELEASE SAVEPOINT future_get_streams")
+
+
+class TestFutureProjection(unittest.TestCase):
+    def setUp(self):
+        os.environ["DB_FILE_PATH"] = "test-dapp.sqlite"
+        initialise_db()
+        self.connection = get_connection()
+        self.token_address = "0x1234567890abcdEf1234567890abcDEf12345673"
+        self.wallets = wallet_addresses(6)
+        token = fill_random_streams(
+            self.connection, self.token_address, self.wallets, random.Random(0), 200
+        )
+        for wallet in self.wallets[:3]:
+            token.process_streams(wallet, 500)
+        self.connection.commit()
+        self.readonly = get_readonly_connection()
+
+    def tearDown(self):
+        self.readonly.close()
+        self.connection.close()
+
+    def assert_same_streams(self, actual, expected):
+        self.assertEqual(
+            [vars(stream) for stream in actual], [vars(stream) for stream in expected]
+        )
+
+    def test_matches_savepoint_version(self):
+        token = StreamRebaseToken(self.connection, self.token_address)
+        readonly_token = StreamRebaseToken(self.readonly, self.token_address)
+        for wallet in self.wallets:
+            for future_timestamp in (None, 0, 499, 750, 1300):
+                self.assertEqual(
+                    readonly_token.future_balance_of(wallet, future_timestamp),
+                    future_balance_of_savepoint(token, wallet, future_timestamp),
+                )
+                self.assert_same_streams(
+                    readonly_token.future_get_streams(wallet, future_timestamp),
+                    future_get_streams_savepoint(token, wallet, future_timestamp),
+                )
+
+    def test_reads_next_to_a_writer(self):
+        expected = {
+            wallet: future_balance_of_savepoint(
+                StreamRebaseToken(self.connection, self.token_address), wallet
+            )
+            for wallet in self.wallets
+        }
+        statements = []
+        self.readonly.set_trace_callback(statements.append)
+        token = StreamRebaseToken(self.readonly, self.token_address)
+
+        # The dapp holds the write lock with an uncommitted stream
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            add_stream(
+                self.connection,
+                Stream(
+                    stream_id="",
+                    from_address=self.wallets[0],
+                    to_address=self.wallets[1],
+                    start_timestamp=0,
+                    duration=0,
+                    amount=1,
+                    token_address=self.token_address,
+                    accrued=False,
+                ),
+            )
+            for wallet in self.wallets:
+                self.assertEqual(token.future_balance_of(wallet), expected[wallet])
+                token.future_get_streams(wallet)
+        finally:
+            self.connection.rollback()
+
+        self.assertTrue(statements)
+        self.assertTrue(
+            all(sql.lstrip().upper().startswith("SELECT") for sql in statements),
+            statements,
+        )
+
+
+class TestUncommittedBalance(unittest.TestCase):
+    def setUp(self):
+        os.environ["DB_FILE_PATH"] = "test-dapp.sqlite"
+        initialise_db()
+        self.connection = get_connection()
+        self.token_address = "0x1234567890abcdEf1234567890abcDEf12345673"
+        self.wallets = wallet_addresses(6)
+        self.token = StreamRebaseToken(self.connection, self.token_address)
+        self.rng = random.Random(0)
+        for wallet in self.wallets:
+            self.token.mint_assets(self.rng.randrange(10**18, 10**20), wallet)
+
+    def tearDown(self):
+        self.connection.close()
+
+    def expected_outflows(self):
+        outflows = {}
+        for from_address, amount in self.connection.execute(
+            """
+            SELECT account.address, amount FROM stream
+            JOIN account ON account.id = stream.from_id
+            WHERE token_id = ? AND accrued = 0 AND from_id != to_id
+            """,
+            (get_address_id(self.connection, self.token_address),),
+        ):
+            outflows[from_address] = outflows.get(from_address, 0) + bytes32_to_int(
+                amount
+            )
+        return outflows
+
+    def assert_consistent(self, now):
+        expected = self.expected_outflows()
+        for wallet in self.wallets:
+            self.assertEqual(
+                get_committed_outflow(self.connection, wallet, self.token_address),
+                expected.get(wallet, 0),
+            )
+            # The check _transfer used to run for a new stream ending by now
+            max_timestamp = max(
+                now, get_max_end_timestamp_for_wallet(self.connection, wallet)
+            )
+            self.assertEqual(
+                self.token.uncommitted_balance(wallet, now),
+                self.token.balance_of(wallet, max_timestamp, False, now),
+            )
+
+    def random_stream(self, now):
+        return random_stream(
+            self.rng,
+            self.token_address,
+            self.wallets,
+            starts=(now - 50, now + 100),
+            max_amount=10**17,
+            accrued_ratio=0.2,
+        )
+
+    def test_matches_stream_scan(self):
+        stream_ids = []
+        for now in range(0, 4000, 20):
+            operation = self.rng.randrange(7)
+            if operation == 0:
+                sender, receiver = self.rng.sample(self.wallets, 2)
+                try:
+                    stream_ids.append(
+                        self.token.transfer(
+                            receiver=receiver,
+                            amount=self.rng.randrange(1, 10**19),
+                            duration=self.rng.randrange(0, 300),
+                            start_timestamp=now + self.rng.randrange(0, 100),
+                            sender=sender,
+                            current_timestamp=now,
+                        )
+                    )
+                except AssertionError:
+                    pass
+            elif operation == 1:
+                stream_ids.append(add_stream(self.connection, self.random_stream(now)))
+            elif operation == 2 and stream_ids:
+                update_stream_amount_duration(
+                    self.connection,
+                    self.rng.choice(stream_ids),
+                    self.rng.randrange(0, 100),
+                    self.rng.randrange(0, 10**17),
+                )
+            elif operation == 3 and stream_ids:
+                update_stream_accrued(
+                    self.connection,
+                    self.rng.choice(stream_ids),
+                    self.rng.random() < 0.5,
+                )
+            elif operation == 4 and stream_ids:
+                stream_id = stream_ids.pop(self.rng.randrange(len(stream_ids)))
+                delete_stream_by_id(self.connection, stream_id)
+            elif operation == 5:
+                self.token.process_streams(self.rng.choice(self.wallets), now)
+            else:
+                # Rebases change share prices but not committed amounts
+                self.token.rebase(
+                    get_token_total_assets(self.connection, self.token_address)
+                    * self.rng.randrange(90, 120)
+                    // 100
+                )
+            self.assert_consistent(now)
+        self.assertGreater(len(stream_ids), 20)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,94 @@
+import os
+import sqlite3
+import unittest
+from unittest.mock import patch
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import eth_utils.address
+from eth_utils import to_checksum_address
+
+from dapp.util import (
+    ChecksumAddress,
+    address_or_raise,
+    bytes32_to_int,
+    checksum_address,
+    int_to_bytes32,
+    int_to_signed_bytes32,
+    signed_bytes32_to_int,
+    with_checksum_address,
+)
+
+
+class TestChecksumAddress(unittest.TestCase):
+    def setUp(self):
+        self.lower = "0xabcdef1234567890abcdef1234567890abcdef12"
+        self.checksummed = to_checksum_address(self.lower)
+
+    def test_checksum_address(self):
+        normalized = checksum_address(self.lower)
+        self.assertIsInstance(normalized, ChecksumAddress)
+        self.assertEqual(normalized, self.checksummed)
+        self.assertIs(checksum_address(normalized), normalized)
+        self.assertEqual(checksum_address("not an address"), "not an address")
+        self.assertEqual(checksum_address(42), 42)
+
+    def test_repeat_calls_do_not_hash(self):
+        address = "0x00000000000000000000000000000000000000ab"
+        checksum_address(address)
+        with patch.object(eth_utils.address, "keccak") as keccak:
+            checksum_address(address)
+            address_or_raise(checksum_address(address))
+            with_checksum_address(lambda *args: args)(address, 1)
+        keccak.assert_not_called()
+
+    def test_address_or_raise(self):
+        self.assertEqual(address_or_raise(self.checksummed), self.checksummed)
+        self.assertIsInstance(address_or_raise(self.checksummed), ChecksumAddress)
+        with self.assertRaises(ValueError):
+            address_or_raise(self.lower)
+        with self.assertRaises(ValueError):
+            address_or_raise("0x1234")
+
+
+class TestAmountCodecs(unittest.TestCase):
+    def test_uint256_round_trips_and_sorts(self):
+        values = [0, 1, 10**18, 2**255 - 1, 2**255, 2**256 - 1]
+        for value in values:
+            self.assertEqual(bytes32_to_int(int_to_bytes32(value)), value)
+        connection = sqlite3.connect(":memory:")
+        connection.execute("CREATE TABLE amounts (amount BLOB)")
+        connection.executemany(
+            "INSERT INTO amounts VALUES (?)",
+            [(int_to_bytes32(value),) for value in reversed(values)],
+        )
+        self.assertEqual(
+            [
+                bytes32_to_int(row[0])
+                for row in connection.execute("SELECT amount FROM amounts ORDER BY 1")
+            ],
+            values,
+        )
+        self.assertEqual(
+            bytes32_to_int(
+                connection.execute("SELECT MAX(amount) FROM amounts").fetchone()[0]
+            ),
+            2**256 - 1,
+        )
+
+    def test_uint256_rejects_negative_and_too_large(self):
+        for value in (-1, -(2**255), 2**256):
+            with self.assertRaises(ValueError):
+                int_to_bytes32(value)
+
+    def test_int256_round_trips(self):
+        for value in (0, 1, -1, 2**255 - 1, -(2**255)):
+            self.assertEqual(signed_bytes32_to_int(int_to_signed_bytes32(value)), value)
+        for value in (2**255, -(2**255) - 1):
+            with self.assertRaises(ValueError):
+                int_to_signed_bytes32(value)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,14 +1,84 @@
+import os
+
+from dapp.db import add_stream, get_connection, get_token_total_assets
+from dapp.stream import Stream
 from dapp.streamrebasetoken import StreamRebaseToken
 from dapp.util import with_checksum_address
 
 
+def wallet_addresses(count, first=1):
+    """count consecutive addresses, 0x00..01 onwards by default."""
+    return [f"0x{i:040x}" for i in range(first, first + count)]
+
+
+def random_stream(
+    rng,
+    token_address,
+    wallets,
+    senders=None,
+    starts=(0, 1000),
+    max_amount=10**18,
+    accrued_ratio=0.0,
+    edge_cases=False,
+):
+    """A stream from one of senders (default wallets) to one of wallets.
+
+    edge_cases mixes zero, one and round durations and amounts in with the
+    random ones.
+    """
+    from_address = rng.choice(wallets if senders is None else senders)
+    to_address = rng.choice(wallets)
+    start_timestamp = rng.randrange(*starts)
+    if edge_cases:
+        duration = rng.choice([0, 1, 7, rng.randrange(1, 300)])
+        amount = rng.choice([0, 1, 3600, rng.randrange(1, max_amount)])
+    else:
+        duration = rng.randrange(0, 200)
+        amount = rng.randrange(1, max_amount)
+    return Stream(
+        stream_id="",
+        from_address=from_address,
+        to_address=to_address,
+        start_timestamp=start_timestamp,
+        duration=duration,
+        amount=amount,
+        token_address=token_address,
+        accrued=accrued_ratio > 0 and rng.random() < accrued_ratio,
+    )
+
+
+def fill_random_streams(
+    connection, token_address, wallets, rng, count, senders=None, accrued_ratio=0.0
+):
+    """Mints to every sender, then adds count random streams between wallets."""
+    token = StreamRebaseToken(connection, token_address)
+    for wallet in wallets if senders is None else senders:
+        token.mint_assets(rng.randrange(1, 10**20), wallet)
+    # An uneven share price makes every conversion round
+    token.rebase(get_token_total_assets(connection, token_address) * 7 // 3)
+    for _ in range(count):
+        add_stream(
+            connection,
+            random_stream(
+                rng, token_address, wallets, senders, accrued_ratio=accrued_ratio
+            ),
+        )
+    return token
+
+
 def get_unique_addresses_for_token(connection, token_address):
     cursor = connection.cursor()
     cursor.execute(
         """
-        SELECT DISTINCT from_address FROM stream WHERE token_address = ?
+        SELECT DISTINCT a.address FROM stream s
+        JOIN account a ON a.id = s.from_id
+        JOIN account t ON t.id = s.token_id
+        WHERE t.address = ?
         UNION
-        SELECT DISTINCT to_address FROM stream WHERE token_address = ?
+        SELECT DISTINCT a.address FROM stream s
+        JOIN account a ON a.id = s.to_id
+        JOIN account t ON t.id = s.token_id
+        WHERE t.address = ?
         """,
         (token_address, token_address),
     )
@@ -16,7 +86,10 @@ def get_unique_addresses_for_token(connection, token_address):
 
     cursor.execute(
         """
-        SELECT DISTINCT account_address FROM balance WHERE token_address = ?
+        SELECT DISTINCT a.address FROM balance b
+        JOIN account a ON a.id = b.account_id
+        JOIN account t ON t.id = b.token_id
+        WHERE t.address = ?
         """,
         (token_address,),
     )
@@ -33,9 +106,12 @@ def get_pair(connection, pair_address):
     cursor = connection.cursor()
     cursor.execute(
         """
-            SELECT address, token_0_address, token_1_address, last_timestamp_processed
+            SELECT p.address, t0.address, t1.address, pair.last_timestamp_processed
             FROM pair
-            WHERE address = ?
+            JOIN account p ON p.id = pair.token_id
+            JOIN account t0 ON t0.id = pair.token_0_id
+            JOIN account t1 ON t1.id = pair.token_1_id
+            WHERE p.address = ?
             """,
         (pair_address,),
     )
@@ -52,11 +128,51 @@ def get_pair(connection, pair_address):
 
 @with_checksum_address
 def calculate_total_supply_token(connection, token_address):
-    addresses = get_unique_addresses_for_token(connection, token_address)
     token = StreamRebaseToken(connection, token_address)
     total_supply = 0
-    for wallet in [address for address in addresses]:
-        balance = token.balance_of(wallet, 2**63 - 1)
+    for balance in token.token_holder_snapshot(2**63 - 1).values():
         assert balance >= 0, "Balance cannot be negative."
         total_supply += balance
     return total_supply
+
+
+def create_legacy_db():
+    """Create the schema as it was before any migration (user_version 0)."""
+    try:
+        os.remove(os.environ["DB_FILE_PATH"])
+    except FileNotFoundError:
+        pass
+    connection = get_connection()
+    connection.executescript(
+        """
+        CREATE TABLE dapp_addresses (name TEXT PRIMARY KEY, address TEXT NOT NULL);
+        CREATE TABLE account (address TEXT PRIMARY KEY);
+        CREATE TABLE token (
+            address TEXT PRIMARY KEY,
+            total_assets TEXT NOT NULL,
+            total_shares TEXT NOT NULL
+        );
+        CREATE TABLE balance (
+            shares TEXT NOT NULL,
+            account_address TEXT NOT NULL,
+            token_address TEXT NOT NULL,
+            PRIMARY KEY (account_address, token_address)
+        );
+        CREATE TABLE stream (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            from_address TEXT NOT NULL,
+            to_address TEXT NOT NULL,
+            start_timestamp INTEGER NOT NULL,
+            duration INTEGER NOT NULL,
+            amount TEXT NOT NULL,
+            token_address TEXT NOT NULL,
+            accrued INTEGER NOT NULL,
+            swap_id TEXT
+        );
+        CREATE INDEX idx_stream_from_address ON stream(from_address);
+        CREATE INDEX idx_stream_to_address ON stream(to_address);
+        CREATE INDEX idx_stream_token_address ON stream(token_address);
+        CREATE INDEX idx_stream_accrued ON stream(accrued);
+        """
+    )
+    return connection
@@ -165,6 +165,15 @@ export const getSetYieldBridgeBody = (yieldBridgeAddress: string): `0x${string}`
     })
   );
 
+// Accrues the ended streams of one token, or of every token when omitted
+export const getSettleBody = (token?: string): `0x${string}` =>
+  hexlify(
+    JSON.stringify({
+      method: "settle",
+      args: token ? { token } : {},
+    })
+  );
+
 export const getCancelBody = (
   token: string,
   parent_id?: string,
@@ -193,6 +202,41 @@ export const getWithdrawBody = (token: string, amount: bigint, recipient: string
     })
   );
 
+// Binary actions: version byte, selector byte, then the ABI-encoded args.
+// See cartesi-dapp/dapp/actions.py.
+const ACTION_FORMAT_VERSION = 1;
+
+const binaryAction = (selector: number, types: string[], values: unknown[]): `0x${string}` =>
+  ethers.concat([
+    new Uint8Array([ACTION_FORMAT_VERSION, selector]),
+    ethers.AbiCoder.defaultAbiCoder().encode(types, values),
+  ]) as `0x${string}`;
+
+export const getStreamBinaryBody = (
+  token: string,
+  receiver: string,
+  amount: bigint,
+  duration: number,
+  start: number
+): `0x${string}` =>
+  binaryAction(1, ["address", "address", "uint256", "uint64", "uint64"], [token, receiver, amount, duration, start]);
+
+export const getWithdrawBinaryBody = (token: string, amount: bigint, recipient: string): `0x${string}` =>
+  binaryAction(2, ["address", "uint256", "address"], [token, amount, recipient]);
+
+export const getCancelBinaryBody = (token: string, streamId: bigint): `0x${string}` =>
+  binaryAction(3, ["address", "uint64"], [token, streamId]);
+
+export const getBatchBody = (
+  actions: Array<{ method: "stream" | "withdraw" | "cancel_stream"; args: Record<string, string | number> }>
+): `0x${string}` =>
+  hexlify(
+    JSON.stringify({
+      method: "batch",
+      args: { actions },
+    })
+  );
+
 export const approveErc20 = async (
   tokenAddress: string,
   amount: string,
@@ -426,6 +470,29 @@ export async function inspectBalance(walletAddress: string, tokenAddress: string
   return result.message;
 }
 
+export async function inspectBalanceSeries(walletAddress: string, tokenAddress: string, timestamps: number[]): Promise<string[]> {
+  const response = await fetch("http://localhost:8080/inspect", {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+    },
+    body: JSON.stringify({
+      data: "balance_series",
+      token_address: tokenAddress,
+      wallet_address: walletAddress,
+      timestamps: timestamps
+    }),
+  });
+
+  if (!response.ok) {
+    throw new Error(`HTTP error! status: ${response.status}`);
+  }
+
+  const data = await response.json();
+  const result = JSON.parse(ethers.toUtf8String(data.reports[0].payload));
+  return JSON.parse(result.message);
+}
+
 
 export async function increaseTime(provider: ethers.JsonRpcProvider, seconds: number) {
   await provider.send("evm_increaseTime", [seconds]);